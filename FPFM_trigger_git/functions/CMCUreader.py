@@ -4,235 +4,880 @@ import socket
 import threading
 import time
 import numpy as np
-from scipy.io import savemat, loadmat
+from scipy.io import savemat
 from datetime import datetime
-import struct
 import queue
 import os
-import errno  # 关键错误码处理
+import re
+import json
 import sys
+import multiprocessing
+try:
+    from .samplestore import SampleStore
+    from . import chunkfile
+    from .pacing import (DeadlineScheduler, clock_anchor, link_rate_limit, raise_timer_resolution,
+                         restore_timer_resolution, raise_process_priority)
+    from . import protocol
+    from .shmring import ShmRingWriter, ShmRingReader, RAW_DTYPE
+    from . import telemetry
+    from .modbus import ResponseParser, response_timeout, build_read_request
+    from .multisensor import parse_sensors, group_by_port, TickAligner
+    from .pubsub import Publisher, SUBSCRIBER_QUEUE
+    from .trackerror import TrackingMonitor, MAX_LAG_S
+except Exception:
+    from samplestore import SampleStore
+    import chunkfile
+    from pacing import (DeadlineScheduler, clock_anchor, link_rate_limit, raise_timer_resolution,
+                        restore_timer_resolution, raise_process_priority)
+    import protocol
+    from shmring import ShmRingWriter, ShmRingReader, RAW_DTYPE
+    import telemetry
+    from modbus import ResponseParser, response_timeout, build_read_request
+    from multisensor import parse_sensors, group_by_port, TickAligner
+    from pubsub import Publisher, SUBSCRIBER_QUEUE
+    from trackerror import TrackingMonitor, MAX_LAG_S
 
 
 # 配置参数
 SERIAL_PORT = 'COM5'  # recorder COM
 BAUD_RATE = 9600            # 波特率
 REQUEST_DATA = bytes.fromhex('01 03 00 00 00 01 84 0A')  # 请求指令
-SAMPLE_INTERVAL = 0.05      # 50ms采样周期
-
-SOCKET_HOST = '127.0.0.1'   # Socket主机
-SOCKET_PORT = 12345         # Socket端口
+SAMPLE_RATE = 20            # 采样率 Hz（20/50/100，受串口链路速率限制）
 
 # Allow overriding via environment variables
 _env_port = os.environ.get('FPFM_SERIAL_PORT')
 if _env_port:
     SERIAL_PORT = _env_port
+BAUD_RATE = int(os.environ.get('FPFM_BAUD_RATE', BAUD_RATE))
+SAMPLE_RATE = float(os.environ.get('FPFM_SAMPLE_RATE', SAMPLE_RATE))
+# 多传感器：'端口:从站地址' 列表，按顺序编号为通道 0,1,2…（为空则只有 SERIAL_PORT 上的从站 1）
+SENSORS = parse_sensors(os.environ.get('FPFM_SENSORS', ''), SERIAL_PORT)
+N_CHANNELS = len(SENSORS)
+# 一次请求(8字节)+应答(7字节)所需时间决定了最高采样率，9600 波特约 64 Hz；
+# 同一串口上的多个从站依次轮询，分摊这一上限
+_max_rate = link_rate_limit(BAUD_RATE) / max(len(chs) for _, chs in group_by_port(SENSORS))
+if SAMPLE_RATE > _max_rate:
+    print(f"Sample rate {SAMPLE_RATE:g} Hz exceeds the {_max_rate:.0f} Hz link limit at {BAUD_RATE} baud, clamping")
+    SAMPLE_RATE = float(int(_max_rate))
+SAMPLE_INTERVAL = 1.0 / SAMPLE_RATE  # 采样周期
+# 应答超时：按波特率计算的请求+应答传输时间加设备余量（9600 波特约 26ms），不再固定 1 秒
+READ_TIMEOUT = float(os.environ.get('FPFM_READ_TIMEOUT', 0)) or response_timeout(BAUD_RATE)
 
 # Control/shutdown settings
 CTRL_HOST = '127.0.0.1'
 CTRL_PORT = int(os.environ.get('FPFM_CTRL_PORT', '12346'))
 STOP_EVENT = threading.Event()
 
+# 共享内存环形缓冲区名称（由 launcher 设置；为空则只用 socket 传输）
+SHM_NAME = os.environ.get('FPFM_SHM_NAME', '').strip()
+# 采样方式：thread（默认，轮询线程与保存、网络在同一进程）或 process（轮询在独立子进程，
+# 经共享内存环形缓冲区把读数交给本进程，保存与网络不再影响采样时刻）
+SAMPLER_MODE = os.environ.get('FPFM_SAMPLER', 'thread').strip().lower()
+RAW_RING_CAPACITY = 1 << 14   # 子进程 -> 主进程的原始读数环，100Hz 下可缓冲约 2.7 分钟
+RAW_NO_REPLY = 0x100          # 原始读数的 flags：该通道本节拍没有应答
+DRAIN_INTERVAL_S = 0.0005     # 主进程读取原始读数环的间隔
+STATUS_INTERVAL_S = 1.0       # 子进程报告丢失截止时间、Modbus 错误计数的间隔
+# 数据 socket 可同时连接多个订阅者（run.py、监视器、外部记录程序），每个最多缓存这么多采样
+SUBSCRIBER_QUEUE = int(os.environ.get('FPFM_SUBSCRIBER_QUEUE', SUBSCRIBER_QUEUE))
+# 追踪范式的在线误差：力与目标互相关滞后的搜索范围（秒）
+TRACK_MAX_LAG_S = float(os.environ.get('FPFM_TRACK_MAX_LAG', MAX_LAG_S))
+
 SAVE_INTERVAL = 600          # 超过10分钟自动保存一次数据
+# 数据保存目录（默认 ../mat_data；基准测试等工具可用 FPFM_MAT_DIR 指向临时目录）
+MAT_DIR = os.environ.get('FPFM_MAT_DIR') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mat_data')
 MAT_FILENAME = 'sensor_data.mat'  # 保存文件名
 
+# 流式写盘：每 N 个采样追加一块到 .fpc（0 关闭，退回到定时保存 .mat）
+STREAM_ROWS = int(os.environ.get('FPFM_STREAM_ROWS', '200'))
+# fsync 策略：always（每块）/ never / 秒数（最多每隔多少秒 fsync 一次）
+FSYNC_POLICY = os.environ.get('FPFM_FSYNC', 'always')
+
+# 每个采样点的存储列：力值 uint16、trigger int16、纳秒时间戳 int64
+# sample_time_ns 为 perf_counter_ns 时钟下请求发出与应答到达的中点，
+# 通过文件中的 clock_anchor_* 换算回 Unix 时间
+SAMPLE_COLUMNS = (
+    ('sensor_data', np.uint16),
+    ('trigger_data', np.int16),
+    ('sample_time_ns', np.int64),
+    ('lateness_us', np.int32),   # 轮询相对截止时间的延迟
+    ('rtt_us', np.int32),        # 本次 Modbus 请求-应答往返时间
+)
+
+
+def sample_columns(n_channels=1):
+    """``SAMPLE_COLUMNS`` for ``n_channels`` sensors.
+
+    With more than one channel every column except ``trigger_data`` holds
+    one value per channel, i.e. is saved as a ``(rows, n_channels)`` array
+    with one row per poll tick; a channel that did not answer in a tick has
+    value 0 and ``sample_time_ns`` 0.
+    """
+    if n_channels == 1:
+        return SAMPLE_COLUMNS
+    return tuple((name, dt) if name == 'trigger_data' else (name, (dt, (n_channels,)))
+                 for name, dt in SAMPLE_COLUMNS)
+
+# 采样点序号（event_sample、mark_sample）均为同一文件 sensor_data 中的行号：流式模式下整个会话一个文件，
+# 按次保存 .mat 时从该文件的第一行算起
+# trigger 事件表：每个收到的 trigger 一行（码值、接收时间、最近的采样点序号，
+# 以及显示端请求发送的时间和实际发出的时间）。接收时间在解析出该帧时取；
+# event_batch 为同一次 recv 中排在它前面的帧数，非 0 表示它与前面的帧一起到达，
+# 接收时间只晚于真实到达时间、精度受这一批的解析时间限制
+EVENT_COLUMNS = (
+    ('event_code', np.int32),
+    ('event_time_ns', np.int64),
+    ('event_sample', np.int64),
+    ('event_request_ns', np.int64),
+    ('event_sent_ns', np.int64),
+    ('event_batch', np.int32),
+)
+# TriggerBox 应答表：每个硬件 trigger 一行，ack_time_ns 为 0 表示 TriggerBox 未应答
+ACK_COLUMNS = (
+    ('ack_seq', np.int64),
+    ('ack_code', np.int32),
+    ('ack_request_ns', np.int64),
+    ('ack_time_ns', np.int64),
+)
+# 时钟同步表：显示端每轮 ping 中 RTT 最小的估计（显示端时间、记录端减显示端的偏移、RTT）
+SYNC_COLUMNS = (
+    ('sync_client_ns', np.int64),
+    ('sync_offset_ns', np.int64),
+    ('sync_rtt_us', np.int32),
+)
+# 分段标记表：显示端经 MSG_META 报告的 block/trial 起止（标记码、序号、接收时间、发送时间、最近的采样点序号）
+MARK_COLUMNS = (
+    ('mark_code', np.int32),
+    ('mark_index', np.int32),
+    ('mark_time_ns', np.int64),
+    ('mark_sent_ns', np.int64),
+    ('mark_sample', np.int64),
+)
+MARK_CODES = {'block_start': 1, 'block_end': 2, 'trial_start': 3, 'trial_end': 4}
+# 追踪误差表：每个追踪 trial 一行（trial 序号、开始时的 trigger 码、开始时间、采样数、
+# RMSE/MAE/偏差（传感器单位）、互相关最大的滞后及其相关系数）
+TRACK_COLUMNS = (
+    ('track_trial', np.int32),
+    ('track_code', np.int32),
+    ('track_start_ns', np.int64),
+    ('track_samples', np.int32),
+    ('track_rmse', np.float64),
+    ('track_mae', np.float64),
+    ('track_bias', np.float64),
+    ('track_lag_ms', np.float64),
+    ('track_lag_r', np.float64),
+)
+# 写盘记录：每次 .mat 保存 / .fpc 块写入一行（类型、开始时间、耗时、行数、期间记录的采样数、
+# 期间 add_data 等锁的最长时间、期间采样轮询相对截止时间的最大延迟），随数据一起保存
+SAVE_COLUMNS = (
+    ('save_kind', np.int32),
+    ('save_start_ns', np.int64),
+    ('save_duration_us', np.int64),
+    ('save_rows', np.int32),
+    ('save_samples_during', np.int32),
+    ('save_max_add_wait_us', np.int32),
+    ('save_max_lateness_us', np.int32),
+)
+SAVE_KINDS = {'mat': 1, 'chunk': 2}
+# 逐条追加的稀疏表：(表名, 列)
+EVENT_TABLES = (
+    ('events', EVENT_COLUMNS),
+    ('acks', ACK_COLUMNS),
+    ('sync', SYNC_COLUMNS),
+    ('marks', MARK_COLUMNS),
+    ('tracking', TRACK_COLUMNS),
+)
+EVENT_CHUNK_ROWS = 256
+
+# 运行指标：控制端口收到 STATS 时返回 JSON 快照，控制台每 SUMMARY_INTERVAL 秒输出一行摘要
+SUMMARY_INTERVAL = float(os.environ.get('FPFM_SUMMARY_INTERVAL', '10'))
+METRICS = telemetry.Registry()
+M_POLLS = METRICS.counter('polls')
+M_SAMPLES = METRICS.counter('samples')
+M_SHORT_READS = METRICS.counter('short_reads')
+M_CRC_ERRORS = METRICS.gauge('modbus_crc_errors')
+M_RESYNCS = METRICS.gauge('modbus_resyncs')
+M_TIMEOUTS = METRICS.gauge('modbus_timeouts')
+M_STALE = METRICS.gauge('modbus_stale_replies')
+M_SERIAL_ERRORS = METRICS.counter('serial_errors')
+M_SENDS = METRICS.counter('sensor_sends')
+M_SEND_BYTES = METRICS.counter('socket_bytes_sent')
+M_QUEUE_DROPS = METRICS.counter('sensor_queue_drops')
+M_TRIGGERS = METRICS.counter('triggers')
+M_PINGS = METRICS.counter('pings')
+M_META = METRICS.counter('meta_messages')
+M_BYTES_WRITTEN = METRICS.counter('bytes_written')
+M_RTT = METRICS.histogram('poll_rtt_us')
+M_LATENESS = METRICS.histogram('poll_lateness_us')
+M_SAVE = METRICS.histogram('save_duration_us')
+M_MISSED = METRICS.gauge('missed_deadlines')
+M_QUEUE_DEPTH = METRICS.gauge('sensor_queue_depth')
+M_SUBSCRIBERS = METRICS.gauge('subscribers')
+INT32_MAX = np.iinfo(np.int32).max
+
 
 class DataRecorder:
-    def __init__(self, hand='R'):
-        self.sensor_data = []
-        self.trigger_data = []
-        self.timestamps = []
+    def __init__(self, hand='R', prefix="FinFor", stream_rows=None, fsync=None, n_channels=1):
         self.hand = hand
+        self.prefix = prefix
+        self.n_channels = n_channels
+        self.columns = sample_columns(n_channels)
+        # 流式写盘：每 stream_rows 个采样追加一个块到 .fpc 文件（0 表示只在保存时写 .mat）
+        self.stream_rows = STREAM_ROWS if stream_rows is None else int(stream_rows)
+        self.store = self._new_store()
+        self._spare = self._new_store()  # 备用缓冲区，保存时与 store 交换
+        self.tables = self._new_tables()
+        self.last_sample_ns = None
+        self.period_ns = int(1e9 / SAMPLE_RATE)
         self.lock = threading.Lock()
+        # 保存期间的采样指标：add_data 等锁的最长时间、轮询的最大延迟、累计采样数
+        self.n_added = 0
+        self.segment_base = 0  # 按次保存 .mat 时，已交换出去（写入之前文件）的采样数
+        self.add_wait_max_ns = 0
+        self.lateness_max_us = 0
+        self.save_stats = SampleStore(SAVE_COLUMNS, chunk_rows=EVENT_CHUNK_ROWS)
+        self.meta = {}  # 随数据一起保存的会话信息（采样率、丢失的截止时间等）
+        self.target_rows = {}  # 显示端发来的目标力轨迹：trial 序号 -> 轨迹
+        # 追踪 trial 的在线误差，trial 结束时即写入 tracking 表
+        self.tracking = TrackingMonitor(self.period_ns, TRACK_MAX_LAG_S, on_result=self._add_tracking)
+        # 墙上时钟锚点：每个文件一个，用于把 perf_counter 时间换算回 Unix 时间
+        wall_ns, perf_ns = clock_anchor()
+        self.meta['clock_anchor_wall_ns'] = np.int64(wall_ns)
+        self.meta['clock_anchor_perf_ns'] = np.int64(perf_ns)
         # 确保保存目录存在
-        self.mat_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mat_data')
+        self.mat_dir = MAT_DIR
         os.makedirs(self.mat_dir, exist_ok=True)
+        self.chunk_writer = None
+        if self.stream_rows > 0:
+            # 上次崩溃遗留的 .fpc 先恢复成 .mat，避免占用文件序号（其他记录程序正在写的文件会跳过）
+            chunkfile.recover(self.mat_dir)
+            self.mat_path = self.get_next_mat_filename(prefix=prefix)
+            self.chunk_writer = chunkfile.ChunkWriter(
+                os.path.splitext(self.mat_path)[0] + '.fpc', fsync=FSYNC_POLICY if fsync is None else fsync)
+            self.chunk_writer.write_block('meta', {
+                'description': np.array('Sensor data with corresponding triggers'),
+                'created': np.array(datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+                'clock_anchor_wall_ns': self.meta['clock_anchor_wall_ns'],
+                'clock_anchor_perf_ns': self.meta['clock_anchor_perf_ns'],
+            }, mode=chunkfile.MODE_REPLACE)
+            print(f"Streaming samples to {self.chunk_writer.path} every {self.stream_rows} samples")
+        self.writer = MatWriter(self)
+        self.writer.start()
+
+    def _new_store(self):
+        if self.stream_rows > 0:
+            return SampleStore(self.columns, chunk_rows=self.stream_rows)
+        return SampleStore(self.columns)
+
+    @staticmethod
+    def _new_tables():
+        return {name: SampleStore(columns, chunk_rows=EVENT_CHUNK_ROWS) for name, columns in EVENT_TABLES}
         
-    def add_data(self, sensor_value, trigger, timestamp):
+    def set_meta(self, **kwargs):
+        self.meta.update(kwargs)
+
+    def add_data(self, sensor_value, trigger, sample_time_ns, lateness_us=0, rtt_us=0):
+        t0 = time.perf_counter_ns()
         with self.lock:
-            self.sensor_data.append(sensor_value)
-            self.trigger_data.append(trigger)
-            self.timestamps.append(timestamp)
+            wait_ns = time.perf_counter_ns() - t0
+            if wait_ns > self.add_wait_max_ns:
+                self.add_wait_max_ns = wait_ns
+            self.store.append(sensor_value, trigger, sample_time_ns, lateness_us, rtt_us)
+            self.n_added += 1
+            late = lateness_us if self.n_channels == 1 else int(np.max(lateness_us))
+            if late > self.lateness_max_us:
+                self.lateness_max_us = late
+            self.last_sample_ns = sample_time_ns if self.n_channels == 1 else int(np.max(sample_time_ns))
+            full = self.chunk_writer is not None and len(self.store) >= self.stream_rows
+        self.tracking.add(sensor_value, trigger, sample_time_ns)
+        if full:
+            self.flush_chunk()
     
+    def _nearest_sample(self, t_ns):
+        # 调用方持有锁；最近的采样点：上一个已记录的采样，或（更接近时）下一个预定采样；
+        # 按次保存 .mat 时减去之前文件中的采样数，即为本段（本文件）中的行号
+        index = self.n_added - 1 - self.segment_base
+        if self.last_sample_ns is None or t_ns - self.last_sample_ns > self.period_ns // 2:
+            index += 1
+        return index
+
+    def add_event(self, code, t_ns, request_ns=0, sent_ns=0, batch=0):
+        """Record one received trigger; every code is kept, however close together."""
+        with self.lock:
+            self.tables['events'].append(code, t_ns, self._nearest_sample(t_ns), request_ns, sent_ns, batch)
+
+    def add_ack(self, seq, code, request_ns, ack_ns):
+        """Record when the TriggerBox acknowledged trigger ``seq`` (0 = no answer)."""
+        with self.lock:
+            self.tables['acks'].append(seq, code, request_ns, ack_ns)
+
+    def add_sync(self, client_ns, offset_ns, rtt_us):
+        """Record one clock offset estimate reported by the display process."""
+        with self.lock:
+            self.tables['sync'].append(client_ns, offset_ns, rtt_us)
+
+    def _add_tracking(self, result):
+        nan = float('nan')
+        with self.lock:
+            self.tables['tracking'].append(
+                result['trial'], -1 if result['code'] is None else result['code'], result['start_ns'],
+                result['samples'], *(nan if result[k] is None else result[k]
+                                     for k in ('rmse', 'mae', 'bias', 'lag_ms', 'lag_r')))
+
+    def add_meta(self, kind, fields, t_ns, sent_ns=0):
+        """Store one session metadata message from the display process (``MSG_META``).
+
+        ``mark`` messages (block/trial boundaries) become rows of the
+        ``marks`` table; ``targets`` rows are collected by trial into
+        ``target_force``; ``track`` starts the online tracking error of a
+        trial and ``track_query`` asks for it: the reply ``(kind, fields)``
+        is returned for the caller to send back.  Any other kind
+        (``calibration``, ``participant``, ...) is saved as
+        ``<kind>_<field>`` entries.  When streaming, the new entries are
+        written to the .fpc right away.
+        """
+        if kind == 'track':
+            trial = int(fields.get('trial', 0))
+            target = fields.get('target_force', self.target_rows.get(trial))
+            if target is None:
+                print(f"No target for tracking trial {trial}")
+                return None
+            self.tracking.start(trial, target, int(fields.get('t0_ns') or sent_ns or t_ns),
+                                float(fields['duration']), float(fields.get('force_scale', 1.0)),
+                                int(fields.get('channel', 0)))
+            return None
+        if kind == 'track_query':
+            trial = int(fields.get('trial', 0))
+            result = self.tracking.result(trial) or {'trial': trial, 'samples': 0}
+            code = result.get('code')
+            if code is not None:
+                result = dict(result, code_summary=self.tracking.code_summary(code))
+            return 'track_result', result
+        if kind == 'mark':
+            code = MARK_CODES.get(fields.get('mark'))
+            if code is None:
+                print(f"Unknown mark {fields.get('mark')!r}")
+                return
+            with self.lock:
+                self.tables['marks'].append(code, int(fields.get('index', 0)), t_ns, sent_ns,
+                                            self._nearest_sample(t_ns))
+            if code == MARK_CODES['trial_end']:
+                self.tracking.finish()
+            return
+        if kind == 'targets':
+            rows = np.atleast_2d(np.asarray(fields.get('target_force', ()), dtype=np.float64))
+            first = int(fields.get('trial', 0))
+            for i, row in enumerate(rows):
+                self.target_rows[first + i] = row
+            try:
+                items = {'target_force': np.vstack([self.target_rows[k] for k in sorted(self.target_rows)])}
+            except ValueError as e:
+                print(f"Target rows of different lengths, not stored: {e}")
+                return
+            if fields.get('target_seed') is not None:
+                items['target_seed'] = np.int64(fields['target_seed'])
+        else:
+            items = {}
+            for key, value in fields.items():
+                if value is None:
+                    continue
+                name = re.sub(r'\W', '_', kind if key == kind else f'{kind}_{key}')
+                arr = np.asarray(value)
+                # 嵌套的结构存为 JSON 文本
+                items[name] = np.array(json.dumps(value)) if arr.dtype.hasobject else arr
+        self.set_meta(**items)
+        if self.chunk_writer is not None and items:
+            self.writer.submit('meta', items)
+
     def get_next_mat_filename(self, prefix="FinFor"):
         today = datetime.now().strftime("%Y%m%d")
         idx = 1
         while True:
             fname = f"{prefix}{self.hand}_{today}-{idx}.mat"
             full_path = os.path.join(self.mat_dir, fname)
-            if not os.path.exists(full_path):
+            if not os.path.exists(full_path) and not os.path.exists(full_path[:-4] + '.fpc'):
                 return full_path
             idx += 1
 
-    def save_to_mat(self, filename="FinFor"):
+    def swap(self):
+        """Swap the active stores for fresh ones and return ``(samples, tables)``.
+
+        Only a reference exchange happens under the lock; returns None when
+        nothing has been recorded since the last swap.
+        """
+        spare = self._spare if self._spare is not None else self._new_store()
+        tables = self._new_tables()
         with self.lock:
-            if not self.sensor_data:
+            if not len(self.store) and not any(len(t) for t in self.tables.values()):
+                self._spare = spare
+                return None
+            full = (self.store, self.tables)
+            self.store, self.tables = spare, tables
+            if self.chunk_writer is None:
+                # 每段写入单独的 .mat 文件，之后的序号从下一个文件的第一行算起
+                self.segment_base += len(full[0])
+        self._spare = self._new_store()
+        return full
+
+    def flush_chunk(self):
+        segment = self.swap()
+        if segment is not None:
+            self.writer.submit('chunk', segment)
+
+    def save_to_mat(self, filename="FinFor", wait=False):
+        if self.chunk_writer is not None:
+            # 流式模式下数据已在 .fpc 中，这里只把当前缓冲区追加进去
+            self.flush_chunk()
+        else:
+            # 锁内只交换缓冲区，序列化与写盘交给 MatWriter 线程
+            segment = self.swap()
+            if segment is not None:
+                self.writer.submit('mat', segment, filename)
+        if wait:
+            self.writer.flush()
+
+    def close(self):
+        """Write everything still buffered and, when streaming, finalize the .fpc into one .mat."""
+        self.tracking.finish()
+        if self.tracking.codes:
+            # 每个 trigger 码下所有追踪采样合并的误差（与 tracking 表的 track_code 列区分，用 track_pooled_*）
+            codes = sorted(self.tracking.codes)
+            pooled = [self.tracking.code_summary(c) for c in codes]
+            self.set_meta(track_pooled_code=np.array(codes, dtype=np.int32),
+                          **{f'track_pooled_{k}': np.array([p[k] for p in pooled], dtype=np.float64)
+                             for k in ('samples', 'rmse', 'mae', 'bias')})
+        self.save_to_mat(filename=self.prefix, wait=True)
+        if self.chunk_writer is None:
+            return
+        # 写盘记录（包括刚才最后一块）
+        self.set_meta(**self.save_stats.arrays())
+        if self.meta:
+            # 与会话元数据的写入一样交给 MatWriter，.fpc 只由一个线程写
+            self.writer.submit('meta', {k: np.asarray(v) for k, v in self.meta.items()})
+            self.writer.flush()
+        # 整理成 .mat 之前一直持有文件锁，其他记录程序的 recover 不会同时处理它
+        self.chunk_writer.close(keep_lock=True)
+        try:
+            if os.path.getsize(self.chunk_writer.path) <= len(chunkfile.FILE_MAGIC):
+                os.remove(self.chunk_writer.path)
+                return
+            data, torn = chunkfile.load(self.chunk_writer.path)
+            if 'sensor_data' not in data:
+                os.remove(self.chunk_writer.path)
                 return
+            savemat(self.mat_path, data)
+            os.remove(self.chunk_writer.path)
+            print(f"Data saved to {self.mat_path}")
+        except Exception as e:
+            print(f"Finalize error, chunks kept in {self.chunk_writer.path}: {e}")
+        finally:
+            self.chunk_writer.unlock()
 
-            filename = self.get_next_mat_filename(prefix=filename)
-
-            # 准备保存的数据
-            data_to_save = {
-                'sensor_data': np.array(self.sensor_data),
-                'trigger_data': np.array(self.trigger_data),
-                'timestamps': np.array(self.timestamps),
-                'description': 'Sensor data with corresponding triggers',
-                'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
-            if filename.endswith("ForTra.mat"):
-                try:
-                    Tar_for = loadmat('target_force_{}.mat'.format(datetime.now().strftime("%Y%m%d")))
-                    data_to_save['target_force'] = Tar_for['target_force']
-                    print('Target force data loaded from file.')
-                except FileNotFoundError:
-                    print('Target force file not found, skipping.')
-            
-            try:
-                savemat(filename, data_to_save)
-                print(f"Data saved to {filename}")
-                
-                # 清空已保存的数据
-                self.sensor_data = []
-                self.trigger_data = []
-                self.timestamps = []
-            except Exception as e:
-                print(f"Error saving to .mat file: {e}")
+    def write_chunk(self, segment):
+        store, tables = segment
+        written = self.chunk_writer.bytes_written
+        if len(store):
+            self.chunk_writer.write_block('samples', store.arrays())
+        for name, table in tables.items():
+            if len(table):
+                self.chunk_writer.write_block(name, table.arrays())
+        M_BYTES_WRITTEN.inc(self.chunk_writer.bytes_written - written)
 
+    def write_mat(self, segment, filename="FinFor"):
+        """Serialize one swapped-out segment to the next free .mat file."""
+        filename = self.get_next_mat_filename(prefix=filename)
+        store, tables = segment
 
+        # 准备保存的数据（列数组直接交给 savemat，不再逐个转换）
+        data_to_save = store.arrays()
+        for table in tables.values():
+            data_to_save.update(table.arrays())
+        data_to_save.update({
+            'description': 'Sensor data with corresponding triggers',
+            'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        })
+        data_to_save.update(self.meta)
+        # 此前各次保存的写盘记录（本次保存的耗时只能记入下一个文件）
+        data_to_save.update(self.save_stats.arrays())
+        # 兼容旧的分析脚本：秒为单位的 Unix 时间戳
+        chunkfile.derive_timestamps(data_to_save)
 
-def serial_worker(ser, data_recorder, data_queue, sensor_queue):
-    last_sample_time = time.time()
-    current_trigger = -1
-    timestamp = time.time()
-    alpha = 0.0  # 初始化alpha
-    Kp = 0.7     # 
-    Ki = 0.1
-    error_integral = 0.0  # 积分误差初始化
-    print('****开始记录压力数据****')
-    
-    while not STOP_EVENT.is_set():
         try:
-            # 发送请求数据
-            ser.write(REQUEST_DATA)
-            
-            # 读取响应数据 (假设响应为7字节)
-            response = ser.read(7)
-            if len(response) == 7:
-                sensor_value = struct.unpack('>H', response[3:5])[0]
-                print('response:  ', response)
-                # 获取当前trigger值
-                try:
-                    current_trigger = data_queue.get_nowait()
-                except queue.Empty:
-                    pass
-                
-                # 记录数据
-                interval = time.time() - timestamp
-                timestamp = time.time()
-                data_recorder.add_data(sensor_value, current_trigger, timestamp)
-                # 新增：将最新sensor_value放入队列（非阻塞，队列满则丢弃旧的）
-                if sensor_queue.full():
-                    try:
-                        sensor_queue.get_nowait()
-                    except queue.Empty:
-                        pass
-                if not STOP_EVENT.is_set():
-                    sensor_queue.put(sensor_value)
-                
-                # 通过socket发送数据 (可选)
-                if 'socket_conn' in globals():
-                    try:
-                        globals()['socket_conn'].sendall(response)
-                    except:
-                        pass
-                
-                error = interval - SAMPLE_INTERVAL
-                error_integral += error
-                alpha += Kp * error + Ki * error_integral  # 比例-积分控制
-                alpha = min(max(alpha, -SAMPLE_INTERVAL/2), SAMPLE_INTERVAL/2)
-
-                # 控制采样频率
-                elapsed = time.time() - last_sample_time
-                sleep_time = max(0, SAMPLE_INTERVAL - elapsed - alpha)
-                time.sleep(sleep_time)
-                last_sample_time = time.time()
-                
-        except serial.SerialException as e:
-            print(f"Serial error: {e}")
-            break
+            savemat(filename, data_to_save)
+            M_BYTES_WRITTEN.inc(os.path.getsize(filename))
+            print(f"Data saved to {filename}")
         except Exception as e:
-            print(f"Error in serial worker: {e}")
+            print(f"Error saving to .mat file: {e}")
+
+
+class MatWriter(threading.Thread):
+    """Writer thread that serializes swapped-out stores off the sampling path.
+
+    Jobs are either ``'mat'`` (one .mat file per save), ``'chunk'`` (one
+    block appended to the streaming .fpc file) or ``'meta'`` (session
+    metadata written to the .fpc as it arrives).  For every 'mat' and
+    'chunk' job it records how long the write took, how many samples were
+    recorded meanwhile, the longest ``add_data`` lock wait and the worst
+    poll lateness seen during it.  The lock wait alone cannot show a
+    sampler stalled by the GIL while ``savemat`` runs; the lateness of the
+    polls made meanwhile does.  The rows (``SAVE_COLUMNS``) are kept in
+    ``save_stats`` and saved with the data.
+    """
+
+    def __init__(self, recorder):
+        super().__init__(daemon=True)
+        self.recorder = recorder
+        self.jobs = queue.Queue()
+
+    def submit(self, kind, segment, filename=None):
+        self.jobs.put((kind, segment, filename))
+
+    def flush(self):
+        self.jobs.join()
+
+    def run(self):
+        rec = self.recorder
+        while True:
+            kind, segment, filename = self.jobs.get()
+            try:
+                if kind == 'meta':
+                    rec.chunk_writer.write_block('meta', segment, mode=chunkfile.MODE_REPLACE)
+                    continue
+                with rec.lock:
+                    rec.add_wait_max_ns = 0
+                    rec.lateness_max_us = 0
+                    n0 = rec.n_added
+                t0 = time.perf_counter_ns()
+                if kind == 'chunk':
+                    rec.write_chunk(segment)
+                else:
+                    rec.write_mat(segment, filename)
+                duration_us = (time.perf_counter_ns() - t0) // 1000
+                with rec.lock:
+                    during = rec.n_added - n0
+                    wait_us = min(rec.add_wait_max_ns // 1000, INT32_MAX)
+                    late_us = min(int(rec.lateness_max_us), INT32_MAX)
+                rec.save_stats.append(SAVE_KINDS[kind], t0, duration_us, len(segment[0]), during, wait_us, late_us)
+                M_SAVE.observe(duration_us)
+                if kind == 'mat':
+                    print(f"Save took {duration_us / 1e3:.1f} ms, {during} samples recorded meanwhile, "
+                          f"max add_data wait {wait_us} us, max poll lateness {late_us / 1e3:.1f} ms")
+            except Exception as e:
+                print(f"Writer error: {e}")
+            finally:
+                self.jobs.task_done()
+
+
+
+class SampleSink:
+    """Where every reading goes: the tick aligner (recording), the display ring and the subscribers.
+
+    ``put`` gets ``value=None`` when the sensor did not answer.
+    """
+
+    def __init__(self, aligner, publisher, ring=None):
+        self.aligner = aligner
+        self.publisher = publisher
+        self.ring = ring
+        self.ring_lock = threading.Lock()  # 共享内存环只允许一个写者，多个串口线程依次写
+
+    def put(self, tick, channel, value, t_ns, lateness_us, rtt_us, flags):
+        M_POLLS.inc()
+        M_LATENESS.observe(lateness_us)
+        if value is None:
+            M_SHORT_READS.inc()
+            self.aligner.put(tick, channel, None)
+            return
+        M_SAMPLES.inc()
+        M_RTT.observe(rtt_us)
+        # 记录数据：按节拍合并成多通道行
+        self.aligner.put(tick, channel, value, t_ns, lateness_us, rtt_us)
+        if self.ring is not None:
+            with self.ring_lock:
+                self.ring.publish(tick, t_ns, value, flags)
+        # 放入每个订阅者的发送队列，由各自的线程立即推送（队列满则丢弃最旧的）
+        if not STOP_EVENT.is_set():
+            self.publisher.publish(tick, t_ns, value, flags)
 
 
-def socket_server(data_queue, sensor_queue):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+class SerialWorker(threading.Thread):
+    """Poll the sensors on one serial port on the shared deadline grid.
+
+    Each port gets its own worker, so ports are polled in parallel; the
+    sensors in ``channels`` (``(channel, slave)`` pairs on this port) are
+    polled one after the other every tick.  Every reading is handed to
+    ``sink.put`` with the tick index as sequence number and the channel
+    in the flags.  ``peers`` is the list of all workers, used to report
+    totals.
+    """
+
+    def __init__(self, ser, channels, sink, rate_hz=None, t0_ns=None, peers=None):
+        super().__init__(name=f"SerialWorker-{getattr(ser, 'port', '')}", daemon=True)
+        self.ser = ser
+        self.channels = [(channel, slave, build_read_request(slave), ResponseParser(ser, slave=slave))
+                         for channel, slave in channels]
+        self.sink = sink
+        # 按绝对截止时间 t0 + k*周期 轮询；各端口共用 t0，同一 k 即同一时刻
+        self.scheduler = DeadlineScheduler(SAMPLE_RATE if rate_hz is None else rate_hz)
+        self.t0_ns = t0_ns
+        self.peers = peers if peers is not None else [self]
+
+    @property
+    def parsers(self):
+        return [c[3] for c in self.channels]
+
+    def _update_gauges(self):
+        parsers = [p for w in self.peers for p in w.parsers]
+        M_MISSED.set(sum(w.scheduler.missed for w in self.peers))
+        M_CRC_ERRORS.set(sum(p.crc_errors for p in parsers))
+        M_RESYNCS.set(sum(p.resyncs for p in parsers))
+        M_TIMEOUTS.set(sum(p.timeouts for p in parsers))
+        M_STALE.set(sum(p.stale for p in parsers))
+
+    def run(self):
+        ser, scheduler, sink = self.ser, self.scheduler, self.sink
+        print(f'****开始记录压力数据**** {getattr(ser, "port", "")} ({scheduler.rate_hz:g} Hz, '
+              f'slave {", ".join(str(c[1]) for c in self.channels)})')
+        scheduler.start(self.t0_ns)
         try:
-            s.bind((SOCKET_HOST, SOCKET_PORT))
-            s.listen(1)
-            s.settimeout(1.0)  # 轮询停止事件
-            print(f"Socket server listening on {SOCKET_HOST}:{SOCKET_PORT}")
-            
-            conn = None
-            addr = None
             while not STOP_EVENT.is_set():
                 try:
-                    conn, addr = s.accept()
+                    deadline_ns, lateness_ns = scheduler.wait()
+                    tick = (deadline_ns - scheduler.t0_ns) // scheduler.period_ns
+                    late = protocol.FLAG_LATE if lateness_ns >= scheduler.period_ns else 0
+                    for channel, _, request, parser in self.channels:
+                        # 上一次超时后才到的应答仍在输入缓冲区中，先丢弃，否则会被当作本次的应答
+                        parser.discard_stale()
+                        # 发送请求数据（发送前与收到应答后各取一次 perf_counter）
+                        t_send = time.perf_counter_ns()
+                        ser.write(request)
+
+                        # 读取并校验应答（帧头 地址 03 02 + CRC16），错帧丢弃、超时清空输入
+                        values = parser.read()
+                        t_recv = time.perf_counter_ns()
+                        # lateness 为本次请求相对截止时间的延迟（同一总线上后面的从站包含前面的轮询时间）
+                        lateness_us = min((t_send - deadline_ns) // 1000, INT32_MAX)
+                        flags = protocol.channel_flags(channel, late)
+                        if values is None:
+                            sink.put(tick, channel, None, 0, lateness_us, 0, flags)
+                            continue
+                        # 采样时间取往返的中点
+                        sink.put(tick, channel, values[0], (t_send + t_recv) // 2, lateness_us,
+                                 min((t_recv - t_send) // 1000, INT32_MAX), flags)
+                    self._update_gauges()
+
+                except serial.SerialException as e:
+                    M_SERIAL_ERRORS.inc()
+                    print(f"Serial error: {e}")
                     break
-                except socket.timeout:
-                    continue
-            if STOP_EVENT.is_set():
+                except Exception as e:
+                    M_SERIAL_ERRORS.inc()
+                    print(f"Error in serial worker: {e}")
+        finally:
+            scheduler.stop()
+            print(f"Sampling {getattr(ser, 'port', '')}: target {scheduler.rate_hz:g} Hz, "
+                  f"achieved {scheduler.achieved_rate():.2f} Hz, missed deadlines {scheduler.missed}")
+
+
+class RawRingSink:
+    """``SampleSink`` of the sampler process: every reading goes into the raw shared-memory ring."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.lock = threading.Lock()
+
+    def put(self, tick, channel, value, t_ns, lateness_us, rtt_us, flags):
+        if value is None:
+            value, flags = 0, flags | RAW_NO_REPLY
+        with self.lock:
+            self.raw.publish(tick, t_ns, value, flags, lateness_us, rtt_us)
+
+
+def open_serials(ports):
+    """Open one serial port per ``(port, channels)``; returns the list, or None if one failed."""
+    serials = []
+    for port, channels in ports:
+        try:
+            serials.append(serial.Serial(port, BAUD_RATE, timeout=READ_TIMEOUT))
+            print(f"Serial port {port} opened for slave {', '.join(str(slave) for _, slave in channels)} "
+                  f"(reply timeout {READ_TIMEOUT * 1000:.0f} ms)")
+        except serial.SerialException as e:
+            print(f"Failed to open serial port: {e}")
+            close_serials(serials)
+            return None
+    return serials
+
+
+def close_serials(serials):
+    for ser in serials:
+        try:
+            ser.close()
+        except Exception:
+            pass
+
+
+def sampler_process(raw_name, stop_event, status):
+    """Entry point of the sampler child process: poll and timestamp, nothing else.
+
+    Readings go into the raw ring ``raw_name`` created by the parent;
+    every ``STATUS_INTERVAL_S`` and once at the end the per-port figures
+    of ``sampling_stats`` are put on ``status`` (the last one with
+    ``done=True``).
+    """
+    raw = ShmRingWriter(raw_name, dtype=RAW_DTYPE, create=False, untrack=False)
+    if not raise_process_priority():
+        print("Sampler process runs at normal priority")
+    ports = group_by_port(SENSORS)
+    serials = open_serials(ports)
+    if serials is None:
+        status.put({'error': 'failed to open serial port', 'done': True})
+        raw.close()
+        return
+    sink = RawRingSink(raw)
+    workers = []
+    t0_ns = time.perf_counter_ns() + 50_000_000
+    for ser, (port, channels) in zip(serials, ports):
+        workers.append(SerialWorker(ser, channels, sink, t0_ns=t0_ns, peers=workers))
+    for worker in workers:
+        worker.start()
+    try:
+        while not stop_event.wait(STATUS_INTERVAL_S) and all(w.is_alive() for w in workers):
+            status.put(sampling_stats(workers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        STOP_EVENT.set()
+        for worker in workers:
+            worker.join(timeout=2.0)
+        close_serials(serials)
+        status.put(dict(sampling_stats(workers), done=True))
+        raw.close()
+
+
+class SamplerProcess(threading.Thread):
+    """Run the serial pollers in a child process and feed their readings to ``sink``.
+
+    The child does nothing but poll and timestamp, so saving, sockets and
+    the other threads here cannot add jitter to the sampling.  This thread
+    drains the raw ring every ``DRAIN_INTERVAL_S`` into ``sink`` (recorder,
+    display ring, subscribers) and keeps ``stats`` from the child's
+    status reports.
+    """
+
+    def __init__(self, sink):
+        super().__init__(name='SamplerDrain', daemon=True)
+        self.sink = sink
+        self.raw = ShmRingWriter(f"fpfm_raw_{os.getpid()}", capacity=RAW_RING_CAPACITY, dtype=RAW_DTYPE)
+        ctx = multiprocessing.get_context('spawn')  # 各平台一致：子进程不继承本进程的线程与 socket
+        self.stop_event = ctx.Event()
+        self.status = ctx.Queue()
+        self.process = ctx.Process(target=sampler_process, args=(self.raw.name, self.stop_event, self.status),
+                                   name='FPFM-sampler', daemon=True)
+        self.stats = None
+        self.done = threading.Event()
+
+    def start(self):
+        self.process.start()
+        super().start()
+
+    def running(self):
+        return self.is_alive() and not self.done.is_set()
+
+    def _read_status(self):
+        while True:
+            try:
+                stats = self.status.get_nowait()
+            except queue.Empty:
                 return
-            conn.setblocking(False)  # 设置为非阻塞
-            globals()['socket_conn'] = conn
-            print(f"Connected by {addr}")
-            
-            while not STOP_EVENT.is_set():
-                # 接收trigger数据 (假设trigger是4字节整数)*********
-                try:
-                    trigger = conn.recv(4)
-                    if len(trigger) == 4:
-                        trigger_value = struct.unpack('i', trigger)[0]
-                        # 清空队列，只保留最新trigger
-                        while not data_queue.empty():
-                            try:
-                                data_queue.get_nowait()
-                            except queue.Empty:
-                                break
-                        data_queue.put(trigger_value)
-                        print(f"Received trigger: {trigger_value}")
-                    elif len(trigger) == 0:
-                        print("Socket closed by client (recv)")
-                        break
-                        
-                except socket.error as e:
-                    if e.errno == errno.EAGAIN or e.errno == errno.EWOULDBLOCK:
-                        pass
-                    else:
-                        print(f"真正的Socket错误: {e}")
-                        raise  # 其他错误向上抛出
+            except (EOFError, OSError):
+                self.done.set()
+                return
+            if 'error' in stats:
+                print(f"Sampler process: {stats['error']}")
+            else:
+                self.stats = stats
+                M_MISSED.set(int(np.sum(stats['missed_deadlines'])))
+                M_CRC_ERRORS.set(int(np.sum(stats['modbus_crc_errors'])))
+                M_RESYNCS.set(int(np.sum(stats['modbus_resyncs'])))
+                M_TIMEOUTS.set(int(np.sum(stats['modbus_timeouts'])))
+                M_STALE.set(int(np.sum(stats['modbus_stale_replies'])))
+            if stats.get('done'):
+                self.done.set()
 
-                # 发送最新sensor_value给客户端*********
-                try:
-                    
-                    if sensor_queue.empty():
-                        sensor_value = 0  # 或其他默认值
+    def run(self):
+        reader = ShmRingReader(self.raw.name, dtype=RAW_DTYPE, untrack=False)
+        cursor = 0
+        raise_timer_resolution()
+        try:
+            while True:
+                records, cursor = reader.read_since(cursor)
+                for tick, t_ns, value, flags, lateness_us, rtt_us in records.tolist():
+                    channel = protocol.frame_channel(flags)
+                    if flags & RAW_NO_REPLY:
+                        self.sink.put(tick, channel, None, 0, lateness_us, 0, flags & ~RAW_NO_REPLY)
                     else:
-                        sensor_value = sensor_queue.get_nowait()
-                    conn.sendall(struct.pack('i', sensor_value))
-                    print(f"Sent sensor value: {sensor_value}")
-                except Exception as e:
-                    print(f"Socket send error: {e}")
-                    break
-                    
-        except Exception as e:
-            print(f"Socket server error: {e}")
+                        self.sink.put(tick, channel, value, t_ns, lateness_us, rtt_us, flags)
+                self._read_status()
+                if not len(records):
+                    if self.done.is_set() or not self.process.is_alive():
+                        # 子进程已结束：再取一次，确保最后的读数都已转交
+                        records, cursor = reader.read_since(cursor)
+                        if not len(records):
+                            break
+                        continue
+                    time.sleep(DRAIN_INTERVAL_S)
         finally:
-            if 'socket_conn' in globals():
-                globals()['socket_conn'].close()
+            reader.close()
+            restore_timer_resolution()
+
+    def stop(self, timeout=5.0):
+        self.stop_event.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(1.0)
+        self.join(timeout)
+        self._read_status()
+        self.raw.close()
+
+
+def row_recorder(data_recorder, data_queue):
+    """Return the ``TickAligner`` callback that records one row per tick with the current trigger."""
+    current_trigger = [-1]
+    single = data_recorder.n_channels == 1
+
+    def emit(tick, values, times, lateness_us, rtt_us):
+        # 获取当前trigger值
+        try:
+            current_trigger[0] = data_queue.get_nowait()
+        except queue.Empty:
+            pass
+        if single:
+            data_recorder.add_data(values[0], current_trigger[0], times[0], lateness_us[0], rtt_us[0])
+        else:
+            data_recorder.add_data(values, current_trigger[0], times, lateness_us, rtt_us)
+    return emit
+
+
+def sampling_stats(workers):
+    """Per-port / per-channel sampling figures saved with the data (ports and channels in config order)."""
+    channels = sorted((c[0], c[3]) for w in workers for c in w.channels)
+    return dict(
+        sample_rate=workers[0].scheduler.rate_hz,
+        achieved_rate=np.array([w.scheduler.achieved_rate() for w in workers]),
+        missed_deadlines=np.array([w.scheduler.missed for w in workers]),
+        modbus_crc_errors=np.array([p.crc_errors for _, p in channels]),
+        modbus_resyncs=np.array([p.resyncs for _, p in channels]),
+        modbus_timeouts=np.array([p.timeouts for _, p in channels]),
+        modbus_stale_replies=np.array([p.stale for _, p in channels]),
+        modbus_stale_bytes=np.array([p.stale_bytes for _, p in channels]),
+        sensor_port=np.array([port for port, _ in SENSORS]),
+        sensor_slave=np.array([slave for _, slave in SENSORS]),
+    )
 
 
 def control_server():
-    """A simple control server to request graceful shutdown and saving."""
+    """A simple control server: ``STATS`` returns a JSON metrics snapshot, anything else stops and saves."""
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as cs:
         cs.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         try:
@@ -246,9 +891,15 @@ def control_server():
                     with conn:
                         try:
                             data = conn.recv(64)
-                            print(f"Control received: {data}")
                         except Exception:
-                            pass
+                            data = b''
+                        if data.strip().upper().startswith(b'STATS'):
+                            try:
+                                conn.sendall(json.dumps(METRICS.snapshot()).encode('utf-8') + b'\n')
+                            except Exception as e:
+                                print(f"Control stats error: {e}")
+                            continue
+                        print(f"Control received: {data}")
                         STOP_EVENT.set()
                         break
                 except socket.timeout:
@@ -257,7 +908,44 @@ def control_server():
             print(f"Control server error: {e}")
 
 
+def summary_line(snap):
+    """One console line with the main health numbers of a metrics snapshot."""
+    rates, counters, hist = snap['rates_per_s'], snap['counters'], snap['histograms']
+
+    def ms(name, q):
+        v = hist[name][q]
+        return '-' if v is None else f"{v / 1000:.1f}"
+    return (f"[stats] samples {rates.get('samples', 0):.1f}/s, sends {rates.get('sensor_sends', 0):.1f}/s "
+            f"to {snap['gauges'].get('subscribers', 0)} subscriber(s), "
+            f"rtt p50/p99 {ms('poll_rtt_us', 'p50')}/{ms('poll_rtt_us', 'p99')} ms, "
+            f"late p99 {ms('poll_lateness_us', 'p99')} ms, missed {snap['gauges'].get('missed_deadlines', 0)}, "
+            f"short reads {counters.get('short_reads', 0)}, queue drops {counters.get('sensor_queue_drops', 0)}, "
+            f"triggers {counters.get('triggers', 0)}, written {counters.get('bytes_written', 0) / 1024:.0f} kB")
+
+
+def summary_worker():
+    # 控制台只输出限频的摘要，不再逐个采样/trigger 打印
+    while not STOP_EVENT.wait(SUMMARY_INTERVAL):
+        METRICS.tick()
+        print(summary_line(METRICS.snapshot()))
+
+
+def request_stats(port=None, timeout=1.0):
+    """Fetch the metrics snapshot of a running recorder through the control port."""
+    with socket.create_connection((CTRL_HOST, port or CTRL_PORT), timeout=timeout) as s:
+        s.sendall(b'STATS')
+        chunks = []
+        while True:
+            data = s.recv(65536)
+            if not data:
+                break
+            chunks.append(data)
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
 def auto_save_worker(data_recorder):
+    if data_recorder.chunk_writer is not None:
+        return  # 流式模式下数据持续落盘，无需定时保存
     while not STOP_EVENT.is_set():
         time.sleep(SAVE_INTERVAL)
         try:
@@ -266,43 +954,103 @@ def auto_save_worker(data_recorder):
             print(f"Auto-save error: {e}")
 
 
-def trigger_receiver(conn, data_queue):
+def trigger_receiver(conn, data_queue, data_recorder=None, writer=None):
+    reader = protocol.FrameReader(conn)
+    writer = writer or protocol.FrameWriter(conn)
+    assembler = protocol.MetaAssembler()
     while True:
         try:
-            trigger = conn.recv(4)
-            if len(trigger) == 4:
-                trigger_value = struct.unpack('i', trigger)[0]
-                # 清空队列，只保留最新trigger
-                while not data_queue.empty():
-                    try:
-                        data_queue.get_nowait()
-                    except queue.Empty:
-                        break
-                data_queue.put(trigger_value)
-                print(f"Received trigger: {trigger_value}")
-            elif len(trigger) == 0:
+            if reader.fill() == 0:
                 print("Socket closed by client (recv)")
                 break
         except Exception as e:
             print(f"Socket receive error: {e}")
             break
+        batch = 0
+        while True:
+            frame = reader.next_frame()
+            if frame is None:
+                break
+            # 每帧解析出来时取接收时间，同一次 recv 中的多个帧不再共用一个时间
+            t_ns = time.perf_counter_ns()
+            batch += 1
+            msg_type, seq, sent_ns, trigger_value, flags, request_ns = frame
+            if msg_type == protocol.MSG_PING:
+                M_PINGS.inc()
+                # t_ns 为收到 ping 的时间，pong 带回接收与发送两个时间
+                writer.send(protocol.MSG_PONG, seq, time.perf_counter_ns(), 0, aux=t_ns)
+                continue
+            if msg_type == protocol.MSG_CLOCK_SYNC:
+                if data_recorder is not None:
+                    data_recorder.add_sync(sent_ns, request_ns, trigger_value)
+                continue
+            if msg_type == protocol.MSG_META:
+                # 会话元数据（目标轨迹、block/trial 起止、校准值、被试信息），直接存入数据文件
+                message = assembler.add(seq, flags, request_ns, reader.payload)
+                if message is not None:
+                    M_META.inc()
+                    reply = None
+                    if data_recorder is not None:
+                        reply = data_recorder.add_meta(message[0], message[1], t_ns, sent_ns)
+                    if reply is not None:
+                        # 如追踪误差查询：与 pong 一样由本线程应答
+                        writer.send_meta(seq, time.perf_counter_ns(), *reply)
+                continue
+            if msg_type == protocol.MSG_TRIGGER_ACK:
+                if data_recorder is not None:
+                    data_recorder.add_ack(seq, trigger_value, request_ns, sent_ns)
+                continue
+            if msg_type != protocol.MSG_TRIGGER:
+                continue
+            # 事件表保留每一个 trigger；下面的队列只用于稠密的 trigger_data 列
+            if data_recorder is not None:
+                data_recorder.add_event(trigger_value, t_ns, request_ns, sent_ns, batch - 1)
+            # 清空队列，只保留最新trigger
+            while not data_queue.empty():
+                try:
+                    data_queue.get_nowait()
+                except queue.Empty:
+                    break
+            data_queue.put(trigger_value)
+            M_TRIGGERS.inc()
+
+def count_send():
+    M_SENDS.inc()
+    M_SEND_BYTES.inc(protocol.FRAME_SIZE)
+
 
-def sensor_sender(conn, sensor_queue):
+def serve_subscriber(publisher, conn, addr, data_queue, data_recorder=None):
+    """Stream samples to one connection and handle what it sends until it disconnects."""
+    protocol.set_nodelay(conn)
+    sub = publisher.subscribe(conn, addr)
+    M_SUBSCRIBERS.set(len(publisher.subscribers))
+    print(f"Connected by {addr} ({len(publisher.subscribers)} subscriber(s))")
+    try:
+        # 接收 trigger 并应答时钟同步 ping；pong 与采样共用该连接的 FrameWriter
+        trigger_receiver(conn, data_queue, data_recorder, sub.writer)
+    finally:
+        publisher.unsubscribe(sub)
+        M_SUBSCRIBERS.set(len(publisher.subscribers))
+
+
+def accept_worker(server, publisher, data_queue, data_recorder=None):
+    # 持续接受新的订阅者，每个连接一个接收线程和一个发送线程
     while not STOP_EVENT.is_set():
         try:
-            if sensor_queue.empty():
-                sensor_value = 0
-            else:
-                sensor_value = sensor_queue.get_nowait()
-            # conn.sendall(struct.pack('>i', sensor_value))
-            data_str = f"{sensor_value}\n"  # 添加换行符作为消息分隔符
-            conn.sendall(data_str.encode('utf-8'))  # 编码为字节流发送
-        except Exception as e:
-            print(f"Socket send error: {e}")
+            conn, addr = server.accept()
+        except socket.timeout:
+            continue
+        except OSError:
             break
-        time.sleep(0.1)  # 100ms周期
+        threading.Thread(target=serve_subscriber, args=(publisher, conn, addr, data_queue, data_recorder),
+                         daemon=True).start()
+
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'stats':
+        # python CMCUreader.py stats：打印正在运行的采集程序的指标
+        print(json.dumps(request_stats(), indent=2))
+        return
     if len(sys.argv) > 1:
         hand = sys.argv[1]  # 第一个用户参数
         filename = sys.argv[2] # 第二个用户参数
@@ -313,26 +1061,33 @@ def main():
     # 启动控制服务器（用于优雅退出）
     ctrl_thread = threading.Thread(target=control_server, daemon=True)
     ctrl_thread.start()
+    summary_thread = threading.Thread(target=summary_worker, daemon=True)
+    summary_thread.start()
 
-    # 初始化串口
-    try:
-        ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
-        print(f"Serial port {SERIAL_PORT} opened")
-    except serial.SerialException as e:
-        print(f"Failed to open serial port: {e}")
-        return
+    # 初始化串口：每个端口一个，同一端口上的从站共用（process 模式下由采样子进程打开）
+    ports = group_by_port(SENSORS)
+    serials = []
+    if SAMPLER_MODE != 'process':
+        serials = open_serials(ports)
+        if serials is None:
+            return
 
-    # 启动Socket服务器，等待连接
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((SOCKET_HOST, SOCKET_PORT))
-        s.listen(1)
+    # 共享内存环形缓冲区（可选）：run.py 等多个读者直接读取最新采样，无需经过 socket
+    ring = None
+    if SHM_NAME:
+        try:
+            ring = ShmRingWriter(SHM_NAME)
+            print(f"Shared memory ring '{ring.name}' created")
+        except Exception as e:
+            print(f"Shared memory ring unavailable: {e}")
+
+    # 启动Socket服务器（TCP 或 Unix 域套接字），等待连接
+    with protocol.listen_socket(backlog=8) as s:
         s.settimeout(1.0)
-        print(f"Socket server listening on {SOCKET_HOST}:{SOCKET_PORT}")
 
         conn = None
         addr = None
-        # 等待客户端连接，支持停止
+        # 等待第一个订阅者（通常是 run.py）连接后开始记录，支持停止
         while not STOP_EVENT.is_set():
             try:
                 conn, addr = s.accept()
@@ -340,10 +1095,9 @@ def main():
             except socket.timeout:
                 continue
         if STOP_EVENT.is_set():
-            try:
-                ser.close()
-            except Exception:
-                pass
+            close_serials(serials)
+            if ring is not None:
+                ring.close()
             # 保存已有数据
             try:
                 # 没有数据记录器时跳过
@@ -351,43 +1105,75 @@ def main():
             except Exception:
                 pass
             return
-        print(f"Connected by {addr}")
 
         # 初始化数据记录器和队列
-        data_recorder = DataRecorder(hand)
+        data_recorder = DataRecorder(hand, prefix=filename, n_channels=N_CHANNELS)
         data_queue = queue.Queue()
-        sensor_queue = queue.Queue(maxsize=1)  # 只保留最新值
+        publisher = Publisher(SUBSCRIBER_QUEUE, on_send=count_send, on_drop=M_QUEUE_DROPS.inc)
+        # 队列深度要逐个获取订阅者队列的锁，只在取指标快照（STATS、控制台摘要）时计算，不放在采样路径上
+        METRICS.on_snapshot(lambda: M_QUEUE_DEPTH.set(publisher.max_depth()))
 
         # 启动自动保存线程
         save_thread = threading.Thread(target=auto_save_worker, args=(data_recorder,), daemon=True)
         save_thread.start()
 
-        # 启动trigger接收线程
-        trigger_thread = threading.Thread(target=trigger_receiver, args=(conn, data_queue), daemon=True)
-        trigger_thread.start()
+        # 第一个订阅者，以及之后随时连接的其他订阅者
+        threading.Thread(target=serve_subscriber, args=(publisher, conn, addr, data_queue, data_recorder),
+                         daemon=True).start()
+        accept_thread = threading.Thread(target=accept_worker, args=(s, publisher, data_queue, data_recorder),
+                                         daemon=True)
+        accept_thread.start()
 
-        # 启动sensor数据发送线程
-        sender_thread = threading.Thread(target=sensor_sender, args=(conn, sensor_queue), daemon=True)
-        sender_thread.start()
+        # 读数按节拍合并成多通道记录，并推送给显示端
+        aligner = TickAligner(N_CHANNELS, row_recorder(data_recorder, data_queue))
+        sink = SampleSink(aligner, publisher, ring)
+        data_recorder.period_ns = int(round(1e9 / SAMPLE_RATE))
+        if N_CHANNELS > 1:
+            print(f"{N_CHANNELS} sensors on {len(ports)} port(s)")
+        workers = []
+        sampler = None
+        if SAMPLER_MODE == 'process':
+            sampler = SamplerProcess(sink)
+            sampler.start()
+            print(f"Sampling in child process {sampler.process.pid}")
+        else:
+            # 每个串口一个轮询线程；起点稍后，让各线程同时开始
+            t0_ns = time.perf_counter_ns() + 50_000_000
+            for ser, (port, channels) in zip(serials, ports):
+                workers.append(SerialWorker(ser, channels, sink, t0_ns=t0_ns, peers=workers))
+            for worker in workers:
+                worker.start()
 
-        # 主线程运行串口工作器
+        # 主线程等待：任一串口线程（或采样子进程）退出即停止全部
         try:
-            serial_worker(ser, data_recorder, data_queue, sensor_queue)
+            while not STOP_EVENT.is_set():
+                if sampler is not None and not sampler.running():
+                    break
+                if sampler is None and not all(w.is_alive() for w in workers):
+                    break
+                STOP_EVENT.wait(0.5)
         except KeyboardInterrupt:
             print("Program terminated by user")
         finally:
             STOP_EVENT.set()
-            try:
-                ser.close()
-            except Exception:
-                pass
-            try:
-                conn.close()
-            except Exception:
-                pass
+            if sampler is not None:
+                sampler.stop()
+                stats = sampler.stats or {}
+            else:
+                for worker in workers:
+                    worker.join(timeout=2.0)
+                stats = sampling_stats(workers)
+            aligner.flush()
+            stats.pop('done', None)
+            data_recorder.set_meta(sampler=SAMPLER_MODE, partial_rows=aligner.partial_rows, **stats)
+            close_serials(serials)
+            publisher.close()
+            accept_thread.join(timeout=2.0)
+            if ring is not None:
+                ring.close()
             # 保存数据（包括终止时）
             try:
-                data_recorder.save_to_mat(filename=filename)
+                data_recorder.close()
             except Exception as e:
                 print(f"Final save error: {e}")
 
@@ -2,23 +2,59 @@
 import socket
 try:
     from .triggerBox import TriggerNeuracle
+    from . import protocol
+    from .shmring import ShmRingReader
+    from .clocksync import ClockSync
 except Exception:
     from triggerBox import TriggerNeuracle
+    import protocol
+    from shmring import ShmRingReader
+    from clocksync import ClockSync
+import os
 import time
-import struct
+import zlib
+import queue
+import atexit
+import threading
+from collections import deque
 import scipy.io as scio
 import numpy as np
 from datetime import datetime
 
+SENSOR_HISTORY = 256  # 接收线程保留的最近采样数
+TRIGGER_HISTORY = 1024  # 发送线程保留的最近 trigger 记录数
+# 目标力轨迹缓存目录（按会话种子保存，随时可按种子重新生成）：默认放在数据目录下（与 CMCUreader 的
+# FPFM_MAT_DIR 一致），不写入源码目录
+TARGET_CACHE_DIR = os.environ.get('FPFM_TARGET_CACHE') or os.path.join(
+    os.environ.get('FPFM_MAT_DIR') or os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mat_data'), 'targets')
+
 class FingerForce:
-    def __init__(self, is_socket=True):
+    def __init__(self, is_socket=True, channel=None):
         self.is_socket = is_socket
+        # 多传感器时显示哪个通道（见 CMCUreader 的 FPFM_SENSORS），默认通道 0
+        if channel is None:
+            channel = int(os.environ.get('FPFM_DISPLAY_CHANNEL', '0') or 0)
+        self.channel = channel
         if is_socket:
-            SOCKET_HOST = '127.0.0.1'
-            SOCKET_PORT = 12345
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.settimeout(0.0005)  # 设置短超时（非阻塞关键）
-            self.socket.connect((SOCKET_HOST, SOCKET_PORT))
+            # TCP(127.0.0.1:12345) 或 Unix 域套接字，见 protocol.py
+            self.socket = protocol.connect_socket()
+            self.writer = protocol.FrameWriter(self.socket)
+            # 与记录端的时钟偏移/漂移估计（ping 由 ClockSync 发出，pong 由接收线程转交）
+            self.clock = ClockSync(self.writer)
+            # 后台线程持续接收，渲染循环只读取最新值，不再阻塞在 recv 上
+            self.receiver = SensorReceiver(self.socket, clock=self.clock, channel=channel)
+            self.receiver.start()
+            self.clock.start()
+        # 共享内存环形缓冲区（可选）：直接读取 CMCUreader 写入的最新采样
+        self.ring = None
+        _shm = os.environ.get('FPFM_SHM_NAME', '').strip()
+        if _shm:
+            try:
+                self.ring = ShmRingReader(_shm)
+                print(f"Attached to shared memory ring '{_shm}'")
+            except Exception as e:
+                print(f"Shared memory ring unavailable, using socket: {e}")
         # --- configurable parameters (defaults) ---
         self.synchronized_with_eeg = False  # 是否与EEG同步
         # 统一命名（与 launcher 的补丁规则一致）
@@ -53,49 +89,107 @@ class FingerForce:
             except Exception as e:
                 print(f"Trigger init failed: {e}")
                 self.trigger = None
+        # trigger 由后台线程发送，帧循环只负责入队，不再等待串口应答
+        self.dispatcher = TriggerDispatcher(self.trigger, self.writer if is_socket else None)
+        self.dispatcher.start()
+        atexit.register(self.dispatcher.flush, 1.0)
         self.Fid = 3
         self.sensor_value = 0
+        self.sensor_seq = -1  # 最近一次采用的采样序号，用于识别过期/重复的值
         self.Target_Force = []
+        # 目标力轨迹：整个会话由一个种子决定（FPFM_TARGET_SEED，未设置时随机选取并记录）
+        _seed = _os.environ.get('FPFM_TARGET_SEED', '').strip()
+        self.target_seed = int(_seed) if _seed else int(np.random.SeedSequence().entropy % 2**32)
+        self.targets = None
+        self.target_params = {}
+        # 校准值随数据一起保存（经 socket 发给记录端，不再另存文件）
+        self.send_meta('calibration', max_force=self.Max_Force, top_force=self.Top_Force,
+                       display_channel=self.channel)
+
+    def select_channel(self, channel):
+        """Show sensor ``channel`` from now on (the others keep being recorded)."""
+        self.channel = channel
+        if self.is_socket:
+            self.receiver.select_channel(channel)
 
     def send_trigger(self, trigger_value):
         # 若不同步EEG，则直接返回（不发送trigger）
         if not getattr(self, 'synchronized_with_eeg', True):
             return
-        # 向triggerbox发送trigger
-        try:
-            if self.trigger is not None:
-                self.trigger.send_trigger(trigger_value)
-                print(f"Sent trigger via triggerbox: {trigger_value}")
-        except Exception as e:
-            print(f"Triggerbox error: {e}")
-        
-        # 向socket发送trigger
-        try:
-            self.socket.sendall(struct.pack('i', trigger_value))
-            print(f"Sent trigger via socket: {trigger_value}")
-        except Exception as e:
-            print(f"Error sending trigger via socket: {e}")
+        # 记录请求时间并入队，由 TriggerDispatcher 同时写入 triggerbox 和 socket
+        self.dispatcher.submit(trigger_value)
+
+    def send_meta(self, kind, **fields):
+        """Send session metadata to the recorder, which stores it in the force data file.
+
+        ``kind`` ``'targets'``, ``'mark'`` (see ``mark``) and e.g.
+        ``'calibration'`` or ``'participant'``; values may be numbers,
+        strings, lists, dicts or numpy arrays.  Queued like a trigger, so
+        the caller never waits on the socket.
+        """
+        if self.is_socket:
+            self.dispatcher.submit_meta(kind, fields)
+
+    def mark(self, boundary, index=0):
+        """Mark ``'block_start'``, ``'block_end'``, ``'trial_start'`` or ``'trial_end'`` in the force data."""
+        self.send_meta('mark', mark=boundary, index=index)
+
+    def force_base(self):
+        """Force shown as a full bar: Top_Force in the first block (Fid 3), else Max_Force."""
+        # 根据当前Fid选择力值基准
+        if self.Fid == 3:  # 第一个block使用Top_Force
+            return self.Top_Force
+        return self.Max_Force  # 后续blocks使用Max_Force
+
+    def start_tracking(self, duration, trial=None):
+        """Start the recorder's online tracking error for target ``trial`` (default: the last one handed out).
+
+        Call it when the trial's target starts moving; the target spans
+        ``duration`` seconds and a full-scale target equals ``force_base()``.
+        """
+        trial = len(self.Target_Force) - 1 if trial is None else trial
+        t0_ns = time.perf_counter_ns()
+        offset = self.clock.estimate(t0_ns)[0] if self.is_socket else None
+        # 换算到记录端的时钟（与 sample_time_ns 一致）
+        self.send_meta('track', trial=trial, t0_ns=t0_ns + int(offset or 0), duration=duration,
+                       force_scale=self.force_base(), channel=self.channel)
+        return trial
+
+    def tracking_result(self, trial=None, timeout=0.5):
+        """Ask the recorder for the tracking error of ``trial`` (default: the last one).
+
+        Returns a dict with ``rmse``, ``mae``, ``bias`` (sensor units),
+        ``lag_ms``, ``lag_r`` and ``samples``, plus ``code_summary`` pooled
+        over the trial's trigger code; None if no answer within ``timeout``.
+        """
+        if not self.is_socket:
+            return None
+        trial = len(self.Target_Force) - 1 if trial is None else trial
+        self.receiver.track_results.pop(trial, None)
+        self.send_meta('track_query', trial=trial)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            result = self.receiver.track_results.get(trial)
+            if result is not None:
+                return result
+            time.sleep(0.005)
+        return None
 
     def receive_sensor_value(self, prog, bmax=None):
-        # 接收传感器值
-        value = receive_sensor_(self.socket)
-        
-        # 更新传感器值（如果新值有效）
-        if value is not None:
-            self.sensor_value = value
-        # 如果新值无效，使用之前保存的有效值
+        # 读取最新采样：共享内存环形缓冲区，或接收线程发布的引用（均无锁）
+        if self.ring is not None:
+            msg = self.ring.latest(channel=self.channel)
         else:
-            value = self.sensor_value  # 使用保存的有效值
+            msg = self.receiver.latest
+        
+        # 更新传感器值（只采用比上一次更新的采样，过期或重复的丢弃）
+        if msg is not None and msg[0] > self.sensor_seq:
+            self.sensor_seq, self.sensor_value = msg[0], msg[2]
+        # 如果没有新值，使用之前保存的有效值
+        value = self.sensor_value
         
-        print(f"Recv sensor value: {value}")
-        # 根据当前Fid选择力值基准
-        if self.Fid == 3:  # 第一个block使用Top_Force
-            force_base = self.Top_Force
-        else:  # 后续blocks使用Max_Force
-            force_base = self.Max_Force
-            
         # 计算除数
-        divisor = bmax if bmax is not None else force_base
+        divisor = bmax if bmax is not None else self.force_base()
         
         # 安全检查：避免除零错误
         if divisor == 0:
@@ -104,53 +198,298 @@ class FingerForce:
         else:
             progress_value = value / divisor
         
-        # 设置进度条
-        prog.setProgress(progress_value)
+        # 设置进度条（每帧调用，不写日志）
+        prog.setProgress(progress_value, log=False)
         
         # 返回值
         return progress_value
 
 
+    def clock_estimate(self, exp_clock=None):
+        """Current offset to the recorder's clock, for the experiment data file.
+
+        ``perf_ns`` and ``exp_t`` (``exp_clock.getTime()``, e.g. PsychoPy's
+        globalClock) are read back to back, so they map experiment time onto
+        this process's ``perf_counter_ns``; adding ``offset_ns`` maps that onto
+        the force data's ``sample_time_ns``.
+        """
+        perf_ns = time.perf_counter_ns()
+        exp_t = exp_clock.getTime(format='float') if exp_clock is not None else None
+        offset, drift, rtt = self.clock.estimate(perf_ns) if self.is_socket else (None, None, None)
+        return {
+            'perf_ns': perf_ns,
+            'exp_t': exp_t,
+            'offset_ns': offset,
+            'drift_ppm': drift,
+            'rtt_us': None if rtt is None else rtt / 1e3,
+        }
+
+    def prepare_targets(self, n_trials, length=200, n_basis=14, seed=None):
+        """Load (or generate and cache) every target trajectory of the session at once.
+
+        Returns the ``(n_trials, length)`` array; ``get_target_value`` then
+        hands out its rows in order.
+        """
+        if seed is not None:
+            self.target_seed = seed
+        self.target_params = {'length': length, 'n_basis': n_basis}
+        self.targets = cached_rbf_batch(self.target_seed, n_trials, length=length, n_basis=n_basis)
+        return self.targets
+
     def get_target_value(self, length=200, n_basis=14):
-        seq = rbf_sequence(length=length, n_basis=n_basis)
+        i = len(self.Target_Force)
+        if self.targets is None or i >= len(self.targets) or \
+                self.target_params != {'length': length, 'n_basis': n_basis}:
+            # 未预先准备或已用完：按同一种子扩大批次（前面的轨迹保持不变）
+            self.prepare_targets(max(i + 1, 2 * (0 if self.targets is None else len(self.targets)), 16),
+                                 length=length, n_basis=n_basis)
+        seq = self.targets[i]
         self.Target_Force.append(seq)
+        # 每条轨迹用到时即发给记录端，存入同一个数据文件
+        self.send_meta('targets', trial=i, target_force=seq, target_seed=self.target_seed)
         return seq
 
 
     def save_to_mat(self):
-        scio.savemat('target_force_{}.mat'.format(datetime.now().strftime("%Y%m%d")), 
-                     {'target_force': np.array(self.Target_Force)})
+        if self.is_socket:
+            # 记录端已随 get_target_value 收到每条轨迹，这里再完整发送一次
+            self.send_meta('targets', trial=0, target_force=np.array(self.Target_Force), target_seed=self.target_seed)
+            return
+        # 没有连接记录端时才写到本地文件
+        scio.savemat('target_force_{}.mat'.format(datetime.now().strftime("%Y%m%d")),
+                     {'target_force': np.array(self.Target_Force), 'target_seed': self.target_seed})
 
 
-def receive_sensor_(conn):
-    buffer = b""  # 字节缓冲区
-    while True:
-        try:
-            chunk = conn.recv(1024)  # 每次最多收1KB
-            if not chunk:  # 连接断开
+class SensorReceiver(threading.Thread):
+    """Daemon thread that drains the data socket as frames arrive.
+
+    The newest sensor sample of the selected ``channel`` is published in
+    ``latest`` as a ``(seq, t_ns, value)`` tuple; replacing a reference is
+    atomic, so readers need no lock.  ``by_channel`` holds the newest
+    sample of every channel and ``history`` the last ``SENSOR_HISTORY``
+    samples of the selected one.  Clock-sync pongs are handed to ``clock``;
+    tracking results from the recorder are kept in ``track_results`` by trial.
+    """
+
+    def __init__(self, sock, history=SENSOR_HISTORY, clock=None, channel=0):
+        super().__init__(daemon=True)
+        self.sock = sock
+        self.clock = clock
+        self.channel = channel
+        self.reader = protocol.FrameReader(sock)
+        self.assembler = protocol.MetaAssembler()
+        self.track_results = {}
+        self.latest = None
+        self.by_channel = {}
+        self.history = deque(maxlen=history)
+        self.received = 0
+        self.stop_event = threading.Event()
+
+    def run(self):
+        self.sock.settimeout(0.5)  # 仅用于定期检查 stop_event
+        reader = self.reader
+        while not self.stop_event.is_set():
+            try:
+                if not reader.fill():  # 连接断开
+                    print("Sensor socket closed")
+                    break
+            except socket.timeout:
+                continue
+            except Exception as e:
+                print(f"接收错误: {e}")
                 break
-            
-            buffer += chunk
-            if b'\n' in buffer:  # 检测到完整消息
-                line, buffer = buffer.split(b'\n', 1)  # 拆分出第一行
+            t_recv = time.perf_counter_ns()
+            while True:
+                frame = reader.next_frame()
+                if frame is None:
+                    break
+                msg_type, seq, t_ns, value, flags, aux = frame
+                if msg_type == protocol.MSG_PONG:
+                    if self.clock is not None:
+                        self.clock.on_pong(seq, aux, t_ns, t_recv)
+                    continue
+                if msg_type == protocol.MSG_META:
+                    message = self.assembler.add(seq, flags, aux, reader.payload)
+                    if message is not None and message[0] == 'track_result':
+                        self.track_results[message[1].get('trial')] = message[1]
+                    continue
+                if msg_type != protocol.MSG_SENSOR:
+                    continue
+                sample = (seq, t_ns, value)
+                channel = protocol.frame_channel(flags)
+                self.by_channel[channel] = sample
+                self.received += 1
+                if channel != self.channel:
+                    continue
+                self.history.append(sample)
+                self.latest = sample
+
+    def select_channel(self, channel):
+        self.channel = channel
+        self.history.clear()
+        self.latest = self.by_channel.get(channel)
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class TriggerDispatcher(threading.Thread):
+    """Daemon thread that sends queued triggers to the TriggerBox and the socket.
+
+    ``submit`` only stamps the request time and enqueues, so the caller never
+    waits on the serial port.  For each trigger the box command and the
+    socket frame are written back to back, then the box's acknowledgement is
+    awaited and reported to the recorder as ``MSG_TRIGGER_ACK``.  ``log``
+    keeps ``(seq, code, request_ns, sent_ns, ack_ns)``; ``ack_ns`` is 0 when
+    the box did not answer.  Metadata messages (``submit_meta``) share the
+    queue, so they reach the recorder in order with the triggers.
+    """
+
+    def __init__(self, trigger=None, writer=None, history=TRIGGER_HISTORY):
+        super().__init__(daemon=True)
+        self.trigger = trigger
+        self.writer = writer
+        self.requests = queue.Queue()
+        self.log = deque(maxlen=history)
+        self.seq = 0
+        self.meta_seq = 0
+
+    def submit(self, code):
+        self.requests.put((code, time.perf_counter_ns(), None))
+
+    def submit_meta(self, kind, fields):
+        self.requests.put((None, time.perf_counter_ns(), (kind, fields)))
+
+    def run(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                self.requests.task_done()
+                return
+            code, request_ns, meta = item
+            try:
+                if meta is not None:
+                    self.send_meta(request_ns, *meta)
+                else:
+                    self.dispatch(code, request_ns)
+            except Exception as e:
+                print(f"Trigger dispatch error: {e}")
+            finally:
+                self.requests.task_done()
+
+    def dispatch(self, code, request_ns):
+        seq = self.seq
+        self.seq += 1
+        box = self.trigger.triggerbox if self.trigger is not None else None
+        if box is not None:
+            try:
+                box.WriteEventData(code)
+            except Exception as e:
+                print(f"Triggerbox error: {e}")
+                box = None
+        sent_ns = time.perf_counter_ns()
+        if self.writer is not None:
+            try:
+                self.writer.send_trigger(seq, sent_ns, code, request_ns)
+            except Exception as e:
+                print(f"Error sending trigger via socket: {e}")
+        ack_ns = 0
+        if box is not None:
+            try:
+                box.ReadEventAck()
+                ack_ns = time.perf_counter_ns()
+            except Exception as e:
+                print(f"Triggerbox error: {e}")
+            if self.writer is not None:
                 try:
-                    value = int(line.decode('utf-8'))  # 字符串转整数
-                    print(f"Recv: {value}")
-                    return value
-                except ValueError:
-                    print(f"无效数据: {line}")
+                    self.writer.send_trigger_ack(seq, ack_ns, code, request_ns,
+                                                 0 if ack_ns else protocol.FLAG_NO_ACK)
+                except Exception as e:
+                    print(f"Error sending trigger ack via socket: {e}")
+        self.log.append((seq, code, request_ns, sent_ns, ack_ns))
+        print(f"Sent trigger {code}: dispatch {(sent_ns - request_ns) / 1e3:.0f} us"
+              + (f", ack {(ack_ns - request_ns) / 1e6:.2f} ms" if ack_ns else ""))
+
+    def send_meta(self, request_ns, kind, fields):
+        if self.writer is None:
+            return
+        seq = self.meta_seq
+        self.meta_seq += 1
+        try:
+            self.writer.send_meta(seq, request_ns, kind, fields)
         except Exception as e:
-            print(f"接收错误: {e}")
-            break
-    return None  # 失败时返回None
+            print(f"Error sending {kind} metadata via socket: {e}")
 
+    def stop(self):
+        """Let the thread exit once everything queued before has been sent."""
+        self.requests.put(None)
 
-def rbf_sequence(length=200, n_basis=14, x_range=(-0.5, 0.5), y_range=(-0.4, 0.4), seed=None):
+    def flush(self, timeout=None):
+        """Wait until every queued trigger has been sent (at most ``timeout`` seconds)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.requests.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def stats(self):
+        """Per trigger code: count, mean/max dispatch latency and mean/max ack latency (ms)."""
+        out = {}
+        for code in sorted({r[1] for r in self.log}):
+            rows = np.array([r[2:] for r in self.log if r[1] == code], dtype=np.int64)
+            dispatch = (rows[:, 1] - rows[:, 0]) / 1e6
+            acked = rows[rows[:, 2] > 0]
+            ack = (acked[:, 2] - acked[:, 0]) / 1e6
+            out[code] = {
+                'n': len(rows),
+                'dispatch_ms_mean': float(dispatch.mean()),
+                'dispatch_ms_max': float(dispatch.max()),
+                'ack_ms_mean': float(ack.mean()) if len(ack) else None,
+                'ack_ms_max': float(ack.max()) if len(ack) else None,
+            }
+        return out
+
+
+def rbf_batch(n_trials, length=200, n_basis=14, x_range=(-0.5, 0.5), y_range=(-0.4, 0.4), seed=None):
+    """Sum-of-Gaussians target trajectories, shape ``(n_trials, length)``, in one broadcast evaluation.
+
+    The random centers, widths and weights are drawn trial by trial from
+    one generator seeded with ``seed``, so trial ``i`` is the same for any
+    ``n_trials > i`` and the whole set can be regenerated from the seed.
+    """
+    rng = np.random.default_rng(seed)
+    u = rng.random((n_trials, 3, n_basis))
+    centers = (x_range[0] + 0.1) + (x_range[1] - x_range[0] - 0.1) * u[:, 0]
+    widths = 0.02 + 0.05 * u[:, 1]
+    weights = y_range[0] + (y_range[1] - y_range[0]) * u[:, 2]
     x = np.linspace(x_range[0], x_range[1], length)
-    centers = np.random.uniform(x_range[0]+0.1, x_range[1], n_basis)
-    widths = np.random.uniform(0.02, 0.07, n_basis)
-    weights = np.random.uniform(y_range[0], y_range[1], n_basis)
-    y = np.zeros_like(x)
-    for c, w, a in zip(centers, widths, weights):
-        y += a * np.exp(-0.5 * ((x - c) / w) ** 2)
+    # (trials, basis, length) 的高斯核按权重求和
+    z = (x[None, None, :] - centers[:, :, None]) / widths[:, :, None]
+    y = np.einsum('tb,tbl->tl', weights, np.exp(-0.5 * z * z))
     return np.clip(y, -0.5, 0.5)
+
+
+def cached_rbf_batch(seed, n_trials, cache_dir=None, **kwargs):
+    """``rbf_batch`` for a session seed, read from / written to ``cache_dir`` (.npy per seed and parameters)."""
+    cache_dir = cache_dir or TARGET_CACHE_DIR
+    key = zlib.crc32(repr(sorted(kwargs.items())).encode('utf-8'))
+    path = os.path.join(cache_dir, f"rbf_seed{seed}_{n_trials}_{key:08x}.npy")
+    try:
+        return np.load(path)
+    except (OSError, ValueError):
+        pass
+    targets = rbf_batch(n_trials, seed=seed, **kwargs)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, targets)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Target cache not written: {e}")
+    return targets
+
+
+def rbf_sequence(length=200, n_basis=14, x_range=(-0.5, 0.5), y_range=(-0.4, 0.4), seed=None):
+    return rbf_batch(1, length, n_basis, x_range, y_range, seed)[0]
@@ -0,0 +1,320 @@
+# 追加写入的分块记录格式（.fpc），崩溃后可恢复为单个 .mat 文件
+"""
+Append-only chunked recording format.
+
+File layout (little-endian)::
+
+    b'FPCHUNK1'                                   file header
+    block*                                        zero or more blocks
+
+    block  := header payload crc32
+    header := b'FPCB' mode:u8 ncols:u8 tlen:u16 plen:u32
+    payload:= table:tlen bytes, then per column
+              nlen:u16 name dlen:u8 dtype.str ndim:u8 shape:u32*ndim data
+
+``mode`` 0 appends the columns to the ones already read (rows concatenate
+along axis 0), ``mode`` 1 replaces them (metadata, last block wins).  A
+block only counts when its CRC matches, so a torn tail after a crash is
+simply dropped.
+
+While a ``ChunkWriter`` has a file open it holds an exclusive lock on
+``<file>.fpc.lock``; the OS releases it when the writer exits or dies, so
+``recover`` only touches files whose lock it can take itself, never one
+another recorder (the other hand of a session) is still writing.
+
+Usage::
+
+    python chunkfile.py recover FinForR_20251023-1.fpc [out.mat]
+"""
+import os
+import sys
+import time
+import struct
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+from scipy.io import savemat
+
+FILE_MAGIC = b'FPCHUNK1'
+BLOCK_MAGIC = b'FPCB'
+BLOCK_HEADER = struct.Struct('<4sBBHI')
+CRC = struct.Struct('<I')
+
+MODE_APPEND = 0
+MODE_REPLACE = 1
+
+LOCK_SUFFIX = '.lock'
+
+FSYNC_ALWAYS = 'always'
+FSYNC_NEVER = 'never'
+
+
+def parse_fsync_policy(value):
+    """Return 'always', 'never' or an fsync interval in seconds."""
+    if value is None:
+        return FSYNC_ALWAYS
+    s = str(value).strip().lower()
+    if s in (FSYNC_ALWAYS, FSYNC_NEVER):
+        return s
+    try:
+        return max(0.0, float(s))
+    except ValueError:
+        return FSYNC_ALWAYS
+
+
+def lock_file(path):
+    """Open ``path`` and lock it exclusively without blocking; None if another writer holds it."""
+    f = open(path, 'a+b')
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def unlock_file(f):
+    """Release a lock taken by ``lock_file`` and remove the lock file."""
+    path = f.name
+    try:
+        if fcntl is None:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    except OSError:
+        pass
+    f.close()
+    try:
+        os.remove(path)
+    except OSError:
+        pass  # 另一个进程正在尝试加锁（Windows）或已删除
+
+
+class ChunkWriter:
+    """Append blocks of named columns to a .fpc file.
+
+    Every block is flushed to the OS as soon as it is written, so it
+    survives the process being killed.  ``fsync`` additionally controls
+    when it is forced to the disk: after every block (``'always'``), never,
+    or at most once per given number of seconds.  The file's lock is held
+    until ``unlock`` (called by ``close`` unless ``keep_lock``), so the
+    owner can finalize the file before ``recover`` may touch it.
+    """
+
+    def __init__(self, path, fsync=FSYNC_ALWAYS):
+        self.path = path
+        self.fsync = parse_fsync_policy(fsync)
+        # 先加锁再创建文件：recover 看到的 .fpc 要么已被锁住，要么确实无人写入
+        self._lock = lock_file(path + LOCK_SUFFIX)
+        if self._lock is None:
+            raise OSError(f"{path} is being written by another process")
+        self._last_sync = time.monotonic()
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.f = open(path, 'ab')
+        if new:
+            self.f.write(FILE_MAGIC)
+            self._sync()
+        self.bytes_written = 0
+
+    def write_block(self, table, columns, mode=MODE_APPEND):
+        parts = [table.encode('utf-8')]
+        for name, arr in columns.items():
+            arr = np.ascontiguousarray(arr)
+            if arr.dtype.hasobject:
+                raise TypeError(f"column {name!r} has object dtype")
+            bname = name.encode('utf-8')
+            bdtype = arr.dtype.str.encode('ascii')
+            parts.append(struct.pack('<H', len(bname)) + bname)
+            parts.append(struct.pack('<B', len(bdtype)) + bdtype)
+            parts.append(struct.pack('<B', arr.ndim) + struct.pack(f'<{arr.ndim}I', *arr.shape))
+            parts.append(arr.tobytes())
+        payload = b''.join(parts)
+        header = BLOCK_HEADER.pack(BLOCK_MAGIC, mode, len(columns), len(parts[0]), len(payload))
+        crc = zlib.crc32(payload, zlib.crc32(header))
+        self.f.write(header)
+        self.f.write(payload)
+        self.f.write(CRC.pack(crc))
+        self.bytes_written += BLOCK_HEADER.size + len(payload) + CRC.size
+        self._sync()
+
+    def _sync(self):
+        self.f.flush()
+        if self.fsync == FSYNC_NEVER:
+            return
+        now = time.monotonic()
+        if self.fsync == FSYNC_ALWAYS or now - self._last_sync >= self.fsync:
+            os.fsync(self.f.fileno())
+            self._last_sync = now
+
+    def close(self, keep_lock=False):
+        if self.f is not None:
+            self.f.flush()
+            if self.fsync != FSYNC_NEVER:
+                os.fsync(self.f.fileno())
+            self.f.close()
+            self.f = None
+        if not keep_lock:
+            self.unlock()
+
+    def unlock(self):
+        if self._lock is not None:
+            unlock_file(self._lock)
+            self._lock = None
+
+
+def _parse_payload(payload, ncols, tlen):
+    table = bytes(payload[:tlen]).decode('utf-8')
+    pos = tlen
+    columns = {}
+    for _ in range(ncols):
+        nlen, = struct.unpack_from('<H', payload, pos)
+        pos += 2
+        name = bytes(payload[pos:pos + nlen]).decode('utf-8')
+        pos += nlen
+        dlen, = struct.unpack_from('<B', payload, pos)
+        pos += 1
+        dtype = np.dtype(bytes(payload[pos:pos + dlen]).decode('ascii'))
+        pos += dlen
+        ndim, = struct.unpack_from('<B', payload, pos)
+        pos += 1
+        shape = struct.unpack_from(f'<{ndim}I', payload, pos)
+        pos += 4 * ndim
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        columns[name] = np.frombuffer(payload, dtype=dtype, count=nbytes // dtype.itemsize,
+                                      offset=pos).reshape(shape)
+        pos += nbytes
+    return table, columns
+
+
+def read_blocks(path):
+    """Yield ``(table, mode, columns)`` for every intact block in ``path``.
+
+    Returns (via StopIteration.value) the number of trailing bytes that had
+    to be dropped because the last block was torn or corrupt.
+    """
+    with open(path, 'rb') as f:
+        buf = memoryview(f.read())
+    if bytes(buf[:len(FILE_MAGIC)]) != FILE_MAGIC:
+        raise ValueError(f"{path} is not a chunk file")
+    pos = len(FILE_MAGIC)
+    end = len(buf)
+    while pos < end:
+        if end - pos < BLOCK_HEADER.size:
+            break
+        magic, mode, ncols, tlen, plen = BLOCK_HEADER.unpack_from(buf, pos)
+        stop = pos + BLOCK_HEADER.size + plen + CRC.size
+        if magic != BLOCK_MAGIC or stop > end:
+            break
+        payload = buf[pos + BLOCK_HEADER.size:stop - CRC.size]
+        crc, = CRC.unpack_from(buf, stop - CRC.size)
+        if zlib.crc32(payload, zlib.crc32(buf[pos:pos + BLOCK_HEADER.size])) != crc:
+            break
+        table, columns = _parse_payload(payload, ncols, tlen)
+        yield table, mode, columns
+        pos = stop
+    return end - pos
+
+
+def load(path):
+    """Merge every intact block of ``path`` into one ``{name: ndarray}`` dict.
+
+    Returns ``(data, torn_bytes)``.
+    """
+    appended = {}
+    data = {}
+    blocks = read_blocks(path)
+    while True:
+        try:
+            table, mode, columns = next(blocks)
+        except StopIteration as stop:
+            torn = stop.value or 0
+            break
+        for name, arr in columns.items():
+            if mode == MODE_APPEND:
+                appended.setdefault(name, []).append(arr)
+            else:
+                data[name] = arr
+    for name, parts in appended.items():
+        data[name] = np.concatenate(parts) if len(parts) > 1 else parts[0].copy()
+    derive_timestamps(data)
+    return data, torn
+
+
+def derive_timestamps(data):
+    """Add the Unix-time ``timestamps`` column (seconds) used by the old analysis scripts.
+
+    Samples are stamped with ``perf_counter_ns``; the file's wall-clock
+    anchor (``clock_anchor_wall_ns``, ``clock_anchor_perf_ns``) converts them.
+    """
+    if 'sample_time_ns' not in data or 'timestamps' in data:
+        return data
+    if 'clock_anchor_wall_ns' not in data:
+        return data
+    offset = int(np.asarray(data['clock_anchor_wall_ns']).ravel()[0]) - \
+        int(np.asarray(data['clock_anchor_perf_ns']).ravel()[0])
+    data['timestamps'] = (data['sample_time_ns'] + offset) * 1e-9
+    return data
+
+
+def finalize(path, mat_path=None, remove=True):
+    """Convert a chunk file (possibly with a torn tail) into a single .mat file."""
+    if mat_path is None:
+        mat_path = os.path.splitext(path)[0] + '.mat'
+    data, torn = load(path)
+    if torn:
+        print(f"{path}: dropped {torn} bytes of torn tail")
+    savemat(mat_path, data)
+    if remove:
+        os.remove(path)
+    return mat_path
+
+
+def recover(directory):
+    """Finalize every abandoned .fpc file in ``directory`` (e.g. after a crash).
+
+    A file whose lock is held by a running writer is skipped.
+    """
+    recovered = []
+    for fname in sorted(os.listdir(directory)):
+        if not fname.endswith('.fpc'):
+            continue
+        path = os.path.join(directory, fname)
+        lock = lock_file(path + LOCK_SUFFIX)
+        if lock is None:
+            print(f"Skipping {path}: still being written")
+            continue
+        try:
+            if os.path.exists(path):  # 加锁前可能刚被写入者整理并删除
+                recovered.append(finalize(path))
+                print(f"Recovered {path} -> {recovered[-1]}")
+        except Exception as e:
+            print(f"Recover failed for {path}: {e}")
+        finally:
+            unlock_file(lock)
+    return recovered
+
+
+def main(argv):
+    if len(argv) < 2 or argv[0] not in ('recover', 'finalize'):
+        print('用法: python chunkfile.py recover <file.fpc | directory> [out.mat]')
+        return 1
+    target = argv[1]
+    if os.path.isdir(target):
+        recover(target)
+    else:
+        out = finalize(target, argv[2] if len(argv) > 2 else None, remove=False)
+        print(f"Wrote {out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
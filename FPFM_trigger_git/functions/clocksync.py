@@ -0,0 +1,127 @@
+# run.py 与 CMCUreader 之间的 NTP 式时钟偏移/漂移估计
+"""
+Clock offset and drift between this process and the recorder.
+
+Every ``INTERVAL_S`` the client sends a burst of ``BURST`` pings.  For
+ping ``seq`` it stamps ``t0`` when sending; the recorder answers with the
+time it received the ping (``t1``) and the time it sent the pong (``t2``),
+and the client stamps ``t3`` on arrival.  Then::
+
+    offset = ((t1 - t0) + (t2 - t3)) / 2     recorder clock - local clock
+    rtt    = (t3 - t0) - (t2 - t1)
+
+Only the exchange with the smallest RTT of each burst is kept (queueing
+delays only ever make an exchange slower and its offset less certain).
+The kept estimates are fitted with a line over the last ``WINDOW`` bursts,
+which gives the current offset and the drift between the two clocks.
+Each kept estimate is also reported to the recorder so it ends up in the
+force data file.
+"""
+import time
+import threading
+from collections import deque
+
+import numpy as np
+
+try:
+    from . import protocol
+except Exception:
+    import protocol
+
+BURST = 8           # 每轮发送的 ping 数
+PING_GAP_S = 0.002  # 同一轮内 ping 的间隔
+INTERVAL_S = 1.0    # 每轮的间隔
+WINDOW = 60         # 拟合漂移所用的最近轮数
+
+
+class ClockSync(threading.Thread):
+    """Daemon thread that pings the recorder and keeps the offset/drift estimate.
+
+    ``on_pong`` must be called by whoever reads the socket (the sensor
+    receiver thread) for each ``MSG_PONG`` frame.
+    """
+
+    def __init__(self, writer, burst=BURST, interval=INTERVAL_S, window=WINDOW):
+        super().__init__(daemon=True)
+        self.writer = writer
+        self.burst = burst
+        self.interval = interval
+        self.samples = deque(maxlen=window)   # (local_ns, offset_ns, rtt_ns)，每轮一个
+        self.stop_event = threading.Event()
+        self._sent = {}
+        self._round = []
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def run(self):
+        rounds = 0
+        while not self.stop_event.is_set():
+            for _ in range(self.burst):
+                if self.stop_event.is_set():
+                    return
+                seq = self._seq
+                self._seq += 1
+                t0 = time.perf_counter_ns()
+                with self._lock:
+                    self._sent[seq] = t0
+                try:
+                    self.writer.send(protocol.MSG_PING, seq, t0, 0)
+                except Exception as e:
+                    print(f"Clock sync ping failed: {e}")
+                    return
+                time.sleep(PING_GAP_S)
+            # 等最后一个 pong 到达后结束本轮
+            self.stop_event.wait(min(0.05, self.interval))
+            self._close_round(rounds)
+            rounds += 1
+            self.stop_event.wait(max(0.0, self.interval - 0.05))
+
+    def on_pong(self, seq, t1, t2, t3=None):
+        if t3 is None:
+            t3 = time.perf_counter_ns()
+        with self._lock:
+            t0 = self._sent.pop(seq, None)
+            if t0 is None:
+                return
+            self._round.append((t0, t1, t2, t3))
+
+    def _close_round(self, index):
+        with self._lock:
+            exchanges, self._round = self._round, []
+            self._sent.clear()
+        if not exchanges:
+            return
+        t0, t1, t2, t3 = min(exchanges, key=lambda e: (e[3] - e[0]) - (e[2] - e[1]))
+        rtt = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) // 2
+        local = (t0 + t3) // 2
+        self.samples.append((local, offset, rtt))
+        try:
+            self.writer.send(protocol.MSG_CLOCK_SYNC, index, local, min(rtt // 1000, 2**31 - 1),
+                             aux=offset)
+        except Exception:
+            pass
+
+    def estimate(self, t_ns=None):
+        """Return ``(offset_ns, drift_ppm, rtt_ns)`` at local time ``t_ns`` (default now).
+
+        ``offset_ns`` is recorder time minus local time; None before the
+        first burst has completed.
+        """
+        samples = list(self.samples)
+        if not samples:
+            return None, None, None
+        if t_ns is None:
+            t_ns = time.perf_counter_ns()
+        local = np.array([s[0] for s in samples], dtype=np.int64)
+        offset = np.array([s[1] for s in samples], dtype=np.float64)
+        rtt = min(s[2] for s in samples)
+        if len(samples) < 3:
+            return int(offset[-1]), 0.0, rtt
+        # 以第一个点为原点拟合，避免大数值的精度损失
+        x = (local - local[0]).astype(np.float64)
+        slope, intercept = np.polyfit(x, offset, 1)
+        return int(round(intercept + slope * (t_ns - local[0]))), float(slope * 1e6), rtt
+
+    def stop(self):
+        self.stop_event.set()
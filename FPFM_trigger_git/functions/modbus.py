@@ -0,0 +1,142 @@
+# Modbus RTU 帧工具（Runeskee 传感器：功能码 0x03 读保持寄存器）
+import time
+import struct
+
+READ_HOLDING = 0x03
+RESPONSE_MARGIN_S = 0.01  # 设备处理请求的余量（秒）
+
+
+def _make_crc_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+CRC_TABLE = _make_crc_table()
+
+
+def crc16(data):
+    """Modbus CRC16 (poly 0xA001, init 0xFFFF), table-driven."""
+    crc = 0xFFFF
+    table = CRC_TABLE
+    for b in data:
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+    return crc
+
+
+def with_crc(body):
+    """Append the CRC, low byte first, as Modbus RTU sends it."""
+    return bytes(body) + struct.pack('<H', crc16(body))
+
+
+def build_read_request(slave=1, register=0, count=1):
+    return with_crc(struct.pack('>BBHH', slave, READ_HOLDING, register, count))
+
+
+def build_read_response(slave, values):
+    values = list(values)
+    return with_crc(struct.pack(f'>BBB{len(values)}H', slave, READ_HOLDING, 2 * len(values), *values))
+
+
+def response_timeout(baud_rate, request_bytes=8, response_bytes=7, margin=RESPONSE_MARGIN_S):
+    """Seconds to wait for a reply: request + response time on the wire (8N1) plus ``margin``."""
+    return 10.0 * (request_bytes + response_bytes) / baud_rate + margin
+
+
+class ResponseParser:
+    """Read function 0x03 responses into a preallocated buffer and validate them.
+
+    A frame must start with ``slave 03 bytecount`` and end with a matching
+    CRC.  Bytes in front of the header are skipped (``resyncs``), frames
+    with a bad CRC are dropped (``crc_errors``) and the search restarts one
+    byte later.  When no valid frame arrives within the port's timeout the
+    read gives up (``timeouts``) and clears the input.  A reply can still
+    arrive after that; ``discard_stale`` must be called right before every
+    request so such a late frame (valid header and CRC) is dropped
+    (``stale``) instead of being taken as the answer to the next poll.
+    """
+
+    def __init__(self, ser, slave=1, count=1, capacity=256):
+        self.ser = ser
+        self.count = count
+        self.frame_len = 5 + 2 * count
+        self.header = bytes([slave, READ_HOLDING, 2 * count])
+        self._h0, self._h1, self._h2 = self.header
+        self._fmt = struct.Struct(f'>{count}H')
+        self._buf = bytearray(capacity)
+        self._start = 0
+        self._end = 0
+        self.crc_errors = 0
+        self.resyncs = 0
+        self.timeouts = 0
+        self.stale = 0        # 发送请求前发现并丢弃旧数据的次数
+        self.stale_bytes = 0
+
+    def discard_stale(self):
+        """Drop whatever earlier polls left behind; returns the number of bytes dropped."""
+        n = self._end - self._start
+        try:
+            n += self.ser.in_waiting
+        except Exception:
+            pass
+        if n:
+            self.stale += 1
+            self.stale_bytes += n
+            self.reset()
+        return n
+
+    def reset(self):
+        self._start = self._end = 0
+        try:
+            self.ser.reset_input_buffer()
+        except Exception:
+            pass
+
+    def _fill(self, need):
+        if self._end + need > len(self._buf):
+            n = self._end - self._start
+            self._buf[:n] = self._buf[self._start:self._end]
+            self._start, self._end = 0, n
+        data = self.ser.read(need)
+        got = len(data)
+        self._buf[self._end:self._end + got] = data
+        self._end += got
+        return got
+
+    def _scan(self):
+        """Return the register values of a complete valid frame in the buffer, or None."""
+        buf, n = self._buf, self.frame_len
+        while self._end - self._start >= n:
+            pos = self._start
+            # 逐字节比较帧头，不为切片分配对象
+            if buf[pos] != self._h0 or buf[pos + 1] != self._h1 or buf[pos + 2] != self._h2:
+                nxt = buf.find(self.header, pos + 1, self._end)
+                self.resyncs += 1
+                self._start = nxt if nxt >= 0 else max(pos + 1, self._end - 2)
+                continue
+            if crc16(memoryview(buf)[pos:pos + n - 2]) != struct.unpack_from('<H', buf, pos + n - 2)[0]:
+                self.crc_errors += 1
+                self._start = pos + 1
+                continue
+            self._start = pos + n
+            return self._fmt.unpack_from(buf, pos + 3)
+        return None
+
+    def read(self):
+        """Return the register values of the next valid response, or None."""
+        deadline = time.perf_counter() + (self.ser.timeout or 0)
+        while True:
+            values = self._scan()
+            if values is not None:
+                if self._start == self._end:
+                    self._start = self._end = 0
+                return values
+            need = self.frame_len - (self._end - self._start)
+            if not self._fill(max(need, 1)) or time.perf_counter() > deadline:
+                self.timeouts += 1
+                self.reset()
+                return None
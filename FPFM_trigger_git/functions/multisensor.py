@@ -0,0 +1,137 @@
+# 多传感器采集：传感器列表（串口 + Modbus 从站地址）的解析与按采样节拍合并
+"""
+Several force sensors recorded as channels of one stream.
+
+A sensor is a serial port plus a Modbus slave ID; channel numbers follow
+the order of the configuration (``FPFM_SENSORS``)::
+
+    COM5:1, COM5:2, COM7:1     ->  channel 0 = COM5 slave 1,
+                                   channel 1 = COM5 slave 2,
+                                   channel 2 = COM7 slave 1
+
+Every port is polled by its own worker on the same deadline grid, so a
+tick index ``k`` means the same instant on every port.  Sensors sharing a
+port (one RS-485 bus) are polled one after the other within the tick.
+``TickAligner`` collects the per-channel readings of each tick and emits
+one row per tick once every channel has answered (or given up).
+"""
+import threading
+
+import numpy as np
+
+MISSING_VALUE = 0  # 该通道本节拍没有有效应答时记录的值（对应时间戳为 0）
+
+
+def parse_sensors(spec, default_port=None):
+    """Parse ``'PORT[:SLAVE], ...'`` into a list of ``(port, slave)``.
+
+    ``spec`` may also be a list of such strings or of ``(port, slave)``
+    pairs; the slave defaults to 1.  An empty spec gives the single
+    ``default_port`` sensor.
+    """
+    if isinstance(spec, str):
+        items = [s for s in spec.replace(';', ',').split(',') if s.strip()]
+    else:
+        items = list(spec or ())
+    sensors = []
+    for item in items:
+        if isinstance(item, str):
+            port, sep, slave = item.strip().rpartition(':')
+            # 没有从站地址（或是 Windows 盘符等），整串都是端口名
+            if not sep or not slave.strip().isdigit():
+                port, slave = item.strip(), 1
+            sensors.append((port.strip(), int(slave)))
+        else:
+            port, slave = item
+            sensors.append((str(port), int(slave)))
+    if not sensors and default_port:
+        sensors.append((default_port, 1))
+    return sensors
+
+
+def group_by_port(sensors):
+    """Return ``[(port, [(channel, slave), ...]), ...]`` in configuration order."""
+    ports = {}
+    for channel, (port, slave) in enumerate(sensors):
+        ports.setdefault(port, []).append((channel, slave))
+    return list(ports.items())
+
+
+class TickAligner:
+    """Merge per-channel readings from several port workers into rows by tick.
+
+    ``put`` is called by each worker with ``value=None`` when a sensor did
+    not answer.  ``emit(tick, values, times, lateness_us, rtt_us)`` gets
+    arrays of length ``n_channels``; missing channels hold ``MISSING_VALUE``
+    with time 0.  Rows are emitted in tick order: when a tick completes,
+    older ticks still waiting on a channel (its worker skipped them) are
+    emitted first with what they have.  A tick where no channel answered
+    is dropped, as a single sensor's short read always was.
+
+    Row buffers are reused once emitted, so there is no allocation per
+    tick; ``emit`` must copy what it keeps (``SampleStore.append`` does).
+    """
+
+    def __init__(self, n_channels, emit, max_pending=8):
+        self.n_channels = int(n_channels)
+        self.emit = emit
+        self.max_pending = max_pending
+        self.pending = {}   # tick -> [values, times, lateness, rtt, 已报告的通道数, 有效通道数]
+        self._free = []     # 已输出、可复用的行
+        self.last_tick = -1
+        self.rows = 0
+        self.partial_rows = 0
+        self.dropped_rows = 0
+        self.lock = threading.Lock()
+
+    def _new_row(self):
+        if self._free:
+            row = self._free.pop()
+            row[0].fill(MISSING_VALUE)
+            row[1].fill(0)
+            row[2].fill(0)
+            row[3].fill(0)
+            row[4] = row[5] = 0
+            return row
+        n = self.n_channels
+        return [np.full(n, MISSING_VALUE, dtype=np.uint16), np.zeros(n, dtype=np.int64),
+                np.zeros(n, dtype=np.int32), np.zeros(n, dtype=np.int32), 0, 0]
+
+    def put(self, tick, channel, value, t_ns=0, lateness_us=0, rtt_us=0):
+        with self.lock:
+            if tick <= self.last_tick:
+                return  # 该节拍已输出（来得太晚）
+            row = self.pending.get(tick)
+            if row is None:
+                row = self.pending[tick] = self._new_row()
+            if value is not None:
+                row[0][channel] = value
+                row[1][channel] = t_ns
+                row[2][channel] = lateness_us
+                row[3][channel] = rtt_us
+                row[5] += 1
+            row[4] += 1
+            if row[4] >= self.n_channels:
+                self._release(tick)
+            elif len(self.pending) > self.max_pending:
+                self._release(min(self.pending))
+
+    def _release(self, upto):
+        # 调用方持有锁；按节拍顺序输出 upto 及之前的所有行
+        for tick in sorted(t for t in self.pending if t <= upto):
+            row = self.pending.pop(tick)
+            self.last_tick = tick
+            if not row[5]:
+                self.dropped_rows += 1
+            else:
+                if row[5] < self.n_channels:
+                    self.partial_rows += 1
+                self.rows += 1
+                self.emit(tick, row[0], row[1], row[2], row[3])
+            self._free.append(row)
+
+    def flush(self):
+        """Emit every row still waiting (at shutdown)."""
+        with self.lock:
+            if self.pending:
+                self._release(max(self.pending))
@@ -0,0 +1,293 @@
+# CMCUreader <-> UserCenter 之间的二进制帧协议
+"""
+Fixed-size binary frames for the sensor/trigger socket.
+
+Every message is one 32-byte little-endian frame::
+
+    magic  2s   b'FP'
+    ver    u8   PROTOCOL_VERSION
+    type   u8   MSG_* message type
+    seq    u32  sample or trigger sequence number
+    t_ns   i64  perf_counter_ns of the sending process
+    value  i32  force value / trigger code
+    flags  u32  FLAG_* bits; sensor frames carry the channel in bits 16-23
+    aux    i64  triggers: perf_counter_ns when the trigger was requested, else 0
+
+A trigger frame's ``t_ns`` is the time it was written to the TriggerBox and
+the socket; the matching ``MSG_TRIGGER_ACK`` carries the time the box
+acknowledged it (``FLAG_NO_ACK`` if it did not).
+
+Clock sync (see clocksync.py): ``MSG_PING`` carries the client's send time
+in ``t_ns``; ``MSG_PONG`` echoes its ``seq`` with the recorder's send time in
+``t_ns`` and receive time in ``aux``; ``MSG_CLOCK_SYNC`` reports one kept
+estimate (``t_ns`` client time, ``aux`` offset in ns, ``value`` RTT in us).
+
+Session metadata (targets, block/trial boundaries, calibration,
+participant info) travels as ``MSG_META``: a frame whose ``value`` bytes
+of payload follow it directly.  The payload is one JSON object
+``{"kind": ..., "fields": {...}}`` (numpy arrays base64-encoded, see
+``encode_meta``), split into parts of at most ``META_CHUNK`` bytes that
+share one ``seq``; every part but the last has ``FLAG_MORE`` set and
+``aux`` is the length of the whole payload.
+
+The transport is TCP on 127.0.0.1 with TCP_NODELAY, or a Unix-domain
+socket when ``FPFM_TRANSPORT=unix`` (``FPFM_SOCKET_PATH``) and the
+platform supports it.
+"""
+import os
+import json
+import base64
+import socket
+import struct
+import tempfile
+import threading
+
+import numpy as np
+
+PROTOCOL_VERSION = 1
+MAGIC = b'FP'
+FRAME = struct.Struct('<2sBBIqiIq')
+FRAME_SIZE = FRAME.size
+_HEADER = MAGIC + bytes([PROTOCOL_VERSION])
+_M0, _M1 = MAGIC
+
+MSG_SENSOR = 1
+MSG_TRIGGER = 2
+MSG_TRIGGER_ACK = 3
+MSG_PING = 4
+MSG_PONG = 5
+MSG_CLOCK_SYNC = 6
+MSG_META = 7
+
+FLAG_LATE = 0x1   # 该采样错过了截止时间
+FLAG_NO_ACK = 0x2  # TriggerBox 没有应答
+FLAG_MORE = 0x4    # MSG_META：后面还有同一条消息的分片
+CHANNEL_SHIFT = 16  # 多传感器：采样的通道号放在 flags 的 16-23 位
+CHANNEL_MASK = 0xFF
+META_CHUNK = 1024   # MSG_META 每个分片的最大负载字节数
+
+SOCKET_HOST = '127.0.0.1'
+SOCKET_PORT = 12345
+TRANSPORT = os.environ.get('FPFM_TRANSPORT', 'tcp').strip().lower()
+SOCKET_PATH = os.environ.get('FPFM_SOCKET_PATH') or os.path.join(tempfile.gettempdir(), 'fpfm.sock')
+
+
+def use_unix_socket():
+    if TRANSPORT != 'unix':
+        return False
+    if not hasattr(socket, 'AF_UNIX'):
+        print("Unix-domain sockets are not available here, using TCP")
+        return False
+    return True
+
+
+def listen_socket(backlog=1):
+    """Create the listening data socket for the configured transport."""
+    if use_unix_socket():
+        try:
+            os.unlink(SOCKET_PATH)
+        except FileNotFoundError:
+            pass
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(SOCKET_PATH)
+        where = SOCKET_PATH
+    else:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((SOCKET_HOST, SOCKET_PORT))
+        where = f"{SOCKET_HOST}:{SOCKET_PORT}"
+    s.listen(backlog)
+    print(f"Socket server listening on {where}")
+    return s
+
+
+def connect_socket():
+    """Connect to the data socket for the configured transport."""
+    if use_unix_socket():
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(SOCKET_PATH)
+    else:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.connect((SOCKET_HOST, SOCKET_PORT))
+    set_nodelay(s)
+    return s
+
+
+def channel_flags(channel, flags=0):
+    return flags | ((channel & CHANNEL_MASK) << CHANNEL_SHIFT)
+
+
+def frame_channel(flags):
+    return (flags >> CHANNEL_SHIFT) & CHANNEL_MASK
+
+
+def _encode_value(value):
+    if isinstance(value, np.ndarray):
+        arr = np.ascontiguousarray(value)
+        return {'__ndarray__': base64.b64encode(arr.tobytes()).decode('ascii'),
+                'dtype': arr.dtype.str, 'shape': list(arr.shape)}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not serializable as metadata")
+
+
+def _decode_value(obj):
+    if '__ndarray__' in obj:
+        data = base64.b64decode(obj['__ndarray__'])
+        return np.frombuffer(data, dtype=np.dtype(obj['dtype'])).reshape(obj['shape']).copy()
+    return obj
+
+
+def encode_meta(kind, fields):
+    """Serialize one metadata message; values may be numbers, strings, lists, dicts or arrays."""
+    return json.dumps({'kind': kind, 'fields': fields}, default=_encode_value,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def decode_meta(payload):
+    """Return ``(kind, fields)`` of an ``encode_meta`` payload."""
+    message = json.loads(bytes(payload).decode('utf-8'), object_hook=_decode_value)
+    return message['kind'], message['fields']
+
+
+class MetaAssembler:
+    """Join the parts of ``MSG_META`` messages received on one connection."""
+
+    def __init__(self, max_pending=8):
+        self.parts = {}
+        self.max_pending = max_pending
+        self.errors = 0
+
+    def add(self, seq, flags, total, payload):
+        """Add one part; returns ``(kind, fields)`` once the message is complete, else None."""
+        parts = self.parts.setdefault(seq, [])
+        parts.append(payload)
+        if flags & FLAG_MORE:
+            if len(self.parts) > self.max_pending:
+                # 最后一个分片一直没来的消息，丢弃最早的
+                del self.parts[next(iter(self.parts))]
+                self.errors += 1
+            return None
+        data = b''.join(self.parts.pop(seq))
+        if len(data) != total:
+            self.errors += 1
+            return None
+        try:
+            return decode_meta(data)
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Bad metadata message: {e}")
+            self.errors += 1
+            return None
+
+
+def set_nodelay(sock):
+    if sock.family == socket.AF_INET:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class FrameWriter:
+    """Pack frames into one preallocated buffer and send them.
+
+    Several threads may share one writer; frames are never interleaved.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._buf = bytearray(FRAME_SIZE)
+        self._lock = threading.Lock()
+
+    def send(self, msg_type, seq, t_ns, value, flags=0, aux=0):
+        with self._lock:
+            FRAME.pack_into(self._buf, 0, MAGIC, PROTOCOL_VERSION, msg_type,
+                            seq & 0xFFFFFFFF, t_ns, value, flags, aux)
+            self.sock.sendall(self._buf)
+
+    def send_sensor(self, seq, t_ns, value, flags=0):
+        self.send(MSG_SENSOR, seq, t_ns, value, flags)
+
+    def send_trigger(self, seq, t_ns, code, request_ns=0):
+        self.send(MSG_TRIGGER, seq, t_ns, code, aux=request_ns)
+
+    def send_trigger_ack(self, seq, t_ns, code, request_ns, flags=0):
+        self.send(MSG_TRIGGER_ACK, seq, t_ns, code, flags, request_ns)
+
+    def send_meta(self, seq, t_ns, kind, fields):
+        """Send one metadata message, in ``META_CHUNK`` parts, without other frames in between."""
+        payload = encode_meta(kind, fields)
+        total = len(payload)
+        with self._lock:
+            start = 0
+            while True:
+                part = payload[start:start + META_CHUNK]
+                start += len(part)
+                FRAME.pack_into(self._buf, 0, MAGIC, PROTOCOL_VERSION, MSG_META, seq & 0xFFFFFFFF,
+                                t_ns, len(part), FLAG_MORE if start < total else 0, total)
+                self.sock.sendall(bytes(self._buf) + part)
+                if start >= total:
+                    break
+
+
+class FrameReader:
+    """Receive frames into a preallocated buffer and decode them in place.
+
+    ``recv_into`` fills a fixed ``bytearray`` and frames are decoded with
+    ``unpack_from`` at an offset; only an incomplete trailing frame is
+    moved to the front of the buffer.  Bytes that do not start with a
+    valid header are skipped until the next one (``resyncs`` counts them).
+    A ``MSG_META`` frame is returned once its payload has arrived too; the
+    payload bytes are then in ``payload``.
+    """
+
+    def __init__(self, sock, capacity=64 * FRAME_SIZE):
+        self.sock = sock
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self.resyncs = 0
+        self.closed = False
+        self.payload = b''
+
+    def fill(self):
+        """Read whatever the socket has; returns the number of bytes received.
+
+        Raises the socket's timeout/BlockingIOError when nothing is pending.
+        """
+        if self._start:
+            n = self._end - self._start
+            self._buf[:n] = self._buf[self._start:self._end]
+            self._start, self._end = 0, n
+        got = self.sock.recv_into(self._view[self._end:])
+        if got == 0:
+            self.closed = True
+        self._end += got
+        return got
+
+    def next_frame(self):
+        """Return the next buffered frame tuple, or None if none is complete.
+
+        The tuple is ``(type, seq, t_ns, value, flags, aux)``.
+        """
+        buf = self._buf
+        while self._end - self._start >= FRAME_SIZE:
+            pos = self._start
+            if buf[pos] != _M0 or buf[pos + 1] != _M1 or buf[pos + 2] != PROTOCOL_VERSION:
+                nxt = buf.find(_HEADER, pos + 1, self._end)
+                self.resyncs += 1
+                self._start = nxt if nxt >= 0 else max(pos + 1, self._end - 2)
+                continue
+            _, _, msg_type, seq, t_ns, value, flags, aux = FRAME.unpack_from(buf, pos)
+            if msg_type == MSG_META:
+                if not 0 <= value <= META_CHUNK:
+                    # 不可能的负载长度：按损坏的帧头处理
+                    self.resyncs += 1
+                    self._start = pos + 1
+                    continue
+                if self._end - pos < FRAME_SIZE + value:
+                    return None  # 负载还没收全
+                self.payload = bytes(buf[pos + FRAME_SIZE:pos + FRAME_SIZE + value])
+                self._start = pos + FRAME_SIZE + value
+                return msg_type, seq, t_ns, value, flags, aux
+            self._start = pos + FRAME_SIZE
+            return msg_type, seq, t_ns, value, flags, aux
+        return None
@@ -0,0 +1,122 @@
+# 传感器数据的多订阅者分发：每个连接一个有界发送队列，满了丢弃最旧的
+"""
+Fan-out of sensor frames to any number of socket subscribers.
+
+The sampler calls ``Publisher.publish`` once per sample; it only puts the
+sample on every subscriber's bounded queue and never touches a socket.
+Each ``Subscriber`` has its own sender thread draining its queue into
+its connection.  When a subscriber falls behind, its queue drops the
+oldest sample to make room, so a slow consumer (a monitor on a busy
+machine, a logger writing to a slow disk) loses its own old samples but
+can never delay the sampler or the other subscribers.
+"""
+import queue
+import threading
+
+try:
+    from . import protocol
+except Exception:
+    import protocol
+
+SUBSCRIBER_QUEUE = 64  # 每个订阅者最多缓存的采样数
+
+
+class Subscriber(threading.Thread):
+    """One connection: a bounded sample queue and the thread that sends it."""
+
+    def __init__(self, conn, addr=None, maxsize=SUBSCRIBER_QUEUE, on_send=None, on_drop=None):
+        super().__init__(name=f"Subscriber-{addr}", daemon=True)
+        self.conn = conn
+        self.addr = addr
+        # socket 上的其他帧（pong 等）也用这个 writer，内部加锁
+        self.writer = protocol.FrameWriter(conn)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.on_send = on_send
+        self.on_drop = on_drop
+        self.sent = 0
+        self.dropped = 0
+        self.closed = threading.Event()
+
+    def offer(self, sample):
+        """Queue ``sample`` without blocking, dropping the oldest queued one when full."""
+        while True:
+            try:
+                self.queue.put_nowait(sample)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                    if self.on_drop is not None:
+                        self.on_drop()
+                except queue.Empty:
+                    pass
+
+    def run(self):
+        while not self.closed.is_set():
+            try:
+                seq, t_ns, value, flags = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.writer.send_sensor(seq, t_ns, value, flags)
+                self.sent += 1
+                if self.on_send is not None:
+                    self.on_send()
+            except Exception as e:
+                print(f"Socket send error ({self.addr}): {e}")
+                break
+        self.closed.set()
+
+    def close(self):
+        self.closed.set()
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class Publisher:
+    """The set of live subscribers.
+
+    The subscriber list is replaced, never mutated, so ``publish`` iterates
+    it without taking a lock.
+    """
+
+    def __init__(self, maxsize=SUBSCRIBER_QUEUE, on_send=None, on_drop=None):
+        self.maxsize = maxsize
+        self.on_send = on_send
+        self.on_drop = on_drop
+        self.subscribers = ()
+        self.dropped = 0   # 已断开的订阅者丢弃的采样数
+        self._lock = threading.Lock()
+
+    def subscribe(self, conn, addr=None):
+        sub = Subscriber(conn, addr, self.maxsize, self.on_send, self.on_drop)
+        with self._lock:
+            self.subscribers = self.subscribers + (sub,)
+        sub.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            if sub in self.subscribers:
+                self.subscribers = tuple(s for s in self.subscribers if s is not sub)
+                self.dropped += sub.dropped
+        sub.close()
+
+    def publish(self, seq, t_ns, value, flags=0):
+        sample = (seq, t_ns, value, flags)
+        for sub in self.subscribers:
+            if not sub.closed.is_set():
+                sub.offer(sample)
+
+    def total_dropped(self):
+        return self.dropped + sum(s.dropped for s in self.subscribers)
+
+    def max_depth(self):
+        return max((s.queue.qsize() for s in self.subscribers), default=0)
+
+    def close(self):
+        for sub in self.subscribers:
+            self.unsubscribe(sub)
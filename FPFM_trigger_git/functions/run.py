@@ -36,6 +36,7 @@ from psychopy.hardware import keyboard
 # Run 'Before Experiment' code from code
 import random
 from UserCenter import FingerForce
+from tracking import ScrollingTarget
 
 uc = FingerForce()
 
@@ -77,6 +78,19 @@ if _env_size and 'x' in _env_size:
         _winSize = [int(_w), int(_h)]
     except Exception:
         pass
+# 每个 trial 力反馈阶段的时长（秒）；原先为 2500 次 0.002s 的微型 routine，60Hz 下约 41.7 秒
+trialDuration = 41.7
+_env_dur = _os.environ.get('FPFM_TRIAL_DURATION')
+if _env_dur:
+    try:
+        trialDuration = float(_env_dur)
+    except Exception:
+        pass
+# block 数与每个 block 的 trial 数（trials_2 / trials 循环的 nReps），追踪范式据此预先生成全部目标轨迹
+nBlocks = 4
+nTrialsPerBlock = 5
+# 追踪范式：力反馈阶段显示滚动的目标力轨迹（rbf_sequence）和力值光标，代替固定位置的红色目标
+trackingMode = (_os.environ.get('FPFM_TRACKING') or '').strip().lower() in ('1', 'true', 'yes', 'on')
 # if in pilot mode, apply overrides according to preferences
 if PILOTING:
     # force windowed mode
@@ -428,6 +442,12 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
         lineWidth=1.0,
         colorSpace='rgb', lineColor=[1.0000, -1.0000, -1.0000], fillColor=[1.0000, -1.0000, -1.0000],
         opacity=None, depth=-3.0, interpolate=True)
+    tracker = None
+    if trackingMode:
+        # 整个会话的目标轨迹一次生成；每个 trial 的轨迹上传一次，逐帧只移动窗口偏移和光标
+        uc.prepare_targets(nBlocks * nTrialsPerBlock)
+        tracker = ScrollingTarget(win, frame_rate=1.0 / frameDur)
+        Eyes.setPos((0, 0.4))
     
     # --- Initialize components for Routine "rest" ---
     text_5 = visual.TextStim(win=win, name='text_5',
@@ -633,7 +653,7 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
       # set up handler to look after randomisation of conditions etc
     trials_2 = data.TrialHandler2(
         name='trials_2',
-        nReps=4.0, 
+        nReps=float(nBlocks), 
         method='sequential', 
         extraInfo=expInfo, 
         originPath=-1, 
@@ -652,6 +672,8 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
     
     for thisTrial_2 in trials_2:
         currentLoop = trials_2
+        # block/trial 的起止写入力数据文件（marks 表）
+        uc.mark('block_start', trials_2.thisN)
         thisExp.timestampOnFlip(win, 'thisRow.t', format=globalClock.format)
         if thisSession is not None:
             # if running in a Session with a Liaison client, send data up to now
@@ -664,7 +686,7 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
         # set up handler to look after randomisation of conditions etc
         trials = data.TrialHandler2(
             name='trials',
-            nReps=5.0, 
+            nReps=float(nTrialsPerBlock), 
             method='random', 
             extraInfo=expInfo, 
             originPath=-1, 
@@ -683,6 +705,7 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
         
         for thisTrial in trials:
             currentLoop = trials
+            uc.mark('trial_start', trials.thisN)
             thisExp.timestampOnFlip(win, 'thisRow.t', format=globalClock.format)
             if thisSession is not None:
                 # if running in a Session with a Liaison client, send data up to now
@@ -814,234 +837,230 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
             # the Routine "prep" was not non-slip safe, so reset the non-slip timer
             routineTimer.reset()
             
-            # set up handler to look after randomisation of conditions etc
-            trials_3 = data.TrialHandler2(
-                name='trials_3',
-                nReps=2500.0, 
-                method='random', 
-                extraInfo=expInfo, 
-                originPath=-1, 
-                trialList=[None], 
-                seed=None, 
+            # --- Prepare to start Routine "run" ---
+            # create an object to store info about Routine run
+            # 力反馈阶段为单个按时长结束的 routine：每帧更新进度条，逐帧力值存成一列数组
+            run = data.Routine(
+                name='run',
+                components=[Eyes, prog] if tracker is not None else [Eyes, prog, polygon],
             )
-            thisExp.addLoop(trials_3)  # add the loop to the experiment
-            thisTrial_3 = trials_3.trialList[0]  # so we can initialise stimuli with some values
-            # abbreviate parameter names if possible (e.g. rgb = thisTrial_3.rgb)
-            if thisTrial_3 != None:
-                for paramName in thisTrial_3:
-                    globals()[paramName] = thisTrial_3[paramName]
-            if thisSession is not None:
-                # if running in a Session with a Liaison client, send data up to now
-                thisSession.sendExperimentData()
+            run.status = NOT_STARTED
+            continueRoutine = True
+            # update component parameters for each repeat
+            # Run 'Begin Routine' code from code_2
+            bar_h = uc.receive_sensor_value(prog)
+            positions = [-0.18, -0.06, 0.18, 0.30]
+            y_pos = positions[uc.Fid]
+            polygon.setPos((0.7, y_pos))
+            runTarget = []  # 追踪范式：每帧的目标值（与进度条同一比例）
+            if tracker is not None:
+                polygon.status = FINISHED
+                tracker.start_trial(uc.get_target_value(), trialDuration)
+                # 记录端随采样在线计算本 trial 的追踪误差
+                uc.start_tracking(trialDuration)
+            runForce = []  # 每帧显示的力值
+            runFrameT = []  # 每帧的预计刷新时间（相对 routine 开始，秒）
+            # store start times for run
+            run.tStartRefresh = win.getFutureFlipTime(clock=globalClock)
+            run.tStart = globalClock.getTime(format='float')
+            run.status = STARTED
+            thisExp.addData('run.started', run.tStart)
+            run.maxDuration = None
+            # keep track of which components have finished
+            runComponents = run.components
+            for thisComponent in run.components:
+                thisComponent.tStart = None
+                thisComponent.tStop = None
+                thisComponent.tStartRefresh = None
+                thisComponent.tStopRefresh = None
+                if hasattr(thisComponent, 'status'):
+                    thisComponent.status = NOT_STARTED
+            # reset timers
+            t = 0
+            _timeToFirstFrame = win.getFutureFlipTime(clock="now")
+            frameN = -1
             
-            for thisTrial_3 in trials_3:
-                currentLoop = trials_3
-                thisExp.timestampOnFlip(win, 'thisRow.t', format=globalClock.format)
-                if thisSession is not None:
-                    # if running in a Session with a Liaison client, send data up to now
-                    thisSession.sendExperimentData()
-                # abbreviate parameter names if possible (e.g. rgb = thisTrial_3.rgb)
-                if thisTrial_3 != None:
-                    for paramName in thisTrial_3:
-                        globals()[paramName] = thisTrial_3[paramName]
+            # --- Run Routine "run" ---
+            # if trial has changed, end Routine now
+            if isinstance(trials, data.TrialHandler2) and thisTrial.thisN != trials.thisTrial.thisN:
+                continueRoutine = False
+            run.forceEnded = routineForceEnded = not continueRoutine
+            while continueRoutine and routineTimer.getTime() < trialDuration:
+                # get current time
+                t = routineTimer.getTime()
+                tThisFlip = win.getFutureFlipTime(clock=routineTimer)
+                tThisFlipGlobal = win.getFutureFlipTime(clock=None)
+                frameN = frameN + 1  # number of completed frames (so 0 is the first frame)
+                # update/draw components on each frame
                 
-                # --- Prepare to start Routine "run" ---
-                # create an object to store info about Routine run
-                run = data.Routine(
-                    name='run',
-                    components=[Eyes, prog, polygon],
-                )
-                run.status = NOT_STARTED
-                continueRoutine = True
-                # update component parameters for each repeat                # Run 'Begin Routine' code from code_2
-                bar_h = uc.receive_sensor_value(prog)
-                positions = [-0.18, -0.06, 0.18, 0.30]
-                y_pos = positions[uc.Fid]
-                polygon.setPos((0.7, y_pos))
-                # store start times for run
-                run.tStartRefresh = win.getFutureFlipTime(clock=globalClock)
-                run.tStart = globalClock.getTime(format='float')
-                run.status = STARTED
-                thisExp.addData('run.started', run.tStart)
-                run.maxDuration = None
-                # keep track of which components have finished
-                runComponents = run.components
-                for thisComponent in run.components:
-                    thisComponent.tStart = None
-                    thisComponent.tStop = None
-                    thisComponent.tStartRefresh = None
-                    thisComponent.tStopRefresh = None
-                    if hasattr(thisComponent, 'status'):
-                        thisComponent.status = NOT_STARTED
-                # reset timers
-                t = 0
-                _timeToFirstFrame = win.getFutureFlipTime(clock="now")
-                frameN = -1
+                # *Eyes* updates
                 
-                # --- Run Routine "run" ---
-                # if trial has changed, end Routine now
-                if isinstance(trials_3, data.TrialHandler2) and thisTrial_3.thisN != trials_3.thisTrial.thisN:
-                    continueRoutine = False
-                run.forceEnded = routineForceEnded = not continueRoutine
-                while continueRoutine and routineTimer.getTime() < 0.002:
-                    # get current time
-                    t = routineTimer.getTime()
-                    tThisFlip = win.getFutureFlipTime(clock=routineTimer)
-                    tThisFlipGlobal = win.getFutureFlipTime(clock=None)
-                    frameN = frameN + 1  # number of completed frames (so 0 is the first frame)
-                    # update/draw components on each frame
-                    
-                    # *Eyes* updates
-                    
-                    # if Eyes is starting this frame...
-                    if Eyes.status == NOT_STARTED and tThisFlip >= 0.0-frameTolerance:
-                        # keep track of start time/frame for later
-                        Eyes.frameNStart = frameN  # exact frame index
-                        Eyes.tStart = t  # local t and not account for scr refresh
-                        Eyes.tStartRefresh = tThisFlipGlobal  # on global time
-                        win.timeOnFlip(Eyes, 'tStartRefresh')  # time at next scr refresh
+                # if Eyes is starting this frame...
+                if Eyes.status == NOT_STARTED and tThisFlip >= 0.0-frameTolerance:
+                    # keep track of start time/frame for later
+                    Eyes.frameNStart = frameN  # exact frame index
+                    Eyes.tStart = t  # local t and not account for scr refresh
+                    Eyes.tStartRefresh = tThisFlipGlobal  # on global time
+                    win.timeOnFlip(Eyes, 'tStartRefresh')  # time at next scr refresh
+                    # add timestamp to datafile
+                    thisExp.timestampOnFlip(win, 'Eyes.started')
+                    # update status
+                    Eyes.status = STARTED
+                    Eyes.setAutoDraw(True)
+                
+                # if Eyes is active this frame...
+                if Eyes.status == STARTED:
+                    # update params
+                    pass
+                
+                # if Eyes is stopping this frame...
+                if Eyes.status == STARTED:
+                    # is it time to stop? (based on global clock, using actual start)
+                    if tThisFlipGlobal > Eyes.tStartRefresh + trialDuration-frameTolerance:
+                        # keep track of stop time/frame for later
+                        Eyes.tStop = t  # not accounting for scr refresh
+                        Eyes.tStopRefresh = tThisFlipGlobal  # on global time
+                        Eyes.frameNStop = frameN  # exact frame index
                         # add timestamp to datafile
-                        thisExp.timestampOnFlip(win, 'Eyes.started')
+                        thisExp.timestampOnFlip(win, 'Eyes.stopped')
                         # update status
-                        Eyes.status = STARTED
-                        Eyes.setAutoDraw(True)
-                    
-                    # if Eyes is active this frame...
-                    if Eyes.status == STARTED:
-                        # update params
-                        pass
-                    
-                    # if Eyes is stopping this frame...
-                    if Eyes.status == STARTED:
-                        # is it time to stop? (based on global clock, using actual start)
-                        if tThisFlipGlobal > Eyes.tStartRefresh + 0.002-frameTolerance:
-                            # keep track of stop time/frame for later
-                            Eyes.tStop = t  # not accounting for scr refresh
-                            Eyes.tStopRefresh = tThisFlipGlobal  # on global time
-                            Eyes.frameNStop = frameN  # exact frame index
-                            # add timestamp to datafile
-                            thisExp.timestampOnFlip(win, 'Eyes.stopped')
-                            # update status
-                            Eyes.status = FINISHED
-                            Eyes.setAutoDraw(False)
-                    
-                    # *prog* updates
-                    
-                    # if prog is starting this frame...
-                    if prog.status == NOT_STARTED and tThisFlip >= 0-frameTolerance:
-                        # keep track of start time/frame for later
-                        prog.frameNStart = frameN  # exact frame index
-                        prog.tStart = t  # local t and not account for scr refresh
-                        prog.tStartRefresh = tThisFlipGlobal  # on global time
-                        win.timeOnFlip(prog, 'tStartRefresh')  # time at next scr refresh
+                        Eyes.status = FINISHED
+                        Eyes.setAutoDraw(False)
+                
+                # *prog* updates
+                
+                # if prog is starting this frame...
+                if prog.status == NOT_STARTED and tThisFlip >= 0-frameTolerance:
+                    # keep track of start time/frame for later
+                    prog.frameNStart = frameN  # exact frame index
+                    prog.tStart = t  # local t and not account for scr refresh
+                    prog.tStartRefresh = tThisFlipGlobal  # on global time
+                    win.timeOnFlip(prog, 'tStartRefresh')  # time at next scr refresh
+                    # add timestamp to datafile
+                    thisExp.timestampOnFlip(win, 'prog.started')
+                    # update status
+                    prog.status = STARTED
+                    prog.setAutoDraw(True)
+                
+                # if prog is active this frame...
+                if prog.status == STARTED:
+                    # update params：每帧读取最新力值并更新进度条
+                    bar_h = uc.receive_sensor_value(prog)
+                    runForce.append(uc.sensor_value)
+                    runFrameT.append(round(tThisFlip, 4))
+                    if tracker is not None:
+                        runTarget.append(round(tracker.draw(tThisFlip, bar_h), 4))
+                
+                # if prog is stopping this frame...
+                if prog.status == STARTED:
+                    # is it time to stop? (based on global clock, using actual start)
+                    if tThisFlipGlobal > prog.tStartRefresh + trialDuration-frameTolerance:
+                        # keep track of stop time/frame for later
+                        prog.tStop = t  # not accounting for scr refresh
+                        prog.tStopRefresh = tThisFlipGlobal  # on global time
+                        prog.frameNStop = frameN  # exact frame index
                         # add timestamp to datafile
-                        thisExp.timestampOnFlip(win, 'prog.started')
+                        thisExp.timestampOnFlip(win, 'prog.stopped')
                         # update status
-                        prog.status = STARTED
-                        prog.setAutoDraw(True)
-                    
-                    # if prog is active this frame...
-                    if prog.status == STARTED:
-                        # update params
-                        prog.setProgress(bar_h, log=False)
-                    
-                    # if prog is stopping this frame...
-                    if prog.status == STARTED:
-                        # is it time to stop? (based on global clock, using actual start)
-                        if tThisFlipGlobal > prog.tStartRefresh + 0.002-frameTolerance:
-                            # keep track of stop time/frame for later
-                            prog.tStop = t  # not accounting for scr refresh
-                            prog.tStopRefresh = tThisFlipGlobal  # on global time
-                            prog.frameNStop = frameN  # exact frame index
-                            # add timestamp to datafile
-                            thisExp.timestampOnFlip(win, 'prog.stopped')
-                            # update status
-                            prog.status = FINISHED
-                            prog.setAutoDraw(False)
-                    
-                    # *polygon* updates
-                    
-                    # if polygon is starting this frame...
-                    if polygon.status == NOT_STARTED and tThisFlip >= 0.0-frameTolerance:
-                        # keep track of start time/frame for later
-                        polygon.frameNStart = frameN  # exact frame index
-                        polygon.tStart = t  # local t and not account for scr refresh
-                        polygon.tStartRefresh = tThisFlipGlobal  # on global time
-                        win.timeOnFlip(polygon, 'tStartRefresh')  # time at next scr refresh
+                        prog.status = FINISHED
+                        prog.setAutoDraw(False)
+                
+                # *polygon* updates
+                
+                # if polygon is starting this frame...
+                if polygon.status == NOT_STARTED and tThisFlip >= 0.0-frameTolerance:
+                    # keep track of start time/frame for later
+                    polygon.frameNStart = frameN  # exact frame index
+                    polygon.tStart = t  # local t and not account for scr refresh
+                    polygon.tStartRefresh = tThisFlipGlobal  # on global time
+                    win.timeOnFlip(polygon, 'tStartRefresh')  # time at next scr refresh
+                    # add timestamp to datafile
+                    thisExp.timestampOnFlip(win, 'polygon.started')
+                    # update status
+                    polygon.status = STARTED
+                    polygon.setAutoDraw(True)
+                
+                # if polygon is active this frame...
+                if polygon.status == STARTED:
+                    # update params
+                    pass
+                
+                # if polygon is stopping this frame...
+                if polygon.status == STARTED:
+                    # is it time to stop? (based on global clock, using actual start)
+                    if tThisFlipGlobal > polygon.tStartRefresh + trialDuration-frameTolerance:
+                        # keep track of stop time/frame for later
+                        polygon.tStop = t  # not accounting for scr refresh
+                        polygon.tStopRefresh = tThisFlipGlobal  # on global time
+                        polygon.frameNStop = frameN  # exact frame index
                         # add timestamp to datafile
-                        thisExp.timestampOnFlip(win, 'polygon.started')
+                        thisExp.timestampOnFlip(win, 'polygon.stopped')
                         # update status
-                        polygon.status = STARTED
-                        polygon.setAutoDraw(True)
-                    
-                    # if polygon is active this frame...
-                    if polygon.status == STARTED:
-                        # update params
-                        pass
-                    
-                    # if polygon is stopping this frame...
-                    if polygon.status == STARTED:
-                        # is it time to stop? (based on global clock, using actual start)
-                        if tThisFlipGlobal > polygon.tStartRefresh + 0.002-frameTolerance:
-                            # keep track of stop time/frame for later
-                            polygon.tStop = t  # not accounting for scr refresh
-                            polygon.tStopRefresh = tThisFlipGlobal  # on global time
-                            polygon.frameNStop = frameN  # exact frame index
-                            # add timestamp to datafile
-                            thisExp.timestampOnFlip(win, 'polygon.stopped')
-                            # update status
-                            polygon.status = FINISHED
-                            polygon.setAutoDraw(False)
-                    
-                    # check for quit (typically the Esc key)
-                    if defaultKeyboard.getKeys(keyList=["escape"]):
-                        thisExp.status = FINISHED
-                    if thisExp.status == FINISHED or endExpNow:
-                        endExperiment(thisExp, win=win)
-                        return
-                    # pause experiment here if requested
-                    if thisExp.status == PAUSED:
-                        pauseExperiment(
-                            thisExp=thisExp, 
-                            win=win, 
-                            timers=[routineTimer], 
-                            playbackComponents=[]
-                        )
-                        # skip the frame we paused on
-                        continue
-                    
-                    # check if all components have finished
-                    if not continueRoutine:  # a component has requested a forced-end of Routine
-                        run.forceEnded = routineForceEnded = True
-                        break
-                    continueRoutine = False  # will revert to True if at least one component still running
-                    for thisComponent in run.components:
-                        if hasattr(thisComponent, "status") and thisComponent.status != FINISHED:
-                            continueRoutine = True
-                            break  # at least one component has not yet finished
-                    
-                    # refresh the screen
-                    if continueRoutine:  # don't flip if this routine is over or we'll get a blank screen
-                        win.flip()
+                        polygon.status = FINISHED
+                        polygon.setAutoDraw(False)
+                
+                # check for quit (typically the Esc key)
+                if defaultKeyboard.getKeys(keyList=["escape"]):
+                    thisExp.status = FINISHED
+                if thisExp.status == FINISHED or endExpNow:
+                    endExperiment(thisExp, win=win)
+                    return
+                # pause experiment here if requested
+                if thisExp.status == PAUSED:
+                    pauseExperiment(
+                        thisExp=thisExp, 
+                        win=win, 
+                        timers=[routineTimer], 
+                        playbackComponents=[]
+                    )
+                    # skip the frame we paused on
+                    continue
                 
-                # --- Ending Routine "run" ---
+                # check if all components have finished
+                if not continueRoutine:  # a component has requested a forced-end of Routine
+                    run.forceEnded = routineForceEnded = True
+                    break
+                continueRoutine = False  # will revert to True if at least one component still running
                 for thisComponent in run.components:
-                    if hasattr(thisComponent, "setAutoDraw"):
-                        thisComponent.setAutoDraw(False)
-                # store stop times for run
-                run.tStop = globalClock.getTime(format='float')
-                run.tStopRefresh = tThisFlipGlobal
-                thisExp.addData('run.stopped', run.tStop)
-                # using non-slip timing so subtract the expected duration of this Routine (unless ended on request)
-                if run.maxDurationReached:
-                    routineTimer.addTime(-run.maxDuration)
-                elif run.forceEnded:
-                    routineTimer.reset()
-                else:
-                    routineTimer.addTime(-0.002000)
-                thisExp.nextEntry()
+                    if hasattr(thisComponent, "status") and thisComponent.status != FINISHED:
+                        continueRoutine = True
+                        break  # at least one component has not yet finished
                 
-            # completed 2500.0 repeats of 'trials_3'
+                # refresh the screen
+                if continueRoutine:  # don't flip if this routine is over or we'll get a blank screen
+                    win.flip()
+            
+            # --- Ending Routine "run" ---
+            for thisComponent in run.components:
+                if hasattr(thisComponent, "setAutoDraw"):
+                    thisComponent.setAutoDraw(False)
+            # store stop times for run
+            run.tStop = globalClock.getTime(format='float')
+            run.tStopRefresh = tThisFlipGlobal
+            thisExp.addData('run.stopped', run.tStop)
+            # 逐帧数据各存为一列（列表），整个 trial 只占一行
+            thisExp.addData('run.force', runForce)
+            thisExp.addData('run.frameT', runFrameT)
+            thisExp.addData('run.nFrames', len(runForce))
+            if tracker is not None:
+                thisExp.addData('run.target', runTarget)
+                # 追踪显示的帧间隔与绘制耗时
+                trackStats = tracker.stats()
+                for _key, _val in trackStats.items():
+                    thisExp.addData('track.' + _key, _val)
+                print("Tracking frames: {} (mean {} ms, p95 {} ms, max {} ms, {} late), draw {} us".format(
+                    trackStats['frames'], trackStats.get('frame_ms_mean'), trackStats.get('frame_ms_p95'),
+                    trackStats.get('frame_ms_max'), trackStats.get('late_frames'), trackStats.get('draw_us_mean')))
+            # 时钟同步估计：globalClock、本进程 perf_counter 与记录端时钟的对应关系
+            for _key, _val in uc.clock_estimate(globalClock).items():
+                thisExp.addData('clock.' + _key, _val)
+            # using non-slip timing so subtract the expected duration of this Routine (unless ended on request)
+            if run.maxDurationReached:
+                routineTimer.addTime(-run.maxDuration)
+            elif run.forceEnded:
+                routineTimer.reset()
+            else:
+                routineTimer.addTime(-trialDuration)
             
             if thisSession is not None:
                 # if running in a Session with a Liaison client, send data up to now
@@ -1058,6 +1077,16 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
             # update component parameters for each repeat
             # Run 'Begin Routine' code from code_4
             uc.send_trigger(0x00)
+            if tracker is not None:
+                # 记录端在线算好的追踪误差，写入数据并显示在休息界面
+                trackResult = uc.tracking_result() or {}
+                for _key in ('rmse', 'mae', 'bias', 'lag_ms', 'lag_r'):
+                    thisExp.addData('track.' + _key, trackResult.get(_key))
+                if trackResult.get('rmse') is not None:
+                    text_5.setText('请休息\n\n误差 {:.0f}，滞后 {:.0f} ms'.format(
+                        trackResult['rmse'], trackResult.get('lag_ms') or 0))
+                else:
+                    text_5.setText('请休息')
             # store start times for rest
             rest.tStartRefresh = win.getFutureFlipTime(clock=globalClock)
             rest.tStart = globalClock.getTime(format='float')
@@ -1171,9 +1200,11 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
                 routineTimer.reset()
             else:
                 routineTimer.addTime(-4.000000)
+            uc.mark('trial_end', trials.thisN)
             thisExp.nextEntry()
             
         # completed 5.0 repeats of 'trials'
+        uc.mark('block_end', trials_2.thisN)
         
         if thisSession is not None:
             # if running in a Session with a Liaison client, send data up to now
@@ -1425,6 +1456,8 @@ if __name__ == '__main__':
     logFile = setupLogging(filename=thisExp.dataFileName)
     win = setupWindow(expInfo=expInfo)
     setupDevices(expInfo=expInfo, thisExp=thisExp, win=win)
+    # 被试信息随力数据一起保存（发给记录端，无需另存文件）
+    uc.send_meta('participant', **expInfo)
     run(
         expInfo=expInfo, 
         thisExp=thisExp, 
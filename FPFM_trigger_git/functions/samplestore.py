@@ -0,0 +1,56 @@
+# 紧凑的列式采样存储（替代 DataRecorder 中的三个 Python list）
+import numpy as np
+
+CHUNK_ROWS = 1 << 16  # 每块 65536 行，20Hz 下约 55 分钟
+
+
+class SampleStore:
+    """Column store that grows in fixed-size, preallocated chunks.
+
+    ``columns`` is a sequence of ``(name, dtype)`` pairs.  ``append`` writes
+    one row into the current chunk in place, so there is no per-sample
+    allocation; when a chunk is full a new one of the same size is allocated.
+    """
+
+    def __init__(self, columns, chunk_rows=CHUNK_ROWS):
+        self.columns = tuple((name, np.dtype(dtype)) for name, dtype in columns)
+        self.chunk_rows = int(chunk_rows)
+        self._sealed = []   # 已写满的块: [tuple(ndarray, ...)]
+        self._cur = self._new_chunk()
+        self._n = 0         # 当前块已写行数
+
+    def _new_chunk(self):
+        return tuple(np.empty(self.chunk_rows, dtype=dt) for _, dt in self.columns)
+
+    def append(self, *values):
+        i = self._n
+        if i == self.chunk_rows:
+            self._sealed.append(self._cur)
+            self._cur = self._new_chunk()
+            i = 0
+        for col, v in zip(self._cur, values):
+            col[i] = v
+        self._n = i + 1
+
+    def __len__(self):
+        return len(self._sealed) * self.chunk_rows + self._n
+
+    @property
+    def nbytes_per_row(self):
+        return sum(dt.itemsize for _, dt in self.columns)
+
+    def arrays(self):
+        """Return ``{name: ndarray}`` with the rows recorded so far.
+
+        While everything fits in one chunk the arrays are views of the
+        store's own buffers (no copy); only a store spanning several chunks
+        has to concatenate them.
+        """
+        out = {}
+        for k, (name, _) in enumerate(self.columns):
+            tail = self._cur[k][:self._n]
+            if self._sealed:
+                out[name] = np.concatenate([c[k] for c in self._sealed] + [tail])
+            else:
+                out[name] = tail
+        return out
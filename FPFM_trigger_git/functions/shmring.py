@@ -0,0 +1,214 @@
+# 基于 multiprocessing.shared_memory 的单写多读环形缓冲区
+"""
+Single-writer, multi-reader ring of ``(seq, t_ns, value, flags)`` records.
+
+Layout of the shared block::
+
+    header  magic:u4 version:u4 capacity:u4 record_size:u4 lock:u8 head:u8
+    records capacity * RECORD_DTYPE
+
+Rings for other record layouts (e.g. ``RAW_DTYPE``, the sampler process's
+readings) pass their own structured ``dtype``; it must start with ``seq``
+and have the same fields on the writer and reader side.
+
+``lock`` is a seqlock counter: the writer makes it odd before touching a
+record and even again afterwards.  A reader that sees the same even value
+before and after its read knows the data it read is consistent; otherwise
+it retries.  ``head`` counts records ever written, so slot
+``(head - 1) % capacity`` holds the newest one.
+"""
+import time
+import struct
+
+import numpy as np
+from multiprocessing import shared_memory
+
+MAGIC = 0x46504652  # 'FPFR'
+VERSION = 1
+HEADER_DTYPE = np.dtype([
+    ('magic', '<u4'), ('version', '<u4'), ('capacity', '<u4'), ('record_size', '<u4'),
+    ('lock', '<u8'), ('head', '<u8'),
+])
+RECORD_DTYPE = np.dtype([('seq', '<u8'), ('t_ns', '<i8'), ('value', '<i4'), ('flags', '<u4')])
+# 采样子进程交给主进程的原始读数：另带轮询延迟与往返时间
+RAW_DTYPE = np.dtype(RECORD_DTYPE.descr + [('lateness_us', '<i4'), ('rtt_us', '<i4')])
+DEFAULT_CAPACITY = 4096
+
+# 热路径用 struct 直接读写共享内存，比结构化 ndarray 字段访问快一个数量级
+_U64 = struct.Struct('<Q')
+_RECORD = struct.Struct('<QqiI')
+_STRUCT_CODES = {('u', 8): 'Q', ('i', 8): 'q', ('u', 4): 'I', ('i', 4): 'i', ('u', 2): 'H', ('i', 2): 'h'}
+_LOCK_OFF = HEADER_DTYPE.fields['lock'][1]
+_HEAD_OFF = HEADER_DTYPE.fields['head'][1]
+_REC_OFF = HEADER_DTYPE.itemsize
+CHANNEL_SHIFT = 16  # 与 protocol.CHANNEL_SHIFT 一致：flags 的 16-23 位为传感器通道
+
+
+def _untrack(shm):
+    # 读端 attach 后不让 resource_tracker 在进程退出时删除共享内存（Python < 3.13 的已知问题）
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+def record_struct(dtype):
+    """``struct.Struct`` packing one record of the structured ``dtype``."""
+    return struct.Struct('<' + ''.join(_STRUCT_CODES[(dtype[name].kind, dtype[name].itemsize)]
+                                       for name in dtype.names))
+
+
+class _Ring:
+    def _map(self, shm, dtype=RECORD_DTYPE):
+        self.shm = shm
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+        capacity = int(self.header['capacity'])
+        self.dtype = dtype
+        self._record = _RECORD if dtype == RECORD_DTYPE else record_struct(dtype)
+        self.records = np.ndarray((capacity,), dtype=dtype, buffer=shm.buf,
+                                  offset=HEADER_DTYPE.itemsize)
+        self.capacity = capacity
+        self.buf = shm.buf
+
+    @property
+    def name(self):
+        return self.shm.name
+
+
+class ShmRingWriter(_Ring):
+    """Create the ring and publish records into it (one writer only).
+
+    With ``create=False`` an existing ring is opened for writing instead,
+    e.g. by a child process writing into a ring its parent created and
+    will remove.  ``untrack`` is as for ``ShmRingReader``.
+    """
+
+    def __init__(self, name=None, capacity=DEFAULT_CAPACITY, dtype=RECORD_DTYPE, create=True, untrack=True):
+        if not create:
+            shm = shared_memory.SharedMemory(name=name)
+            if untrack:
+                _untrack(shm)
+            self.owner = False
+            self._map(shm, dtype)
+            return
+        size = HEADER_DTYPE.itemsize + capacity * dtype.itemsize
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # 上次异常退出遗留的同名共享内存
+            old = shared_memory.SharedMemory(name=name)
+            old.close()
+            old.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['capacity'] = capacity
+        header['record_size'] = dtype.itemsize
+        header['lock'] = 0
+        header['head'] = 0
+        del header
+        self.owner = True
+        self._map(shm, dtype)
+
+    def publish(self, seq, t_ns, value, flags=0, *extra):
+        buf = self.buf
+        record = self._record
+        lock, = _U64.unpack_from(buf, _LOCK_OFF)
+        head, = _U64.unpack_from(buf, _HEAD_OFF)
+        _U64.pack_into(buf, _LOCK_OFF, lock + 1)      # 奇数：写入中
+        record.pack_into(buf, _REC_OFF + (head % self.capacity) * record.size,
+                         seq, t_ns, value, flags, *extra)
+        _U64.pack_into(buf, _HEAD_OFF, head + 1)
+        _U64.pack_into(buf, _LOCK_OFF, lock + 2)      # 偶数：写入完成
+
+    def close(self):
+        self.header = self.records = self.buf = None
+        self.shm.close()
+        if not self.owner:
+            return
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ShmRingReader(_Ring):
+    """Attach to an existing ring; any number of readers may watch it.
+
+    ``untrack=False`` is for the creating process itself and its
+    multiprocessing children, which share its resource tracker and must
+    leave the ring registered there.
+    """
+
+    def __init__(self, name, dtype=RECORD_DTYPE, untrack=True):
+        shm = shared_memory.SharedMemory(name=name)
+        if untrack:
+            _untrack(shm)
+        self._map(shm, dtype)
+        if int(self.header['magic']) != MAGIC or int(self.header['version']) != VERSION:
+            raise ValueError(f"shared memory {name!r} is not an FPFM ring")
+        if int(self.header['record_size']) not in (0, dtype.itemsize):
+            raise ValueError(f"shared memory {name!r} holds {int(self.header['record_size'])}-byte records, "
+                             f"expected {dtype.itemsize}")
+
+    @property
+    def head(self):
+        return _U64.unpack_from(self.buf, _HEAD_OFF)[0]
+
+    def latest(self, retries=100, channel=None, scan=64):
+        """Return the newest ``(seq, t_ns, value, flags)``, or None if empty.
+
+        With ``channel`` set, return the newest record of that sensor
+        channel (``flags`` bits 16-23), looking back at most ``scan`` records.
+        """
+        buf = self.buf
+        for _ in range(retries):
+            s1, = _U64.unpack_from(buf, _LOCK_OFF)
+            if s1 & 1:
+                continue
+            head, = _U64.unpack_from(buf, _HEAD_OFF)
+            if head == 0:
+                return None
+            out = None
+            for back in range(1, min(head, scan, self.capacity) + 1):
+                rec = self._record.unpack_from(buf, _REC_OFF + ((head - back) % self.capacity) * self._record.size)
+                if channel is None or (rec[3] >> CHANNEL_SHIFT) & 0xFF == channel:
+                    out = rec
+                    break
+            if _U64.unpack_from(buf, _LOCK_OFF)[0] == s1:
+                return out
+        return None
+
+    def read_since(self, cursor, retries=1000):
+        """Return ``(records, new_cursor)`` for everything written after ``cursor``.
+
+        ``records`` is a copy, so it stays valid after the writer wraps; if
+        the reader fell more than ``capacity`` behind, the oldest records
+        are skipped.  A writer killed in the middle of ``publish`` leaves
+        ``lock`` odd for good: after ``retries`` failed attempts the records
+        before ``head`` are returned anyway (``head`` only moves once a
+        record is complete), without the slot a live writer would be
+        overwriting.
+        """
+        buf = self.buf
+        for attempt in range(retries):
+            s1, = _U64.unpack_from(buf, _LOCK_OFF)
+            if s1 & 1:
+                if attempt % 64 == 63:
+                    time.sleep(0)  # 让出 GIL
+                continue
+            head, = _U64.unpack_from(buf, _HEAD_OFF)
+            start = max(cursor, head - self.capacity)
+            idx = np.arange(start, head) % self.capacity
+            out = self.records[idx]   # fancy indexing copies
+            if _U64.unpack_from(buf, _LOCK_OFF)[0] == s1:
+                return out, head
+        head, = _U64.unpack_from(buf, _HEAD_OFF)
+        start = max(cursor, head - self.capacity + 1)
+        return self.records[np.arange(start, head) % self.capacity], head
+
+    def close(self):
+        self.header = self.records = self.buf = None
+        self.shm.close()
@@ -0,0 +1,318 @@
+# 基于伪终端(pty)的虚拟 Runeskee 压力传感器与 Neuracle TriggerBox，用于无硬件时测试
+"""
+Virtual serial devices on pseudo-terminal pairs (Linux/macOS only).
+
+``SensorSimulator`` answers Modbus RTU read requests such as
+``01 03 00 00 00 01 84 0A`` with valid ``01 03 02 HI LO CRC`` frames whose
+value comes from a waveform or a recorded .mat file.  ``TriggerBoxSimulator``
+speaks the ``SendCommand``/``ReadResponse`` protocol of ``triggerBox.py``.
+Each simulator owns the master side of a pty; point the code under test at
+``sim.port`` (the slave path)::
+
+    python simulators.py both --waveform square --delay-ms 3 --jitter-ms 1
+    FPFM_SERIAL_PORT=/dev/pts/5 FPFM_TRIGGER_COM=/dev/pts/6 python CMCUreader.py R FinFor
+"""
+import os
+import sys
+import time
+import math
+import random
+import select
+import struct
+import argparse
+import threading
+from collections import deque
+
+import numpy as np
+
+try:
+    from .modbus import build_read_response, crc16, READ_HOLDING
+except Exception:
+    from modbus import build_read_response, crc16, READ_HOLDING
+
+EVENT_HISTORY = 4096  # TriggerBox 模拟器保留的最近事件数
+
+
+def _open_pty():
+    try:
+        import pty
+        import tty
+    except ImportError:
+        raise RuntimeError("pseudo-terminals are not available on this platform")
+    master, slave = pty.openpty()
+    tty.setraw(slave)  # 关闭回显和行缓冲，字节原样透传
+    return master, slave, os.ttyname(slave)
+
+
+class PtySimulator(threading.Thread):
+    """Serve a byte protocol on the master side of a pty pair."""
+
+    def __init__(self, name):
+        super().__init__(name=name, daemon=True)
+        self.master, self._slave, self.port = _open_pty()
+        self.stop_event = threading.Event()
+        self._buf = bytearray()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                ready, _, _ = select.select([self.master], [], [], 0.1)
+                if not ready:
+                    continue
+                data = os.read(self.master, 4096)
+            except OSError:
+                break
+            if data:
+                self._buf += data
+                self.handle()
+
+    def handle(self):
+        raise NotImplementedError
+
+    def write(self, data):
+        os.write(self.master, data)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join(timeout=1.0)
+        for fd in (self.master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def waveform(kind='sine', low=0.0, high=600.0, period=2.0):
+    """Return ``f(t_seconds) -> value`` for a named waveform."""
+    span = high - low
+    if kind == 'constant':
+        return lambda t: high
+    if kind in ('square', 'step'):
+        # 前半周期为 low，后半周期为 high，便于测量阶跃延迟
+        return lambda t: high if (t % period) >= period / 2 else low
+    if kind == 'ramp':
+        return lambda t: low + span * ((t % period) / period)
+    if kind == 'sine':
+        return lambda t: low + span * 0.5 * (1.0 - math.cos(2 * math.pi * t / period))
+    raise ValueError(f"unknown waveform {kind!r}")
+
+
+def mat_source(path, rate_hz=None):
+    """Replay ``sensor_data`` from a recorded .mat file (looping) as ``f(t_seconds)``."""
+    from scipy.io import loadmat
+    mat = loadmat(path)
+    values = np.asarray(mat['sensor_data']).ravel().astype(np.int64)
+    if values.size == 0:
+        raise ValueError(f"{path} has no sensor_data")
+    if rate_hz is None:
+        rate_hz = float(np.asarray(mat['sample_rate']).ravel()[0]) if 'sample_rate' in mat else 20.0
+    n = values.size
+    return lambda t: int(values[int(t * rate_hz) % n])
+
+
+class SensorSimulator(PtySimulator):
+    """Runeskee force sensor: Modbus RTU function 0x03 over a pty.
+
+    ``source`` maps seconds since start to a force value.  ``slave`` may be
+    a list of addresses to simulate several sensors on one RS-485 bus; then
+    ``source`` may be a dict ``{slave: source}``.  Every reply is
+    delayed by ``delay_s`` plus a uniform ``±jitter_s``, a request is
+    left unanswered with probability ``drop_rate``, and with probability
+    ``corrupt_rate`` the reply loses one byte or has one bit flipped.  Requests with a bad
+    CRC are ignored, like the real device does.  ``on_reply(t_ns, value)``
+    is called after each reply has been written.
+    """
+
+    def __init__(self, source=None, delay_s=0.0, jitter_s=0.0, drop_rate=0.0, slave=1, seed=None,
+                 on_reply=None, corrupt_rate=0.0):
+        super().__init__('SensorSimulator')
+        self.slaves = tuple(slave) if isinstance(slave, (list, tuple)) else (slave,)
+        self.slave = self.slaves[0]
+        self.sources = source if isinstance(source, dict) else {s: source or waveform() for s in self.slaves}
+        self.source = self.sources[self.slave]
+        self.delay_s = delay_s
+        self.jitter_s = jitter_s
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.rng = random.Random(seed)
+        self.on_reply = on_reply
+        self.t0_ns = time.perf_counter_ns()
+        self.requests = 0
+        self.replies = 0
+        self.dropped = 0
+        self.bad_crc = 0
+        self.corrupted = 0
+
+    def value_at(self, t, slave=None):
+        source = self.source if slave is None else self.sources[slave]
+        return int(min(max(source(t), 0), 0xFFFF))
+
+    def handle(self):
+        buf = self._buf
+        while len(buf) >= 8:
+            slave, func = buf[0], buf[1]
+            if slave not in self.slaves or func != READ_HOLDING:
+                del buf[0]
+                continue
+            if crc16(buf[:6]) != struct.unpack_from('<H', buf, 6)[0]:
+                self.bad_crc += 1
+                del buf[0]
+                continue
+            count = struct.unpack_from('>H', buf, 4)[0]
+            del buf[:8]
+            self.requests += 1
+            self.reply(count, slave)
+
+    def reply(self, count, slave=None):
+        slave = self.slave if slave is None else slave
+        if self.drop_rate and self.rng.random() < self.drop_rate:
+            self.dropped += 1
+            return
+        delay = self.delay_s + (self.rng.uniform(-self.jitter_s, self.jitter_s) if self.jitter_s else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        value = self.value_at((time.perf_counter_ns() - self.t0_ns) / 1e9, slave)
+        frame = bytearray(build_read_response(slave, [value] + [0] * (max(count, 1) - 1)))
+        if self.corrupt_rate and self.rng.random() < self.corrupt_rate:
+            pos = self.rng.randrange(len(frame))
+            if self.rng.random() < 0.5:
+                del frame[pos]
+            else:
+                frame[pos] ^= 1 << self.rng.randrange(8)
+            self.corrupted += 1
+        self.write(bytes(frame))
+        self.replies += 1
+        if self.on_reply is not None:
+            self.on_reply(time.perf_counter_ns(), value)
+
+
+class TriggerBoxSimulator(PtySimulator):
+    """Neuracle TriggerBox: ``<2BH`` header (deviceID, functionID, payload length) + payload.
+
+    Answers the device-name, device-info, sensor-info, sensor-parameter,
+    sensor-sample and event-output functions; every output event is kept
+    in ``events`` as ``(perf_counter_ns, code)``.
+    """
+    HEADER = struct.Struct('<2BH')
+
+    def __init__(self, device_id=1, name='TriggerBox-SIM', device_serial=0x46504653):
+        super().__init__('TriggerBoxSimulator')
+        self.device_id = device_id
+        self.device_name = name
+        self.device_serial = device_serial
+        # (类型, 编号): DigitalIN 1, Light 1
+        self.sensors = [(1, 1), (2, 1)]
+        # Edge, OutputChannel, TriggerToBeOut, Threshold, EventData
+        self.params = {s: [0, 0, 0, 0, 0] for s in self.sensors}
+        self.events = deque(maxlen=EVENT_HISTORY)
+
+    def handle(self):
+        buf = self._buf
+        while len(buf) >= self.HEADER.size:
+            device_id, func, plen = self.HEADER.unpack_from(buf)
+            if len(buf) < self.HEADER.size + plen:
+                return
+            payload = bytes(buf[self.HEADER.size:self.HEADER.size + plen])
+            del buf[:self.HEADER.size + plen]
+            if device_id != self.device_id:
+                self.error(4)
+                continue
+            self.dispatch(func, payload)
+
+    def respond(self, func, payload=b''):
+        self.write(self.HEADER.pack(self.device_id, func, len(payload)) + payload)
+
+    def error(self, code):
+        self.respond(131, bytes([code]))
+
+    def dispatch(self, func, payload):
+        if func == 225:      # OutputEventData
+            if len(payload) != 2:
+                return self.error(2)
+            self.events.append((time.perf_counter_ns(), struct.unpack('<H', payload)[0]))
+            self.respond(func, payload)
+        elif func == 4:      # DeviceNameGet
+            self.respond(func, self.device_name.encode())
+        elif func == 3:      # DeviceInfoGet: 硬件版本、固件版本、传感器数、保留、ID
+            self.respond(func, struct.pack('<4BI', 1, 1, len(self.sensors), 0, self.device_serial))
+        elif func == 6:      # SensorInfoGet
+            self.respond(func, bytes(b for s in self.sensors for b in s))
+        elif func in (1, 5):  # SensorParaGet / SensorSampleGet
+            key = tuple(payload[:2])
+            if key not in self.params:
+                return self.error(3)
+            if func == 1:
+                self.respond(func, struct.pack('<2B3H', *self.params[key]))
+            else:
+                self.respond(func, payload[:2] + struct.pack('<H', 0))
+        elif func == 2:      # SensorParaSet
+            if len(payload) != struct.calcsize('<4B3H'):
+                return self.error(2)
+            fields = struct.unpack('<4B3H', payload)
+            key = fields[:2]
+            if key not in self.params:
+                return self.error(3)
+            self.params[key] = list(fields[2:])
+            self.respond(func, payload[:2])
+        else:
+            self.error(5)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='虚拟压力传感器 / TriggerBox（pty）')
+    parser.add_argument('device', choices=('sensor', 'trigger', 'both'), nargs='?', default='both')
+    parser.add_argument('--waveform', default='sine', choices=('sine', 'square', 'step', 'ramp', 'constant'))
+    parser.add_argument('--low', type=float, default=0.0)
+    parser.add_argument('--high', type=float, default=600.0)
+    parser.add_argument('--period', type=float, default=2.0, help='waveform period (s)')
+    parser.add_argument('--mat', help='replay sensor_data from a recorded .mat file')
+    parser.add_argument('--mat-rate', type=float, help='replay rate (Hz) for --mat')
+    parser.add_argument('--delay-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--drop', type=float, default=0.0, help='probability of not answering')
+    parser.add_argument('--corrupt', type=float, default=0.0, help='probability of a damaged reply')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--ports', type=int, default=1, help='number of sensor ports')
+    parser.add_argument('--slaves', default='1', help='slave IDs on every sensor port, e.g. 1,2')
+    args = parser.parse_args(argv)
+
+    sims = []
+    if args.device in ('sensor', 'both'):
+        slaves = [int(x) for x in args.slaves.split(',') if x.strip()]
+        sensors = []
+        for i in range(args.ports):
+            # 每个传感器（端口 i、从站 j）的波形错开相位，便于区分通道
+            sources = {}
+            for j, slave in enumerate(slaves):
+                base = mat_source(args.mat, args.mat_rate) if args.mat else \
+                    waveform(args.waveform, args.low, args.high, args.period)
+                shift = args.period * (i * len(slaves) + j) / (args.ports * len(slaves))
+                sources[slave] = (lambda f, d: lambda t: f(t + d))(base, shift)
+            sensor = SensorSimulator(sources, args.delay_ms / 1000.0, args.jitter_ms / 1000.0,
+                                     args.drop, slave=slaves, seed=args.seed, corrupt_rate=args.corrupt)
+            sims.append(sensor)
+            sensors += [f"{sensor.port}:{slave}" for slave in slaves]
+        print(f"FPFM_SERIAL_PORT={sims[0].port}")
+        if len(sensors) > 1:
+            print(f"FPFM_SENSORS={','.join(sensors)}")
+    if args.device in ('trigger', 'both'):
+        box = TriggerBoxSimulator()
+        sims.append(box)
+        print(f"FPFM_TRIGGER_COM={box.port}")
+    for sim in sims:
+        sim.start()
+    print("Simulators running, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for sim in sims:
+            sim.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
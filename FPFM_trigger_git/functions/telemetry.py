@@ -0,0 +1,142 @@
+# 采集服务器的运行指标：计数器、瞬时值和直方图
+"""
+Lightweight runtime metrics for the acquisition server.
+
+Metrics are plain objects updated in the hot loops with an integer add or
+a ``bisect`` into fixed bucket edges, so recording costs well under a
+microsecond.  Counters and histograms may be updated from several threads
+(one polling worker per serial port) and take a small lock to do so;
+readers (the control server, the summary line) take a snapshot without it
+that may be a few updates stale, which is fine for monitoring.
+"""
+import time
+import threading
+from bisect import bisect_left
+
+# 默认直方图分桶（微秒）：覆盖 10us ~ 1s
+US_EDGES = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000, 500000, 1000000)
+
+
+class Counter:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+
+class Gauge:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    """Fixed-bucket histogram; ``counts[i]`` holds values ``<= edges[i]``, the last bucket the rest."""
+
+    def __init__(self, edges=US_EDGES):
+        self.edges = tuple(edges)
+        self.counts = [0] * (len(self.edges) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.edges, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += value
+            if self.max is None or value > self.max:
+                self.max = value
+            if self.min is None or value < self.min:
+                self.min = value
+
+    def percentile(self, q):
+        """Upper edge of the bucket holding the ``q``-th percentile (the max for the last bucket)."""
+        if not self.count:
+            return None
+        rank = q / 100.0 * self.count
+        seen = 0
+        for i, c in enumerate(list(self.counts)):
+            seen += c
+            if seen >= rank and c:
+                return self.edges[i] if i < len(self.edges) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'edges': list(self.edges),
+            'counts': list(self.counts),
+        }
+
+
+class Registry:
+    """Named metrics plus per-second rates of the counters over the last ``tick`` interval."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.rates = {}
+        self._last_tick = (time.monotonic(), {})
+        self._refresh = []  # snapshot 前调用，更新按需计算的 gauge
+        self._lock = threading.Lock()
+
+    def counter(self, name):
+        with self._lock:
+            return self.counters.setdefault(name, Counter())
+
+    def gauge(self, name):
+        with self._lock:
+            return self.gauges.setdefault(name, Gauge())
+
+    def histogram(self, name, edges=US_EDGES):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(edges)
+            return self.histograms[name]
+
+    def on_snapshot(self, fn):
+        """Call ``fn()`` before every snapshot, e.g. to set a gauge too costly to update per sample."""
+        with self._lock:
+            self._refresh = self._refresh + [fn]
+
+    def tick(self):
+        """Update ``rates`` from the counter deltas since the previous tick."""
+        now = time.monotonic()
+        values = {name: c.value for name, c in self.counters.items()}
+        t_prev, prev = self._last_tick
+        dt = max(now - t_prev, 1e-9)
+        self.rates = {name: (v - prev.get(name, 0)) / dt for name, v in values.items()}
+        self._last_tick = (now, values)
+
+    def snapshot(self):
+        for fn in self._refresh:
+            fn()
+        return {
+            'time': time.time(),
+            'uptime_s': time.time() - self.started,
+            'counters': {name: c.value for name, c in self.counters.items()},
+            'rates_per_s': dict(self.rates),
+            'gauges': {name: g.value for name, g in self.gauges.items()},
+            'histograms': {name: h.snapshot() for name, h in self.histograms.items()},
+        }
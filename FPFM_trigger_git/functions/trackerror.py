@@ -0,0 +1,204 @@
+# 在线追踪误差：逐采样累加 RMSE、MAE、偏差，以及有界窗口内力与目标的互相关滞后
+"""
+Online tracking error between the recorded force and the target trajectory.
+
+``ErrorAccumulator`` keeps running sums, so every sample costs the same
+whatever the trial length:
+
+* error ``e = force - target``: count, sum, sum of ``|e|`` and of ``e**2``
+  give ``bias``, ``mae`` and ``rmse``;
+* for a fixed number ``taps`` of lags ``l`` spread evenly over
+  ``0..max_lag`` samples (force following the target), the sums of ``f``,
+  ``f**2``, ``g``, ``g**2`` and ``f*g`` over the pairs
+  ``(force[t], target[t - l])``.  The last ``max_lag + 1`` targets sit in
+  a doubled ring, so the lagged targets are one gather without a modulo.
+  Each sample adds to ``taps`` sums, whatever the window length or sample
+  rate, i.e. O(1) per sample.  The lag reported is the tap with the
+  largest Pearson correlation, refined by a parabola through it and its
+  two neighbours; no FFT involved.  With ``max_lag < taps`` every lag is a
+  tap and the estimate is exact to the sample.
+
+``TrackingMonitor`` runs one accumulator per trial: ``start`` arms it with
+the trial's target (spread over ``duration`` seconds from ``t0_ns``),
+``add`` feeds it every recorded row, and the trial finishes by itself once
+the samples pass its end (or on ``finish``).  Per trigger code it also
+pools the error of every tracked sample recorded under that code.
+"""
+import math
+import threading
+
+import numpy as np
+
+MAX_LAG_S = 1.0           # 互相关滞后的搜索范围（秒）
+LAG_TAPS = 16             # 搜索范围内均匀分布的滞后点数，即每个采样的固定开销
+TARGET_RANGE = (-0.5, 0.5)  # rbf_sequence 的取值范围，对应 0..force_scale
+
+
+class ErrorAccumulator:
+    """Running tracking error and force/target cross-correlation at ``taps`` lags up to ``max_lag`` samples."""
+
+    def __init__(self, max_lag, taps=LAG_TAPS):
+        self.width = int(max_lag) + 1
+        # 滞后点（采样数），升序且不重复
+        self.lags = np.unique(np.linspace(0, self.width - 1, min(int(taps), self.width)).round().astype(np.intp))
+        self._ring = np.zeros(2 * self.width)
+        self._pos = 0
+        self.n = 0
+        self.sum_e = 0.0
+        self.sum_abs = 0.0
+        self.sum_sq = 0.0
+        k = len(self.lags)
+        self._sf, self._sff, self._sg, self._sgg, self._sfg = (np.zeros(k) for _ in range(5))
+
+    def add(self, force, target):
+        e = force - target
+        self.n += 1
+        self.sum_e += e
+        self.sum_abs += abs(e)
+        self.sum_sq += e * e
+        # 新目标值写在环的两半，g[l] 即 l 个采样之前的目标
+        w = self.width
+        p = self._pos = (self._pos - 1) % w
+        self._ring[p] = self._ring[p + w] = target
+        # 只有 l < n 的滞后已有对应的目标值
+        m = len(self.lags) if self.n >= w else int(np.searchsorted(self.lags, self.n))
+        g = self._ring[p + self.lags[:m]]
+        self._sf[:m] += force
+        self._sff[:m] += force * force
+        self._sg[:m] += g
+        self._sgg[:m] += g * g
+        self._sfg[:m] += force * g
+
+    def lag(self):
+        """Return ``(lag_samples, r)`` with the largest correlation, or ``(None, None)``.
+
+        ``lag_samples`` is fractional when refined between taps.
+        """
+        n = self.n - self.lags
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = n * self._sfg - self._sf * self._sg
+            var = (n * self._sff - self._sf ** 2) * (n * self._sgg - self._sg ** 2)
+            r = np.where((n >= 3) & (var > 0), cov / np.sqrt(var), np.nan)
+        if np.all(np.isnan(r)):
+            return None, None
+        best = int(np.nanargmax(r))
+        lag = float(self.lags[best])
+        if 0 < best < len(r) - 1 and self.lags[best + 1] - self.lags[best - 1] > 2:
+            # 抛物线插值：峰值落在相邻两个滞后点之间
+            r0, r1, r2 = r[best - 1], r[best], r[best + 1]
+            curve = r0 - 2.0 * r1 + r2
+            if np.isfinite(curve) and curve < 0:
+                lag += 0.5 * (r0 - r2) / curve * (self.lags[best + 1] - self.lags[best - 1]) / 2.0
+        return float(lag), float(r[best])
+
+    def summary(self):
+        if not self.n:
+            return {'samples': 0, 'rmse': None, 'mae': None, 'bias': None}
+        return {
+            'samples': self.n,
+            'rmse': math.sqrt(self.sum_sq / self.n),
+            'mae': float(self.sum_abs / self.n),
+            'bias': float(self.sum_e / self.n),
+        }
+
+
+class TrackingMonitor:
+    """Per-trial tracking error of one force channel against the trial's target.
+
+    ``on_result(result)`` is called with every finished trial's result dict
+    (``trial``, ``code``, ``start_ns``, ``samples``, ``rmse``, ``mae``,
+    ``bias``, ``lag_ms``, ``lag_r``); force, target and errors are in sensor
+    units.
+    """
+
+    def __init__(self, period_ns, max_lag_s=MAX_LAG_S, on_result=None):
+        self.period_ns = period_ns
+        self.max_lag = max(1, int(round(max_lag_s * 1e9 / period_ns)))
+        self.on_result = on_result
+        self.results = {}   # trial -> result
+        self.codes = {}     # trigger 码 -> 该码下所有追踪采样的 [n, sum_e, sum_abs, sum_sq]
+        self._open = None
+        self.lock = threading.Lock()
+
+    def start(self, trial, target, t0_ns, duration, force_scale, channel=0, target_range=TARGET_RANGE):
+        """Track ``target`` (one trial's trajectory) from ``t0_ns`` for ``duration`` seconds."""
+        target = np.asarray(target, dtype=np.float64).ravel()
+        lo, hi = target_range
+        levels = np.clip((target - lo) / (hi - lo), 0.0, 1.0) * force_scale
+        end_ns = int(duration * 1e9)
+        with self.lock:
+            if self._open is not None:
+                self._finish()
+            self._open = {
+                'trial': int(trial), 'code': None, 't0_ns': int(t0_ns), 'end_ns': end_ns,
+                'levels': levels, 'per_ns': (len(levels) - 1) / float(end_ns), 'channel': channel,
+                'acc': ErrorAccumulator(self.max_lag),
+            }
+
+    def add(self, values, trigger, times):
+        """Feed one recorded row (a scalar or one value per channel)."""
+        tr = self._open
+        if tr is None:
+            return
+        if np.ndim(values):
+            values, times = values[tr['channel']], times[tr['channel']]
+        if not times:
+            return  # 该通道本节拍没有应答
+        with self.lock:
+            if tr is not self._open:
+                return
+            dt = int(times) - tr['t0_ns']
+            if dt < 0:
+                return
+            if dt > tr['end_ns']:
+                self._finish()
+                return
+            if tr['code'] is None:
+                tr['code'] = int(trigger)
+            levels = tr['levels']
+            k = dt * tr['per_ns']
+            i = min(int(k), len(levels) - 2)
+            f = k - i
+            target = float(levels[i] * (1.0 - f) + levels[i + 1] * f)
+            force = float(values)
+            tr['acc'].add(force, target)
+            pooled = self.codes.get(int(trigger))
+            if pooled is None:
+                pooled = self.codes[int(trigger)] = [0, 0.0, 0.0, 0.0]
+            e = force - target
+            pooled[0] += 1
+            pooled[1] += e
+            pooled[2] += abs(e)
+            pooled[3] += e * e
+
+    def _finish(self):
+        # 调用方持有锁
+        tr, self._open = self._open, None
+        acc = tr['acc']
+        lag, r = acc.lag()
+        result = dict(acc.summary(), trial=tr['trial'], code=tr['code'], start_ns=tr['t0_ns'],
+                      lag_ms=None if lag is None else lag * self.period_ns / 1e6, lag_r=r)
+        self.results[tr['trial']] = result
+        if self.on_result is not None:
+            self.on_result(result)
+        return result
+
+    def finish(self, trial=None):
+        """Finish the open trial (only if it is ``trial``, when given) and return its result."""
+        with self.lock:
+            tr = self._open
+            if tr is not None and (trial is None or tr['trial'] == trial):
+                return self._finish()
+        return None
+
+    def result(self, trial):
+        """The result of ``trial``, finishing it first if it is still open; None if unknown."""
+        return self.finish(trial) or self.results.get(trial)
+
+    def code_summary(self, code):
+        """Error pooled over every tracked sample recorded under trigger ``code``."""
+        with self.lock:
+            n, sum_e, sum_abs, sum_sq = self.codes.get(code, (0, 0.0, 0.0, 0.0))
+        if not n:
+            return {'samples': 0, 'rmse': None, 'mae': None, 'bias': None}
+        return {'samples': n, 'rmse': math.sqrt(sum_sq / n), 'mae': float(sum_abs / n), 'bias': float(sum_e / n)}
@@ -0,0 +1,171 @@
+# 追踪范式的滚动目标轨迹：每个 trial 上传一次顶点缓冲，逐帧只移动窗口偏移和光标
+"""
+Scrolling target trajectory for a force-tracking block.
+
+At the start of a trial ``start_trial`` converts the whole target
+trajectory to pixel vertices once and uploads them into a static OpenGL
+vertex buffer.  Per frame ``draw`` only computes the window offset (one
+translation) and the range of vertices currently visible, draws that
+slice of the buffer as a line strip, clipped to the panel, and moves the
+cursor; no vertex array is rebuilt while the trial runs.
+
+The panel is a rectangle in window units: time runs from right to left,
+the "now" line sits at ``now_x`` (fraction of the width from the left),
+``window_s`` seconds are visible, and force and target are drawn as
+fractions of the panel height (0 = bottom, 1 = top).
+
+Frame timing is kept per trial (``stats``): intervals between successive
+draws, i.e. the achieved frame period, and the CPU time of the draw call
+itself.
+"""
+import time
+import ctypes
+
+import numpy as np
+import pyglet.gl as GL
+from psychopy import visual
+from psychopy.tools.monitorunittools import convertToPix
+
+TARGET_RANGE = (-0.5, 0.5)  # rbf_sequence 的取值范围，映射到面板的底部和顶部
+
+
+class ScrollingTarget:
+    """Target line scrolling past a fixed "now" line, with a force cursor on it."""
+
+    def __init__(self, win, pos=(-0.15, 0.0), size=(1.1, 0.6), window_s=6.0, now_x=0.3,
+                 line_color=(1.0, -1.0, -1.0), line_width=3.0, cursor_radius=0.012,
+                 cursor_color=(-1.0, 0.0, 1.0), frame_rate=60.0):
+        self.win = win
+        self.pos = np.asarray(pos, dtype=np.float64)
+        self.size = np.asarray(size, dtype=np.float64)
+        self.window_s = float(window_s)
+        self.now_x = float(now_x)
+        # psychopy 的 rgb 颜色空间为 -1..1，GL 为 0..1
+        self.rgba = tuple((np.asarray(line_color, dtype=np.float64) + 1.0) / 2.0) + (1.0,)
+        self.line_width = line_width
+        self.frame_rate = frame_rate
+        self.cursor = visual.Circle(win, radius=cursor_radius, edges=24, units=win.units,
+                                    fillColor=cursor_color, lineColor=cursor_color, colorSpace='rgb')
+        self.now_line = visual.Line(win, start=self._panel_point(self.now_x, 0.0),
+                                    end=self._panel_point(self.now_x, 1.0), units=win.units,
+                                    lineColor=(0.4, 0.4, 0.4), colorSpace='rgb', lineWidth=1.0)
+        self._box = self._scissor_box()
+        self._vbo = None
+        self.levels = None
+        self.n = 0
+        self.rate = 0.0
+        self._frame_ns = np.zeros(0, dtype=np.int64)
+        self._draw_ns = np.zeros(0, dtype=np.int64)
+        self.frames = 0
+        self._last_ns = 0
+
+    def _panel_point(self, fx, fy):
+        """Window-unit position of the panel point at fractions ``(fx, fy)`` of its size."""
+        return tuple(self.pos + (np.array([fx, fy]) - 0.5) * self.size)
+
+    def _scissor_box(self):
+        # 面板在帧缓冲中的像素矩形（左下角为原点），裁掉可见范围两端伸出面板的线段
+        corners = convertToPix(np.array([[-0.5, -0.5], [0.5, 0.5]]) * self.size, self.pos,
+                               self.win.units, self.win)
+        size = np.asarray(self.win.size, dtype=np.float64)
+        scale = np.asarray(getattr(self.win, 'frameBufferSize', size), dtype=np.float64) / size
+        (x0, y0), (x1, y1) = (corners + size / 2.0) * scale
+        return int(x0), int(y0), int(np.ceil(x1 - x0)), int(np.ceil(y1 - y0))
+
+    def start_trial(self, target, duration, target_range=TARGET_RANGE):
+        """Upload ``target`` (spread over ``duration`` seconds) and reset the frame statistics."""
+        target = np.asarray(target, dtype=np.float64).ravel()
+        lo, hi = target_range
+        self.levels = np.clip((target - lo) / (hi - lo), 0.0, 1.0)
+        self.n = len(self.levels)
+        self.rate = (self.n - 1) / float(duration)  # 每秒经过的目标采样点数
+        # t = 0 时第 0 个点在 now 线上；平移量只在 draw 中随时间变化
+        xs = self.now_x + np.arange(self.n) / self.rate / self.window_s
+        verts = np.column_stack([xs, self.levels]) - 0.5
+        verts = convertToPix(verts * self.size, self.pos, self.win.units, self.win)
+        self._px_per_s = float(convertToPix(np.array([[self.size[0] / self.window_s, 0.0]]),
+                                            (0.0, 0.0), self.win.units, self.win)[0, 0])
+        self._upload(np.ascontiguousarray(verts, dtype=np.float32))
+        capacity = int(duration * self.frame_rate * 1.5) + 16
+        if len(self._frame_ns) < capacity:
+            self._frame_ns = np.zeros(capacity, dtype=np.int64)
+            self._draw_ns = np.zeros(capacity, dtype=np.int64)
+        self.frames = 0
+        self._last_ns = 0
+
+    def _upload(self, verts):
+        if self._vbo is None:
+            self._vbo = GL.GLuint()
+            GL.glGenBuffers(1, ctypes.byref(self._vbo))
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self._vbo)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, verts.nbytes, verts.ctypes.data_as(ctypes.c_void_p),
+                        GL.GL_STATIC_DRAW)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
+    def target_at(self, t):
+        """Target level (0..1) at ``t`` seconds into the trial, linearly interpolated."""
+        k = min(max(t * self.rate, 0.0), self.n - 1.0)
+        i = min(int(k), self.n - 2)
+        f = k - i
+        return self.levels[i] * (1.0 - f) + self.levels[i + 1] * f
+
+    def visible(self, t):
+        """``(first, count)`` of the vertices inside the panel at time ``t``."""
+        k = t * self.rate
+        first = max(int(k - self.now_x * self.window_s * self.rate), 0)
+        last = min(int(k + (1.0 - self.now_x) * self.window_s * self.rate) + 2, self.n)
+        return first, max(last - first, 0)
+
+    def draw(self, t, force_level):
+        """Draw the frame for ``t`` seconds into the trial; returns the target level at ``t``."""
+        t0 = time.perf_counter_ns()
+        first, count = self.visible(t)
+        self.now_line.draw()
+        if count >= 2:
+            self.win.setScale('pix')
+            GL.glPushAttrib(GL.GL_SCISSOR_BIT | GL.GL_LINE_BIT | GL.GL_CURRENT_BIT)
+            GL.glEnable(GL.GL_SCISSOR_TEST)
+            GL.glScissor(*self._box)
+            GL.glPushMatrix()
+            GL.glTranslatef(-t * self._px_per_s, 0.0, 0.0)
+            GL.glLineWidth(self.line_width)
+            GL.glColor4f(*self.rgba)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self._vbo)
+            GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
+            GL.glVertexPointer(2, GL.GL_FLOAT, 0, None)
+            GL.glDrawArrays(GL.GL_LINE_STRIP, first, count)
+            GL.glDisableClientState(GL.GL_VERTEX_ARRAY)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+            GL.glPopMatrix()
+            GL.glPopAttrib()
+        self.cursor.pos = self._panel_point(self.now_x, min(max(force_level, 0.0), 1.0))
+        self.cursor.draw()
+        t1 = time.perf_counter_ns()
+        i = self.frames
+        if i < len(self._frame_ns):
+            self._frame_ns[i] = t0 - self._last_ns if self._last_ns else 0
+            self._draw_ns[i] = t1 - t0
+            self.frames = i + 1
+        self._last_ns = t0
+        return self.target_at(t)
+
+    def stats(self):
+        """Frame period (ms) and draw time (us) of the current trial; ``late_frames`` counts periods over 1.5 frames."""
+        frame_ms = self._frame_ns[1:self.frames] / 1e6
+        draw_us = self._draw_ns[:self.frames] / 1e3
+        if not len(frame_ms):
+            return {'frames': self.frames}
+        return {
+            'frames': self.frames,
+            'frame_ms_mean': round(float(frame_ms.mean()), 3),
+            'frame_ms_p95': round(float(np.percentile(frame_ms, 95)), 3),
+            'frame_ms_max': round(float(frame_ms.max()), 3),
+            'late_frames': int(np.sum(frame_ms > 1.5e3 / self.frame_rate)),
+            'draw_us_mean': round(float(draw_us.mean()), 1),
+            'draw_us_max': round(float(draw_us.max()), 1),
+        }
+
+    def close(self):
+        if self._vbo is not None:
+            GL.glDeleteBuffers(1, ctypes.byref(self._vbo))
+            self._vbo = None
@@ -69,12 +69,20 @@ class TriggerBox(object):
     def OutputEventData(self, eventData):
         # directly mark trigger with serial
         # eventData is an unsigned short
+        self.WriteEventData(eventData)
+        return self.ReadEventAck()
+
+    def WriteEventData(self, eventData):
+        # only write the command, the response is read by ReadEventAck
         assert isinstance(eventData, int)
         msg = struct.pack('<H', eventData)
         self.SendCommand(self.functionIDOutputEventData, msg)
+
+    def ReadEventAck(self):
         resp = self.ReadResponse(self.functionIDOutputEventData)
         if self.tcpOutput is not None:
             self.tcpOutput.send(resp)
+        return resp
 
     def SetEventData(self, sensorID, eventData, triggerToBeOut=1):
         assert isinstance(eventData, int)
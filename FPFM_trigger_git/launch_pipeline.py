@@ -7,8 +7,18 @@ C:\tool\PsychoPy\python.
 This version reads config.yml and passes settings to target scripts via environment variables
 instead of modifying their source code.
 - ENV FPFM_SERIAL_PORT -> CMCUreader.py: serial port
+- ENV FPFM_SENSORS -> CMCUreader.py: several sensors as 'PORT:SLAVE, ...' (channels 0, 1, ...)
+- ENV FPFM_DISPLAY_CHANNEL -> UserCenter.py: sensor channel shown as feedback
+- ENV FPFM_STREAM_ROWS, FPFM_FSYNC -> CMCUreader.py: streaming chunk size and fsync policy
+- ENV FPFM_SAMPLE_RATE, FPFM_BAUD_RATE -> CMCUreader.py: poll rate (Hz) and sensor baud rate
+- ENV FPFM_SAMPLER -> CMCUreader.py: poll in a thread (default) or in a dedicated child process
+- ENV FPFM_TRANSPORT, FPFM_SOCKET_PATH -> CMCUreader.py and UserCenter.py: data socket transport (tcp/unix)
+- ENV FPFM_SHM_NAME -> CMCUreader.py creates / UserCenter.py attaches the shared-memory sample ring
 - ENV FPFM_SCREEN_SIZE -> run.py: window size WxH
+- ENV FPFM_TRIAL_DURATION -> run.py: seconds of force feedback per trial
+- ENV FPFM_TRACKING -> run.py: show a scrolling target trajectory to track instead of the static target
 - ENV FPFM_MAX_FORCE, FPFM_TOP_FORCE, FPFM_TRIGGER_COM, FPFM_SYNC_EEG -> UserCenter.py runtime
+- ENV FPFM_TARGET_SEED -> UserCenter.py: session seed of the target force trajectories
 - config.yml psychopy_py -> override PsychoPy python executable path
 
 Double-clicking the packaged EXE or running this script will:
@@ -134,6 +144,34 @@ def build_env_from_config(cfg: dict) -> dict:
     # CMCUreader serial port
     if 'serial_port' in cfg:
         env['FPFM_SERIAL_PORT'] = str(cfg['serial_port'])
+    # several sensors: 'COM5:1, COM7:1' or ['COM5:1', 'COM7:1']
+    if cfg.get('sensors'):
+        sensors = cfg['sensors']
+        if isinstance(sensors, (list, tuple)):
+            sensors = ','.join(s if isinstance(s, str) else f"{s[0]}:{s[1]}" for s in sensors)
+        env['FPFM_SENSORS'] = str(sensors)
+    if 'display_channel' in cfg:
+        env['FPFM_DISPLAY_CHANNEL'] = str(int(cfg['display_channel']))
+    # CMCUreader sampling rate / link speed
+    if 'sample_rate' in cfg:
+        env['FPFM_SAMPLE_RATE'] = str(float(cfg['sample_rate']))
+    if 'baud_rate' in cfg:
+        env['FPFM_BAUD_RATE'] = str(int(cfg['baud_rate']))
+    if 'sampler' in cfg:
+        env['FPFM_SAMPLER'] = str(cfg['sampler'])
+    # data socket transport between CMCUreader and run.py
+    if 'transport' in cfg:
+        env['FPFM_TRANSPORT'] = str(cfg['transport'])
+    if 'socket_path' in cfg and cfg['socket_path']:
+        env['FPFM_SOCKET_PATH'] = str(cfg['socket_path'])
+    # shared-memory sample ring (one name per launch)
+    if cfg.get('shm_ring'):
+        env['FPFM_SHM_NAME'] = f"fpfm_{os.getpid()}"
+    # CMCUreader streaming recorder
+    if 'stream_rows' in cfg:
+        env['FPFM_STREAM_ROWS'] = str(int(cfg['stream_rows']))
+    if 'fsync_policy' in cfg:
+        env['FPFM_FSYNC'] = str(cfg['fsync_policy'])
     # run.py window size (WxH)
     if 'screen_size' in cfg and isinstance(cfg['screen_size'], (list, tuple)) and len(cfg['screen_size']) == 2:
         try:
@@ -141,6 +179,11 @@ def build_env_from_config(cfg: dict) -> dict:
             env['FPFM_SCREEN_SIZE'] = f"{w}x{h}"
         except Exception:
             pass
+    # run.py force-feedback duration per trial (seconds)
+    if 'trial_duration' in cfg:
+        env['FPFM_TRIAL_DURATION'] = str(float(cfg['trial_duration']))
+    if 'tracking' in cfg:
+        env['FPFM_TRACKING'] = '1' if bool(cfg['tracking']) else '0'
     # UserCenter runtime parameters
     if 'max_force' in cfg:
         env['FPFM_MAX_FORCE'] = str(int(cfg['max_force']))
@@ -148,6 +191,8 @@ def build_env_from_config(cfg: dict) -> dict:
         env['FPFM_TOP_FORCE'] = str(int(cfg['top_force']))
     if 'trigger_com' in cfg and cfg['trigger_com']:
         env['FPFM_TRIGGER_COM'] = str(cfg['trigger_com'])
+    if cfg.get('target_seed') not in (None, ''):
+        env['FPFM_TARGET_SEED'] = str(int(cfg['target_seed']))
     if 'synchronized_with_eeg' in cfg:
         env['FPFM_SYNC_EEG'] = '1' if bool(cfg['synchronized_with_eeg']) else '0'
 
@@ -201,7 +246,8 @@ def main():
         print(f"[Launcher] Failed to start CMCUreader: {e}")
         sys.exit(1)
 
-    # Small delay to let server bind the port. Do NOT connect here to avoid consuming the single accept().
+    # Small delay to let server bind the port. The server accepts any number of subscribers, but the
+    # first connection starts the recording, so do not probe it here.
     time.sleep(1.0)
 
     # 2) Start PsychoPy task
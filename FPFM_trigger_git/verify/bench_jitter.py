@@ -0,0 +1,203 @@
+# 采样抖动对比：轮询线程与保存/网络共用一个进程（thread） vs 独立采样子进程（process）
+"""
+Sampling jitter of the recorder's two sampler modes (Linux/macOS, no hardware needed).
+
+For each mode (``FPFM_SAMPLER=thread`` / ``process``) the real
+``CMCUreader.py`` polls a ``SensorSimulator`` on a pty while this process
+loads it the way a session does, only harder: several subscribers read
+the stream and fire triggers at it, and the samples are streamed to disk
+in small, fsync'ed chunks.  Jitter is read back from the saved file:
+
+* ``lateness_us``  poll start after its deadline (the recorder's own column)
+* ``interval_us``  deviation of consecutive ``sample_time_ns`` from the period
+* ``missed``       deadlines skipped because the poller overran a whole period
+
+Usage::
+
+    python bench_jitter.py --rate 200 --duration 20 --subscribers 4 --out jitter.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+import numpy as np
+from scipy.io import loadmat
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'functions')
+sys.path.insert(0, FUNCTIONS_DIR)
+
+from simulators import SensorSimulator, waveform  # noqa: E402
+import protocol  # noqa: E402
+
+CMCU_SCRIPT = os.path.join(FUNCTIONS_DIR, 'CMCUreader.py')
+CONNECT_TIMEOUT_S = 10.0
+PERCENTILES = (50, 95, 99, 99.9)
+
+
+def _summary(values_us):
+    if not len(values_us):
+        return None
+    v = np.asarray(values_us, dtype=np.float64)
+    out = {f'p{p:g}': round(float(np.percentile(v, p)), 1) for p in PERCENTILES}
+    out['mean'] = round(float(v.mean()), 1)
+    out['std'] = round(float(v.std()), 1)
+    out['max'] = round(float(v.max()), 1)
+    return out
+
+
+def _connect(deadline):
+    while True:
+        try:
+            return protocol.connect_socket()
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def _subscriber(sock, stop, trigger_hz):
+    """Drain the stream and, with ``trigger_hz``, send triggers at that rate."""
+    reader = protocol.FrameReader(sock)
+    writer = protocol.FrameWriter(sock)
+    sock.settimeout(0.01)
+    seq = 0
+    next_t = time.perf_counter()
+    while not stop.is_set():
+        try:
+            if not reader.fill():
+                break
+            while reader.next_frame() is not None:
+                pass
+        except socket.timeout:
+            pass
+        except OSError:
+            break
+        if trigger_hz and time.perf_counter() >= next_t:
+            try:
+                writer.send_trigger(seq, time.perf_counter_ns(), 1 + seq % 4)
+            except OSError:
+                break
+            seq += 1
+            next_t += 1.0 / trigger_hz
+
+
+def run_mode(mode, args, workdir):
+    sensor = SensorSimulator(waveform('sine', 0, 600, 1.0), args.delay_ms / 1000.0, args.jitter_ms / 1000.0,
+                             seed=1)
+    sensor.start()
+    mat_dir = os.path.join(workdir, mode)
+    env = dict(os.environ,
+               FPFM_SAMPLER=mode,
+               FPFM_SERIAL_PORT=sensor.port,
+               FPFM_BAUD_RATE=str(args.baud),
+               FPFM_SAMPLE_RATE=str(args.rate),
+               FPFM_MAT_DIR=mat_dir,
+               FPFM_CTRL_PORT=str(args.ctrl_port),
+               FPFM_STREAM_ROWS=str(args.stream_rows),
+               FPFM_FSYNC='always')
+    env.pop('FPFM_SENSORS', None)
+    env.pop('FPFM_SHM_NAME', None)
+    log_path = os.path.join(workdir, f'cmcu_{mode}.log')
+    with open(log_path, 'w') as log:
+        child = subprocess.Popen([sys.executable, CMCU_SCRIPT, 'R', 'Jitter'], env=env, cwd=FUNCTIONS_DIR,
+                                 stdout=log, stderr=subprocess.STDOUT)
+    stop = threading.Event()
+    threads = []
+    try:
+        deadline = time.monotonic() + CONNECT_TIMEOUT_S
+        socks = [_connect(deadline)]
+        time.sleep(0.2)  # 第一个连接开始记录，其余为负载
+        socks += [_connect(deadline) for _ in range(args.subscribers)]
+        for i, sock in enumerate(socks):
+            t = threading.Thread(target=_subscriber, args=(sock, stop, args.trigger_hz if i else 0), daemon=True)
+            t.start()
+            threads.append(t)
+        time.sleep(args.duration)
+    finally:
+        try:
+            with socket.create_connection(('127.0.0.1', args.ctrl_port), timeout=1.0) as s:
+                s.sendall(b'STOP')
+        except OSError:
+            child.terminate()
+        try:
+            child.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            child.kill()
+            child.wait()
+        stop.set()
+        for t in threads:
+            t.join(timeout=1.0)
+        sensor.stop()
+
+    files = sorted(f for f in os.listdir(mat_dir) if f.endswith('.mat')) if os.path.isdir(mat_dir) else []
+    if not files:
+        raise RuntimeError(f"no data file for {mode}, see {log_path}")
+    mat = loadmat(os.path.join(mat_dir, files[-1]))
+    lateness = np.asarray(mat['lateness_us']).ravel()
+    t_ns = np.asarray(mat['sample_time_ns']).ravel().astype(np.int64)
+    period_us = 1e6 / args.rate
+    d_us = np.diff(t_ns) / 1e3
+    d_us = d_us[d_us < 1.5 * period_us]  # 跳过丢失/未应答的采样造成的间隔
+    return {
+        'mode': mode,
+        'rate_hz': args.rate,
+        'samples': int(t_ns.size),
+        'achieved_rate': float(np.asarray(mat['achieved_rate']).ravel()[0]) if 'achieved_rate' in mat else None,
+        'missed': int(np.sum(mat['missed_deadlines'])) if 'missed_deadlines' in mat else None,
+        'lateness_us': _summary(lateness),
+        'interval_us': _summary(np.abs(d_us - period_us)),
+        'triggers': int(np.asarray(mat['event_code']).size) if 'event_code' in mat else 0,
+        'child_exit': child.returncode,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='采样抖动对比：thread / process 采样模式')
+    parser.add_argument('--modes', nargs='+', default=['thread', 'process'], choices=('thread', 'process'))
+    parser.add_argument('--rate', type=float, default=200.0, help='poll rate (Hz)')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds per mode')
+    parser.add_argument('--subscribers', type=int, default=4, help='extra subscribers loading the recorder')
+    parser.add_argument('--trigger-hz', type=float, default=200.0, help='triggers per second per extra subscriber')
+    parser.add_argument('--stream-rows', type=int, default=20, help='samples per fsync\'ed chunk on disk')
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--delay-ms', type=float, default=1.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--ctrl-port', type=int, default=12355)
+    parser.add_argument('--out', help='JSON output path (default jitter_<time>.json)')
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='fpfm_jitter_') as workdir:
+        for mode in args.modes:
+            print(f"--- {mode} @ {args.rate:g} Hz ---")
+            r = run_mode(mode, args, workdir)
+            results.append(r)
+            late, iv = r['lateness_us'] or {}, r['interval_us'] or {}
+            print(f"lateness p50/p99/max {late.get('p50')}/{late.get('p99')}/{late.get('max')} us, "
+                  f"interval error p99/max {iv.get('p99')}/{iv.get('max')} us, missed {r['missed']}, "
+                  f"{r['samples']} samples, {r['triggers']} triggers")
+
+    report = {
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'settings': {k: v for k, v in vars(args).items() if k != 'out'},
+        'results': results,
+    }
+    out = args.out or f"jitter_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+# 端到端反馈延迟基准测试：虚拟传感器阶跃 -> CMCUreader -> socket/共享内存 -> 显示端
+"""
+End-to-end feedback latency benchmark (Linux/macOS, no hardware needed).
+
+For every transport and sampling rate, a ``SensorSimulator`` emits a square
+wave on a pty, the real ``CMCUreader.py`` runs as a child process polling
+it, and this process plays the part of run.py: a ``FingerForce`` client
+calls ``receive_sensor_value(prog)`` once per display frame and then
+flips.  Both processes stamp with ``perf_counter_ns`` (the system-wide
+monotonic clock), so each step edge can be followed to the first frame
+that shows it.
+
+Reported per configuration:
+
+* ``latency_ms``   edge -> first flip showing the new level
+* ``sensor_ms``    edge -> first sensor reply carrying it (poll phase + device delay)
+* ``pipeline_ms``  that reply -> the flip (recorder, transport, display)
+* ``dropped_rate`` samples the recorder produced that never reached the client
+* ``stale_rate``   frames that drew a sample already superseded at the sensor
+* ``missed_edges`` edges that never showed before the next one
+
+Usage::
+
+    python bench_latency.py --transports tcp unix shm --rates 20 50 100 --out latency.json
+    python bench_latency.py --baseline latency_old.json
+"""
+import os
+import sys
+import time
+import json
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+
+import numpy as np
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'functions')
+sys.path.insert(0, FUNCTIONS_DIR)
+
+from simulators import SensorSimulator, waveform  # noqa: E402
+from pacing import DeadlineScheduler  # noqa: E402
+import protocol  # noqa: E402
+from UserCenter import FingerForce  # noqa: E402
+
+CMCU_SCRIPT = os.path.join(FUNCTIONS_DIR, 'CMCUreader.py')
+LOW, HIGH = 100, 500       # 方波的两个力值
+WARMUP_S = 1.0             # 忽略开始阶段的边沿
+CONNECT_TIMEOUT_S = 10.0
+PERCENTILES = (50, 95, 99)
+
+
+class _Progress:
+    """Stand-in for ``visual.Progress`` when no window is used."""
+
+    def __init__(self):
+        self.value = 0
+
+    def setProgress(self, value, log=False):
+        self.value = value
+
+
+def _summary(values_ns):
+    if not values_ns:
+        return None
+    ms = np.asarray(values_ns, dtype=np.float64) / 1e6
+    out = {f'p{p}': round(float(np.percentile(ms, p)), 3) for p in PERCENTILES}
+    out['mean'] = round(float(ms.mean()), 3)
+    out['max'] = round(float(ms.max()), 3)
+    return out
+
+
+def _connect(transport, deadline):
+    while True:
+        try:
+            return FingerForce(is_socket=True)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"CMCUreader did not accept a {transport} connection")
+            time.sleep(0.1)
+
+
+def _stop_child(child, ctrl_port):
+    try:
+        with socket.create_connection(('127.0.0.1', ctrl_port), timeout=1.0) as s:
+            s.sendall(b'STOP')
+    except OSError:
+        pass
+    try:
+        child.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        child.kill()
+        child.wait()
+
+
+def run_config(transport, rate_hz, args, workdir):
+    """Run one transport/rate combination and return its result dict."""
+    replies = []   # (t_ns, value)，按序号顺序
+    period_ns = int(args.period * 1e9)
+    sensor = SensorSimulator(waveform('square', LOW, HIGH, args.period),
+                             args.delay_ms / 1000.0, args.jitter_ms / 1000.0, args.drop,
+                             seed=0, on_reply=lambda t, v: replies.append((t, v)))
+    sensor.start()
+
+    env = dict(os.environ)
+    env.update({
+        'FPFM_SERIAL_PORT': sensor.port,
+        'FPFM_BAUD_RATE': str(args.baud),
+        'FPFM_SAMPLE_RATE': str(rate_hz),
+        'FPFM_TRANSPORT': 'unix' if transport == 'unix' else 'tcp',
+        'FPFM_SOCKET_PATH': os.path.join(workdir, 'fpfm.sock'),
+        'FPFM_MAT_DIR': os.path.join(workdir, f'{transport}_{rate_hz:g}'),
+        'FPFM_CTRL_PORT': str(args.ctrl_port),
+        'FPFM_SHM_NAME': f'fpfm_bench_{os.getpid()}' if transport == 'shm' else '',
+        'FPFM_SYNC_EEG': '0',
+    })
+    # 本进程扮演 run.py，使用同样的传输配置
+    protocol.TRANSPORT = env['FPFM_TRANSPORT']
+    protocol.SOCKET_PATH = env['FPFM_SOCKET_PATH']
+    os.environ['FPFM_SHM_NAME'] = env['FPFM_SHM_NAME']
+    os.environ['FPFM_SYNC_EEG'] = '0'
+
+    log_path = os.path.join(workdir, f'CMCUreader_{transport}_{rate_hz:g}.log')
+    with open(log_path, 'wb') as log:
+        child = subprocess.Popen([sys.executable, CMCU_SCRIPT, 'R', 'Bench'], env=env,
+                                 stdout=log, stderr=subprocess.STDOUT, cwd=workdir)
+    uc = None
+    frames = []    # (t_call_ns, t_flip_ns, seq, value)
+    try:
+        uc = _connect(transport, time.monotonic() + CONNECT_TIMEOUT_S)
+        prog = _Progress() if args.window is None else args.window[1]
+        frame_clock = DeadlineScheduler(args.refresh)
+        frame_clock.start()
+        t_end = time.perf_counter_ns() + int(args.duration * 1e9)
+        while time.perf_counter_ns() < t_end:
+            t_call = time.perf_counter_ns()
+            uc.receive_sensor_value(prog, bmax=1)
+            if args.window is None:
+                frame_clock.wait()          # 模拟垂直同步
+            else:
+                args.window[0].flip()
+            frames.append((t_call, time.perf_counter_ns(), uc.sensor_seq, uc.sensor_value))
+        frame_clock.stop()
+        # 收到的采样数与最新序号之比给出丢失率（共享内存模式下所有采样都在环中）
+        if uc.ring is None:
+            received, newest = uc.receiver.received, uc.receiver.latest
+        else:
+            received, newest = uc.ring.head, uc.ring.latest()
+        expected = newest[0] + 1 if newest is not None else 0
+    finally:
+        if uc is not None:
+            # 先停掉会写 socket 的线程，再关闭连接（否则它们继续运行到下一个配置）
+            uc.clock.stop()
+            uc.clock.join(timeout=1.0)
+            uc.dispatcher.stop()
+            uc.dispatcher.join(timeout=1.0)
+            uc.receiver.stop()
+            uc.receiver.join(timeout=1.0)
+            uc.socket.close()
+            if uc.ring is not None:
+                uc.ring.close()
+        _stop_child(child, args.ctrl_port)
+        sensor.stop()
+
+    if not frames or not replies:
+        raise RuntimeError(f"no data for {transport} @ {rate_hz:g} Hz, see {log_path}")
+
+    # 阶跃边沿 k 发生在 t0 + k * period/2，之后的电平为 HIGH(k 奇数) / LOW(k 偶数)
+    reply_t = np.array([t for t, _ in replies], dtype=np.int64)
+    reply_v = np.array([v for _, v in replies], dtype=np.int64)
+    f_call = np.array([f[0] for f in frames], dtype=np.int64)
+    f_flip = np.array([f[1] for f in frames], dtype=np.int64)
+    f_seq = np.array([f[2] for f in frames], dtype=np.int64)
+    f_val = np.array([f[3] for f in frames], dtype=np.int64)
+    half = period_ns // 2
+    first = int((f_flip[0] - sensor.t0_ns + WARMUP_S * 1e9) // half) + 1
+    last = int((f_flip[-1] - sensor.t0_ns) // half) - 1
+    latency, sensor_part, pipeline_part = [], [], []
+    missed = 0
+    for k in range(first, last):
+        t_edge = sensor.t0_ns + k * half
+        t_next = t_edge + half
+        level = HIGH if k % 2 else LOW
+        r = np.flatnonzero((reply_t >= t_edge) & (reply_t < t_next) & (reply_v == level))
+        f = np.flatnonzero((f_flip >= t_edge) & (f_flip < t_next) & (f_val == level))
+        if r.size == 0 or f.size == 0:
+            missed += 1
+            continue
+        t_sample, t_show = reply_t[r[0]], f_flip[f[0]]
+        latency.append(t_show - t_edge)
+        sensor_part.append(t_sample - t_edge)
+        pipeline_part.append(t_show - t_sample)
+
+    # 陈旧帧：读取时传感器已经给出了比所显示序号更新的采样
+    produced = np.searchsorted(reply_t, f_call, side='right')  # 读取时已应答的采样数
+    shown = f_seq >= 0
+    stale = int(np.count_nonzero(shown & (produced - 1 > f_seq)))
+    return {
+        'transport': transport,
+        'rate_hz': rate_hz,
+        'edges': len(latency),
+        'missed_edges': missed,
+        'latency_ms': _summary(latency),
+        'sensor_ms': _summary(sensor_part),
+        'pipeline_ms': _summary(pipeline_part),
+        'samples': expected,
+        'dropped_rate': round(max(0, expected - received) / max(1, expected), 4),
+        'stale_rate': round(stale / max(1, int(np.count_nonzero(shown))), 4),
+        'frames': len(frames),
+        'sensor_dropped': sensor.dropped,
+        'child_exit': child.returncode,
+    }
+
+
+def _compare(results, baseline_path):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(r['transport'], r['rate_hz']): r for r in json.load(f)['results']}
+    print(f"\nCompared with {baseline_path}:")
+    for r in results:
+        old = baseline.get((r['transport'], r['rate_hz']))
+        if old is None or not old.get('latency_ms') or not r['latency_ms']:
+            continue
+        deltas = ', '.join(f"p{p} {r['latency_ms'][f'p{p}'] - old['latency_ms'][f'p{p}']:+.2f} ms"
+                           for p in PERCENTILES)
+        print(f"  {r['transport']:>4} {r['rate_hz']:>5g} Hz: {deltas}")
+
+
+def _open_window(refresh):
+    from psychopy import visual
+    win = visual.Window(size=(800, 600), fullscr=False, units='norm', waitBlanking=True)
+    prog = visual.Progress(win, progress=0, size=(0.2, 1.0), pos=(0, -0.5), anchor='bottom',
+                           barColor='blue', backColor=None, borderColor='white')
+    prog.setAutoDraw(True)
+    return win, prog
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='端到端反馈延迟基准测试')
+    parser.add_argument('--transports', nargs='+', default=['tcp', 'unix', 'shm'],
+                        choices=('tcp', 'unix', 'shm'))
+    parser.add_argument('--rates', nargs='+', type=float, default=[20, 50, 100])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per configuration')
+    # 周期不是采样/刷新周期的整数倍，阶跃边沿才会落在各个相位上
+    parser.add_argument('--period', type=float, default=0.413, help='square wave period (s)')
+    parser.add_argument('--refresh', type=float, default=60.0, help='display refresh rate (Hz)')
+    parser.add_argument('--baud', type=int, default=115200, help='baud rate passed to the recorder')
+    parser.add_argument('--delay-ms', type=float, default=2.0, help='simulated sensor response delay')
+    parser.add_argument('--jitter-ms', type=float, default=0.5)
+    parser.add_argument('--drop', type=float, default=0.0)
+    parser.add_argument('--ctrl-port', type=int, default=12356)
+    parser.add_argument('--window', action='store_true', help='draw and flip a real PsychoPy window')
+    parser.add_argument('--out', help='JSON output path (default latency_<time>.json)')
+    parser.add_argument('--baseline', help='earlier JSON result to compare against')
+    args = parser.parse_args(argv)
+    args.window = _open_window(args.refresh) if args.window else None
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='fpfm_bench_') as workdir:
+        for transport in args.transports:
+            if transport == 'unix' and not hasattr(socket, 'AF_UNIX'):
+                print("Skipping unix: not supported on this platform")
+                continue
+            for rate in args.rates:
+                print(f"--- {transport} @ {rate:g} Hz ---")
+                r = run_config(transport, rate, args, workdir)
+                results.append(r)
+                lat = r['latency_ms'] or {}
+                print(f"latency p50/p95/p99 {lat.get('p50')}/{lat.get('p95')}/{lat.get('p99')} ms, "
+                      f"dropped {r['dropped_rate']:.2%}, stale {r['stale_rate']:.2%}, "
+                      f"missed edges {r['missed_edges']}/{r['edges'] + r['missed_edges']}")
+    if args.window is not None:
+        args.window[0].close()
+
+    report = {
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'settings': {k: v for k, v in vars(args).items() if k not in ('window', 'out', 'baseline')},
+        'display': 'psychopy' if args.window is not None else 'simulated',
+        'results': results,
+    }
+    out = args.out or f"latency_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {out}")
+    if args.baseline:
+        _compare(results, args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
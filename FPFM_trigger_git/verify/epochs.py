@@ -0,0 +1,249 @@
+# 按 trigger 分段的力数据分析：向量化切分所有 trial，逐条件统计
+"""
+Trigger-locked epochs and per-condition force statistics of one recording.
+
+The recording (``.mat``, or a ``.fpc`` still being written) is read once;
+trial onsets are the samples where ``trigger_data`` changes to a
+condition code (``np.flatnonzero(np.diff(...))``) and a trial lasts until
+the next change.  All trials are cut into one NaN-padded
+``(trials, pre + post)`` array with a single fancy-indexing step, and
+every statistic is a reduction along its rows:
+
+* ``peak``          largest force in the trial
+* ``plateau_mean``  mean force over the ``--plateau`` fraction of the trial
+* ``cv``            plateau standard deviation / plateau mean
+* ``rise_s``        10 % -> 90 % of the rise from the pre-onset baseline to the peak
+
+Usage::
+
+    python epochs.py ../mat_data/FinForR_20251023-1.mat
+    python epochs.py FinForR_20251023-1.mat --pre 1 --plateau 0.25 0.75 --json out.json --plot
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import warnings
+
+import numpy as np
+from scipy.io import loadmat
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'functions')
+sys.path.insert(0, FUNCTIONS_DIR)
+
+import chunkfile  # noqa: E402
+
+# 触发码 -> 条件名（run.py 中 trigger = Fid + 1）
+EVENT_TYPES = {4: "Full", 3: "80%", 2: "40%", 1: "20%"}
+RISE_LOW, RISE_HIGH = 0.1, 0.9
+Y_LIMIT = (0, 400)
+
+
+def load_recording(path, channel=0):
+    """Return ``(force, trigger, rate_hz)``; samples a channel missed are NaN."""
+    if path.endswith('.fpc'):
+        data, torn = chunkfile.load(path)
+        if torn:
+            print(f"{path}: ignored {torn} bytes of torn tail")
+    else:
+        data = loadmat(path)
+    force = np.asarray(data['sensor_data'], dtype=np.float64)
+    t_ns = np.asarray(data['sample_time_ns'], dtype=np.int64) if 'sample_time_ns' in data else None
+    if force.ndim == 2 and min(force.shape) > 1:
+        # 多传感器：(采样数, 通道数)，未应答的通道时间戳为 0
+        force = force[:, channel]
+        if t_ns is not None:
+            t_ns = t_ns[:, channel]
+            force[t_ns == 0] = np.nan
+    force = force.ravel()
+    trigger = np.asarray(data['trigger_data']).ravel().astype(np.int64)
+    if 'sample_rate' in data:
+        rate = float(np.asarray(data['sample_rate']).ravel()[0])
+    elif t_ns is not None and len(t_ns) > 1:
+        rate = 1e9 / float(np.median(np.diff(t_ns.ravel()[t_ns.ravel() > 0])))
+    else:
+        rate = 1.0 / float(np.median(np.diff(np.asarray(data['timestamps']).ravel())))
+    return force, trigger, rate
+
+
+def find_trials(trigger, codes=EVENT_TYPES):
+    """Return ``(onsets, ends, codes)`` of every segment whose trigger is one of ``codes``."""
+    change = np.flatnonzero(np.diff(trigger)) + 1
+    bounds = np.concatenate([change, [len(trigger)]])
+    onsets, ends = bounds[:-1], bounds[1:]
+    trial_codes = trigger[onsets]
+    keep = np.isin(trial_codes, list(codes))
+    return onsets[keep], ends[keep], trial_codes[keep]
+
+
+def cut_epochs(force, onsets, ends, pre, post=None):
+    """All trials as one NaN-padded ``(trials, pre + post)`` array (``post`` defaults to the longest trial).
+
+    Column ``pre`` is the onset; samples before the recording, after it or
+    past the trial's own end are NaN.
+    """
+    lengths = ends - onsets
+    if post is None:
+        post = int(lengths.max()) if len(lengths) else 0
+    rel = np.arange(-pre, post)
+    idx = onsets[:, None] + rel[None, :]
+    valid = (idx >= 0) & (idx < len(force)) & (rel[None, :] < lengths[:, None])
+    epochs = np.where(valid, force[np.clip(idx, 0, len(force) - 1)], np.nan)
+    return epochs, rel
+
+
+def trial_stats(epochs, rel, lengths, rate, plateau=(0.25, 0.75)):
+    """Per-trial peak, plateau mean, CV and rise time, reduced along the epoch rows."""
+    n = len(epochs)
+    if not n:
+        return {k: np.zeros(0) for k in ('baseline', 'peak', 'peak_s', 'plateau_mean', 'cv', 'rise_s')}
+    after = rel[None, :] >= 0
+    trial = np.where(after, epochs, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # 空 trial / 空基线窗口的 nanmean
+        pre = np.where(~after, epochs, np.nan)
+        baseline = np.nanmean(pre, axis=1) if (rel < 0).any() else np.zeros(n)
+        baseline = np.where(np.isnan(baseline), 0.0, baseline)
+        filled = np.where(np.isnan(trial), -np.inf, trial)
+        i_peak = np.argmax(filled, axis=1)
+        peak = filled[np.arange(n), i_peak]
+        peak = np.where(np.isfinite(peak), peak, np.nan)
+        # 平台期：每个 trial 自身时长的 plateau[0]..plateau[1] 部分
+        lo = (plateau[0] * lengths)[:, None]
+        hi = (plateau[1] * lengths)[:, None]
+        in_plateau = (rel[None, :] >= lo) & (rel[None, :] < hi)
+        plat = np.where(in_plateau, epochs, np.nan)
+        plateau_mean = np.nanmean(plat, axis=1)
+        cv = np.nanstd(plat, axis=1) / plateau_mean
+        # 上升时间：首次超过 基线 + 10% / 90% 升幅 的采样（峰值之前）
+        rise = (peak - baseline)[:, None]
+        before_peak = rel[None, :] <= rel[i_peak][:, None]
+        low = after & before_peak & (trial >= baseline[:, None] + RISE_LOW * rise)
+        high = after & before_peak & (trial >= baseline[:, None] + RISE_HIGH * rise)
+        ok = low.any(axis=1) & high.any(axis=1) & (rise[:, 0] > 0)
+        rise_s = np.where(ok, (np.argmax(high, axis=1) - np.argmax(low, axis=1)) / rate, np.nan)
+    return {
+        'baseline': baseline,
+        'peak': peak,
+        'peak_s': rel[i_peak] / rate,
+        'plateau_mean': plateau_mean,
+        'cv': cv,
+        'rise_s': rise_s,
+    }
+
+
+def condition_summary(stats, codes, names=EVENT_TYPES):
+    """Mean and SD of every statistic per condition, in ``names`` order."""
+    out = {}
+    for code, name in names.items():
+        sel = codes == code
+        if not sel.any():
+            continue
+        entry = {'code': int(code), 'trials': int(sel.sum())}
+        for key, values in stats.items():
+            v = values[sel]
+            v = v[~np.isnan(v)]
+            entry[key] = round(float(v.mean()), 4) if len(v) else None
+            entry[key + '_sd'] = round(float(v.std()), 4) if len(v) else None
+        out[name] = entry
+    return out
+
+
+def analyze(path, pre_s=1.0, post_s=None, plateau=(0.25, 0.75), channel=0):
+    """Load ``path`` and return ``(result, epochs, rel, codes, rate)``."""
+    force, trigger, rate = load_recording(path, channel)
+    t0 = time.perf_counter()
+    onsets, ends, codes = find_trials(trigger)
+    if not len(onsets):
+        # 例如 trigger 未接入时整列为 -1：明确提示，而不是只输出一张空表
+        found = ', '.join(str(v) for v in np.unique(trigger)[:10]) or 'none'
+        print(f"WARNING: {path}: no trigger onsets with codes {sorted(EVENT_TYPES)} found "
+              f"(trigger_data values: {found}); nothing to analyse")
+    pre = int(round(pre_s * rate))
+    post = None if post_s is None else int(round(post_s * rate))
+    epochs, rel = cut_epochs(force, onsets, ends, pre, post)
+    lengths = np.minimum(ends - onsets, rel[-1] + 1 if len(rel) else 0)
+    stats = trial_stats(epochs, rel, lengths, rate, plateau)
+    result = {
+        'file': os.path.abspath(path),
+        'sample_rate': rate,
+        'samples': int(len(force)),
+        'trials': int(len(onsets)),
+        'conditions': condition_summary(stats, codes),
+        'per_trial': {
+            'onset_sample': onsets.tolist(),
+            'code': codes.tolist(),
+            'duration_s': ((ends - onsets) / rate).round(4).tolist(),
+            **{k: [None if np.isnan(x) else round(float(x), 4) for x in v] for k, v in stats.items()},
+        },
+        'analysis_ms': round((time.perf_counter() - t0) * 1e3, 3),
+    }
+    return result, epochs, rel, codes, rate
+
+
+def plot(epochs, rel, codes, rate, out=None):
+    try:
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed, skipping the plot")
+        return
+    fig, ax = plt.subplots(figsize=(8, 6))
+    t = rel / rate
+    for code, name in EVENT_TYPES.items():
+        sel = epochs[codes == code]
+        if not len(sel):
+            continue
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean, sd = np.nanmean(sel, axis=0), np.nanstd(sel, axis=0)
+        line, = ax.plot(t, mean, label=f"{name} (n={len(sel)})")
+        ax.fill_between(t, mean - sd, mean + sd, color=line.get_color(), alpha=0.2)
+    ax.axvline(0, color='k', lw=0.8)
+    ax.set_ylim(*Y_LIMIT)
+    ax.set_xlabel('Time from trigger (s)')
+    ax.set_ylabel('Pressure')
+    ax.legend()
+    if out:
+        fig.savefig(out, dpi=150)
+        print(f"Wrote {out}")
+    else:
+        plt.show()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='按 trigger 分段统计力数据（峰值、平台均值、CV、上升时间）')
+    parser.add_argument('path', help='.mat recording (or .fpc being written)')
+    parser.add_argument('--pre', type=float, default=1.0, help='seconds before each onset (baseline)')
+    parser.add_argument('--post', type=float, help='seconds after each onset (default: longest trial)')
+    parser.add_argument('--plateau', type=float, nargs=2, default=(0.25, 0.75), metavar=('START', 'END'),
+                        help='plateau as fractions of each trial\'s duration')
+    parser.add_argument('--channel', type=int, default=0, help='sensor channel of a multi-sensor recording')
+    parser.add_argument('--json', help='write the full result (with per-trial values) to this file')
+    parser.add_argument('--plot', nargs='?', const='', help='plot mean epochs per condition (to a file if given)')
+    args = parser.parse_args(argv)
+
+    result, epochs, rel, codes, rate = analyze(args.path, args.pre, args.post, tuple(args.plateau), args.channel)
+    if not result['trials']:
+        return 1
+    print(f"{result['trials']} trials, {result['samples']} samples at {rate:g} Hz, "
+          f"analysed in {result['analysis_ms']:.1f} ms")
+    print(f"{'condition':>9} {'n':>3} {'peak':>16} {'plateau':>16} {'cv':>14} {'rise (s)':>14}")
+    for name, c in result['conditions'].items():
+        def cell(key, width, fmt):
+            if c[key] is None:
+                return f"{'-':>{width}}"
+            return f"{format(c[key], fmt) + ' ± ' + format(c[key + '_sd'], fmt):>{width}}"
+        print(f"{name:>9} {c['trials']:>3} {cell('peak', 16, '.1f')} {cell('plateau_mean', 16, '.1f')} "
+              f"{cell('cv', 14, '.3f')} {cell('rise_s', 14, '.3f')}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"Wrote {args.json}")
+    if args.plot is not None:
+        plot(epochs, rel, codes, rate, args.plot or None)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())